@@ -7,14 +7,26 @@
 # ----------------------------------------------------------------------------
 
 from ._alpha import (alpha, alpha_phylogenetic, alpha_group_significance,
-                     alpha_correlation, alpha_rarefaction)
+                     alpha_correlation, alpha_rarefaction,
+                     alpha_rarefaction_iterations, core_alpha_metrics,
+                     alpha_multiple)
 from ._beta import (beta, beta_phylogenetic, bioenv,
                     beta_group_significance, mantel, beta_rarefaction,
-                    beta_correlation, adonis)
-from ._ordination import pcoa, pcoa_biplot, tsne, umap
+                    beta_correlation, adonis, beta_rarefaction_iterations,
+                    extend_distance_matrix, beta_phylogenetic_multiple,
+                    beta_multiple, beta_tiled, beta_sparse,
+                    beta_approximate, nearest_neighbors, beta_cross,
+                    beta_phylogenetic_cross, beta_shard,
+                    beta_phylogenetic_shard, merge_distance_blocks)
+from ._ordination import pcoa, pcoa_biplot, pcoa_project, tsne, umap
 from ._procrustes import procrustes_analysis, partial_procrustes
-from ._core_metrics import core_metrics_phylogenetic, core_metrics
-from ._filter import filter_distance_matrix, filter_alpha_diversity
+from ._core_metrics import (core_metrics_phylogenetic, core_metrics,
+                            core_metrics_selected,
+                            core_metrics_multiple_depths,
+                            core_metrics_incremental)
+from ._filter import (filter_distance_matrix, filter_alpha_diversity,
+                      partition_distance_matrix,
+                      filter_alpha_diversity_multiple)
 from ._version import get_versions
 
 __version__ = get_versions()['version']
@@ -27,5 +39,14 @@ __all__ = ['beta', 'beta_phylogenetic', 'alpha', 'alpha_phylogenetic',
            'core_metrics_phylogenetic', 'core_metrics',
            'filter_alpha_diversity', 'filter_distance_matrix',
            'alpha_rarefaction', 'beta_rarefaction', 'procrustes_analysis',
-           'beta_correlation', 'adonis', 'partial_procrustes', 'mantel'
+           'beta_correlation', 'adonis', 'partial_procrustes', 'mantel',
+           'alpha_rarefaction_iterations', 'beta_rarefaction_iterations',
+           'core_alpha_metrics', 'core_metrics_selected',
+           'core_metrics_multiple_depths', 'core_metrics_incremental',
+           'extend_distance_matrix', 'pcoa_project',
+           'beta_phylogenetic_multiple', 'alpha_multiple', 'beta_multiple',
+           'beta_tiled', 'beta_sparse', 'beta_approximate',
+           'nearest_neighbors', 'beta_cross', 'beta_phylogenetic_cross',
+           'beta_shard', 'beta_phylogenetic_shard', 'merge_distance_blocks',
+           'partition_distance_matrix', 'filter_alpha_diversity_multiple'
            ]
@@ -8,7 +8,9 @@
 
 from q2_diversity_lib.alpha import METRICS
 
-from ._pipeline import alpha, alpha_phylogenetic
+from ._pipeline import (alpha, alpha_phylogenetic,
+                        alpha_rarefaction_iterations)
+from ._method import core_alpha_metrics, alpha_multiple
 from ._visualizer import (alpha_group_significance, alpha_correlation,
                           alpha_rarefaction,
                           alpha_rarefaction_unsupported_metrics)
@@ -17,5 +19,6 @@ from ._visualizer import (alpha_group_significance, alpha_correlation,
 __all__ = [
     'alpha', 'alpha_phylogenetic', 'alpha_group_significance',
     'alpha_correlation', 'alpha_rarefaction', 'METRICS',
-    'alpha_rarefaction_unsupported_metrics',
+    'alpha_rarefaction_unsupported_metrics', 'alpha_rarefaction_iterations',
+    'core_alpha_metrics', 'alpha_multiple',
 ]
@@ -0,0 +1,300 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+
+import biom
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import scipy.special
+import skbio
+
+from . import METRICS
+
+
+# largest number of (sample, tree node) pairs evaluated at once by faith_pd
+_FAITH_PD_BLOCK_SIZE = 2 ** 24
+
+
+def _sample_major(table):
+    # samples x features, with explicit zeros removed so that the stored
+    # entries of each row are exactly the observed features of that sample
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    counts.eliminate_zeros()
+    return counts
+
+
+def _row_sums(counts, values):
+    # sum `values` (aligned with `counts.data`) over each row of `counts`
+    rows = scipy.sparse.csr_matrix((values, counts.indices, counts.indptr),
+                                   shape=counts.shape)
+    return np.asarray(rows.sum(axis=1)).ravel()
+
+
+def _row_max(counts):
+    return counts.max(axis=1).toarray().ravel()
+
+
+# Per-sample quantities shared by the vectorized metrics. `proportions` and
+# the other per-entry arrays are aligned with `counts.data`.
+_AlphaStats = collections.namedtuple(
+    '_AlphaStats', ['counts', 'observed', 'totals', 'proportions'])
+
+
+def _alpha_stats(table):
+    counts = _sample_major(table)
+    observed = np.diff(counts.indptr).astype(np.int64)
+    totals = _row_sums(counts, counts.data)
+    proportions = counts.data / np.repeat(totals, observed)
+    return _AlphaStats(counts, observed, totals, proportions)
+
+
+def _undefined(values, mask):
+    values = np.asarray(values, dtype=float)
+    values[mask] = np.nan
+    return values
+
+
+def _observed_features(stats):
+    return stats.observed
+
+
+def _shannon(stats):
+    p = stats.proportions
+    # Shannon's entropy is undefined for samples without any counts.
+    return _undefined(_row_sums(stats.counts, -p * np.log2(p)),
+                      stats.observed == 0)
+
+
+def _pielou_e(stats):
+    # Pielou's evenness is Shannon's entropy normalized by its maximum for the
+    # observed richness; the logarithm base cancels out. It is undefined for
+    # samples with fewer than two observed features.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _undefined(_shannon(stats) / np.log2(stats.observed),
+                          stats.observed < 2)
+
+
+def _dominance(stats):
+    return _row_sums(stats.counts, stats.proportions ** 2)
+
+
+def _simpson(stats):
+    return 1 - _dominance(stats)
+
+
+def _enspie(stats):
+    return 1 / _dominance(stats)
+
+
+def _simpson_e(stats):
+    return _enspie(stats) / stats.observed
+
+
+def _berger_parker_d(stats):
+    return _row_max(stats.counts) / stats.totals
+
+
+def _singles(stats):
+    return _row_sums(stats.counts, stats.counts.data == 1).astype(np.int64)
+
+
+def _doubles(stats):
+    return _row_sums(stats.counts, stats.counts.data == 2).astype(np.int64)
+
+
+def _chao1(stats):
+    singles = _singles(stats)
+    doubles = _doubles(stats)
+    return stats.observed + singles * (singles - 1) / (2 * (doubles + 1))
+
+
+def _goods_coverage(stats):
+    return 1 - _singles(stats) / stats.totals
+
+
+def _margalef(stats):
+    return (stats.observed - 1) / np.log(stats.totals)
+
+
+def _menhinick(stats):
+    return stats.observed / np.sqrt(stats.totals)
+
+
+def _mcintosh_d(stats):
+    u = np.sqrt(_row_sums(stats.counts, stats.counts.data ** 2))
+    n = stats.totals
+    return (n - u) / (n - np.sqrt(n))
+
+
+def _mcintosh_e(stats):
+    u = np.sqrt(_row_sums(stats.counts, stats.counts.data ** 2))
+    n, s = stats.totals, stats.observed
+    return u / np.sqrt((n - s + 1) ** 2 + s - 1)
+
+
+def _robbins(stats):
+    return _singles(stats) / stats.totals
+
+
+def _heip_e(stats):
+    shannon = _shannon(stats) * np.log(2)
+    return (np.exp(shannon) - 1) / (stats.observed - 1)
+
+
+def _brillouin_d(stats):
+    n = stats.totals
+    return (scipy.special.gammaln(n + 1) -
+            _row_sums(stats.counts,
+                      scipy.special.gammaln(stats.counts.data + 1))) / n
+
+
+# Metrics that are computed directly from the sparse table. Any other
+# non-phylogenetic metric is computed per sample by scikit-bio.
+_VECTORIZED_METRICS = {
+    'observed_features': _observed_features,
+    'shannon': _shannon,
+    'pielou_e': _pielou_e,
+    'dominance': _dominance,
+    'simpson': _simpson,
+    'enspie': _enspie,
+    'simpson_e': _simpson_e,
+    'berger_parker_d': _berger_parker_d,
+    'singles': _singles,
+    'doubles': _doubles,
+    'chao1': _chao1,
+    'goods_coverage': _goods_coverage,
+    'margalef': _margalef,
+    'menhinick': _menhinick,
+    'mcintosh_d': _mcintosh_d,
+    'mcintosh_e': _mcintosh_e,
+    'robbins': _robbins,
+    'heip_e': _heip_e,
+    'brillouin_d': _brillouin_d,
+}
+
+# keyword arguments scikit-bio needs to compute a metric as defined here
+_SKBIO_KWARGS = {'shannon': {'base': 2}}
+
+
+def _tip_ranges(phylogeny):
+    # Numbering the tips in postorder gives the tips descending from every
+    # node a contiguous range [start, end), so a branch is observed in a
+    # sample iff any tip in its range is. The root's branch isn't part of any
+    # path to a tip.
+    tip_positions = {}
+    starts, ends, lengths = [], [], []
+    ranges = {}
+    for node in phylogeny.postorder(include_self=True):
+        if node.is_tip():
+            start = len(tip_positions)
+            tip_positions[node.name] = start
+            ranges[id(node)] = (start, start + 1)
+        else:
+            ranges[id(node)] = (ranges[id(node.children[0])][0],
+                                ranges[id(node.children[-1])][1])
+        if not node.is_root():
+            start, end = ranges[id(node)]
+            starts.append(start)
+            ends.append(end)
+            lengths.append(node.length or 0.0)
+    return (tip_positions, np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64), np.array(lengths, dtype=float))
+
+
+def _tip_columns(features, tip_positions):
+    missing = [f for f in features if f not in tip_positions]
+    if missing:
+        raise ValueError('The table contains features that are not present '
+                         'in the phylogeny: %s' % ', '.join(sorted(missing)))
+    return np.array([tip_positions[f] for f in features], dtype=np.int64)
+
+
+def _faith_pd(counts, features, phylogeny):
+    tip_positions, starts, ends, lengths = _tip_ranges(phylogeny)
+    columns = _tip_columns(features, tip_positions)
+    presence = scipy.sparse.csr_matrix(
+        (np.ones_like(counts.data), columns[counts.indices], counts.indptr),
+        shape=(counts.shape[0], len(tip_positions)))
+
+    result = np.empty(counts.shape[0])
+    block = max(1, _FAITH_PD_BLOCK_SIZE // max(1, len(lengths)))
+    for i in range(0, counts.shape[0], block):
+        cumulative = np.zeros((min(block, counts.shape[0] - i),
+                               presence.shape[1] + 1))
+        np.cumsum(presence[i:i + block].toarray(), axis=1,
+                  out=cumulative[:, 1:])
+        observed = (cumulative[:, ends] - cumulative[:, starts]) > 0
+        result[i:i + block] = observed @ lengths
+    return result
+
+
+def core_alpha_metrics(table: biom.Table) -> (pd.Series, pd.Series,
+                                              pd.Series):
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    stats = _alpha_stats(table)
+    ids = table.ids(axis='sample')
+
+    return (pd.Series(_observed_features(stats), index=ids,
+                      name='observed_features'),
+            pd.Series(_shannon(stats), index=ids, name='shannon_entropy'),
+            pd.Series(_pielou_e(stats), index=ids, name='pielou_evenness'))
+
+
+def alpha_multiple(table: biom.Table, metrics: set,
+                   phylogeny: skbio.TreeNode = None) -> pd.Series:
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    phylo_metrics = METRICS['PHYLO']['IMPL'] | METRICS['PHYLO']['UNIMPL']
+    unsupported = set(metrics) & phylo_metrics - {'faith_pd'}
+    if unsupported:
+        raise ValueError('The following phylogenetic metrics are not '
+                         'supported: %s' % ', '.join(sorted(unsupported)))
+    if phylogeny is None and set(metrics) & phylo_metrics:
+        raise ValueError('A phylogenetic metric was requested, but a '
+                         'phylogenetic tree was not provided. Phylogeny must '
+                         'be provided when using a phylogenetic diversity '
+                         'metric.')
+
+    # the table is converted once, and every metric reads from it
+    stats = _alpha_stats(table)
+    ids = table.ids(axis='sample')
+    dense = None
+    # Samples with fewer than two observed features are where the metrics
+    # are degenerate, and where scikit-bio's handling of them has changed
+    # between its versions, so those samples are left to scikit-bio.
+    degenerate = stats.observed < 2
+
+    vectors = {}
+    for metric in sorted(metrics):
+        if metric == 'faith_pd':
+            values = _faith_pd(stats.counts, table.ids(axis='observation'),
+                               phylogeny)
+        elif metric in _VECTORIZED_METRICS:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = _VECTORIZED_METRICS[metric](stats)
+            if degenerate.any():
+                edge_values = skbio.diversity.alpha_diversity(
+                    metric, stats.counts[degenerate].astype(int).toarray(),
+                    validate=True, **_SKBIO_KWARGS.get(metric, {})).values
+                values = np.asarray(values).astype(
+                    np.result_type(values, edge_values))
+                values[degenerate] = edge_values
+        else:
+            if dense is None:
+                dense = stats.counts.astype(int).toarray()
+            values = skbio.diversity.alpha_diversity(
+                metric, dense, ids=ids, validate=True).values
+        name = METRICS['NAME_TRANSLATIONS'].get(metric, metric)
+        vectors[metric] = pd.Series(values, index=ids, name=name)
+
+    return vectors
@@ -6,7 +6,13 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import itertools
+
 from . import METRICS
+from .._rarefaction import _rarefaction_iteration_key
+from ._visualizer import (_get_rarefaction_metrics, _get_depth_range,
+                          _validate_previous_iterations,
+                          _compute_rarefaction_iterations)
 
 
 def alpha_phylogenetic(ctx, table, phylogeny, metric):
@@ -28,3 +34,31 @@ def alpha(ctx, table, metric):
         vector, = action(table=table, metric=metric)
 
     return vector
+
+
+def alpha_rarefaction_iterations(ctx, table, max_depth, phylogeny=None,
+                                 metrics=None, min_depth=1, steps=10,
+                                 iterations=10, previous_iterations=None):
+    metrics = _get_rarefaction_metrics(metrics, phylogeny)
+    depth_range = _get_depth_range(min_depth, max_depth, steps)
+
+    if previous_iterations is None:
+        previous_iterations = {}
+    else:
+        previous_iterations = dict(previous_iterations.items())
+        _validate_previous_iterations(previous_iterations, metrics,
+                                      depth_range)
+
+    vectors = _compute_rarefaction_iterations(
+        ctx, table, depth_range, iterations, phylogeny, metrics,
+        previous_iterations)
+
+    results = {}
+    for depth, i in itertools.product(depth_range, range(1, iterations + 1)):
+        for metric in sorted(metrics):
+            key = _rarefaction_iteration_key(metric, depth, i)
+            if key in vectors:
+                results[key] = vectors[key]
+            else:
+                results[key] = previous_iterations[key]
+    return results
@@ -23,6 +23,7 @@ import biom
 import itertools
 
 from . import METRICS
+from .._rarefaction import _rarefaction_depth_key, _rarefaction_iteration_key
 from q2_types.tree import NewickFormat
 
 TEMPLATES = pkg_resources.resource_filename('q2_diversity', '_alpha')
@@ -283,8 +284,86 @@ def _alpha_rarefaction_jsonp(output_dir, filename, metric, data, column):
         fh.write(");")
 
 
+def _get_rarefaction_metrics(metrics, phylogeny):
+    if metrics is None:
+        metrics = {'observed_features', 'shannon'}
+        if phylogeny is not None:
+            metrics.add('faith_pd')
+    elif not metrics:
+        raise ValueError('`metrics` was given an empty set.')
+    else:
+        phylo_overlap = ((METRICS['PHYLO']['IMPL'] |
+                          METRICS['PHYLO']['UNIMPL']) &
+                         metrics)
+        if phylo_overlap and phylogeny is None:
+            raise ValueError('Phylogenetic metric %s was requested but '
+                             'phylogeny was not provided.' % phylo_overlap)
+    return metrics
+
+
+def _get_depth_range(min_depth, max_depth, steps):
+    if max_depth <= min_depth:
+        raise ValueError('Provided max_depth of %d must be greater than '
+                         'provided min_depth of %d.' % (max_depth, min_depth))
+    possible_steps = max_depth - min_depth
+    if possible_steps < steps:
+        raise ValueError('Provided number of steps (%d) is greater than the '
+                         'steps possible between min_depth and '
+                         'max_depth (%d).' % (steps, possible_steps))
+    return np.linspace(min_depth, max_depth, num=steps, dtype=int)
+
+
+def _validate_previous_iterations(previous_iterations, metrics, depth_range):
+    # Iterations beyond the requested number are simply not used, but vectors
+    # computed for another metric or depth indicate mismatched inputs.
+    prefixes = {_rarefaction_depth_key(m, d)
+                for m, d in itertools.product(metrics, depth_range)}
+    unknown = {k for k in previous_iterations
+               if k.rsplit('_iter-', 1)[0] not in prefixes}
+    if unknown:
+        raise ValueError('The following previous iterations do not match '
+                         'any of the requested metrics and rarefaction '
+                         'depths: %s' % ', '.join(sorted(unknown)))
+
+
+def _compute_rarefaction_iterations(ctx, feature_table, depth_range,
+                                    iterations, phylogeny, metrics,
+                                    previous_iterations):
+    # Only the (metric, depth, iteration) combinations that are not already
+    # present in `previous_iterations` are computed. Returns a dict mapping
+    # iteration keys to the newly computed alpha diversity artifacts.
+    rarefy_method = ctx.get_action('feature_table', 'rarefy')
+    alpha_phylo = ctx.get_action('diversity', 'alpha_phylogenetic')
+    alpha = ctx.get_action('diversity', 'alpha')
+
+    vectors = {}
+    for depth, i in itertools.product(depth_range,
+                                      range(1, iterations + 1)):
+        missing = [m for m in metrics if _rarefaction_iteration_key(
+            m, depth, i) not in previous_iterations]
+        if not missing:
+            continue
+
+        rt, = rarefy_method(feature_table, depth)
+
+        for metric in missing:
+            if metric in (METRICS['PHYLO']['IMPL'] |
+                          METRICS['PHYLO']['UNIMPL']):
+                vector, = alpha_phylo(table=rt, metric=metric,
+                                      phylogeny=phylogeny)
+            else:
+                vector, = alpha(table=rt, metric=metric)
+
+            vectors[_rarefaction_iteration_key(metric, depth, i)] = vector
+    return vectors
+
+
 def _compute_rarefaction_data(feature_table, min_depth, max_depth, steps,
-                              iterations, phylogeny, metrics):
+                              iterations, phylogeny, metrics,
+                              previous_iterations=None):
+    if previous_iterations is None:
+        previous_iterations = {}
+
     depth_range = np.linspace(min_depth, max_depth, num=steps, dtype=int)
     iter_range = range(1, iterations + 1)
 
@@ -302,22 +381,17 @@ def _compute_rarefaction_data(feature_table, min_depth, max_depth, steps,
     if phylogeny:
         phylogeny = ctx.make_artifact('Phylogeny[Rooted]', phylogeny)
 
-    for depth, i in itertools.product(depth_range, iter_range):
-        rarefy_method = ctx.get_action('feature_table', 'rarefy')
-        rt, = rarefy_method(feature_table, depth)
+    vectors = _compute_rarefaction_iterations(
+        ctx, feature_table, depth_range, iterations, phylogeny, metrics,
+        previous_iterations)
 
+    for depth, i in itertools.product(depth_range, iter_range):
         for metric in metrics:
-            if metric in (METRICS['PHYLO']['IMPL'] |
-                          METRICS['PHYLO']['UNIMPL']):
-                alpha_phylo = ctx.get_action('diversity',
-                                             'alpha_phylogenetic')
-                vector, = alpha_phylo(table=rt, metric=metric,
-                                      phylogeny=phylogeny)
+            key = _rarefaction_iteration_key(metric, depth, i)
+            if key in vectors:
+                vector = vectors[key].view(pd.Series)
             else:
-                alpha = ctx.get_action('diversity', 'alpha')
-                vector, = alpha(table=rt, metric=metric)
-
-            vector = vector.view(pd.Series)
+                vector = previous_iterations[key]
             data[metric][(depth, i)] = vector
     return data
 
@@ -325,30 +399,15 @@ def _compute_rarefaction_data(feature_table, min_depth, max_depth, steps,
 def alpha_rarefaction(output_dir: str, table: biom.Table, max_depth: int,
                       phylogeny: NewickFormat = None, metrics: set = None,
                       metadata: qiime2.Metadata = None, min_depth: int = 1,
-                      steps: int = 10, iterations: int = 10) -> None:
-
-    if metrics is None:
-        metrics = {'observed_features', 'shannon'}
-        if phylogeny is not None:
-            metrics.add('faith_pd')
-    elif not metrics:
-        raise ValueError('`metrics` was given an empty set.')
-    else:
-        phylo_overlap = ((METRICS['PHYLO']['IMPL'] |
-                          METRICS['PHYLO']['UNIMPL']) &
-                         metrics)
-        if phylo_overlap and phylogeny is None:
-            raise ValueError('Phylogenetic metric %s was requested but '
-                             'phylogeny was not provided.' % phylo_overlap)
-
-    if max_depth <= min_depth:
-        raise ValueError('Provided max_depth of %d must be greater than '
-                         'provided min_depth of %d.' % (max_depth, min_depth))
-    possible_steps = max_depth - min_depth
-    if possible_steps < steps:
-        raise ValueError('Provided number of steps (%d) is greater than the '
-                         'steps possible between min_depth and '
-                         'max_depth (%d).' % (steps, possible_steps))
+                      steps: int = 10, iterations: int = 10,
+                      previous_iterations: pd.Series = None) -> None:
+    # previous_iterations is a collection: QIIME 2 passes it as a dict of
+    # iteration keys to vectors, each viewed as the annotated pd.Series
+    metrics = _get_rarefaction_metrics(metrics, phylogeny)
+    depth_range = _get_depth_range(min_depth, max_depth, steps)
+    if previous_iterations is not None:
+        _validate_previous_iterations(previous_iterations, metrics,
+                                      depth_range)
     if table.is_empty():
         raise ValueError('Provided table is empty.')
     max_frequency = max(table.sum(axis='sample'))
@@ -381,7 +440,8 @@ def alpha_rarefaction(output_dir: str, table: biom.Table, max_depth: int,
             names=('_alpha_rarefaction_depth_column_', 'iter'))
         columns = metadata_df.columns.get_level_values(0)
     data = _compute_rarefaction_data(table, min_depth, max_depth,
-                                     steps, iterations, phylogeny, metrics)
+                                     steps, iterations, phylogeny, metrics,
+                                     previous_iterations)
 
     filenames = []
     for m, data in data.items():
@@ -8,13 +8,28 @@
 
 from q2_diversity_lib.beta import METRICS
 
-from ._pipeline import beta_phylogenetic, beta
+from ._pipeline import (beta_phylogenetic, beta,
+                        beta_rarefaction_iterations,
+                        beta_phylogenetic_multiple)
 from ._visualizer import bioenv, beta_group_significance, mantel, adonis
 from ._beta_rarefaction import beta_rarefaction
 from ._beta_correlation import beta_correlation
+from ._sketch import beta_approximate, SKETCH_METRICS
+from ._cross import beta_cross, beta_phylogenetic_cross, CROSS_PHYLO_METRICS
+from ._shard import (beta_shard, beta_phylogenetic_shard,
+                     merge_distance_blocks)
+from ._method import (extend_distance_matrix, EXTEND_METRICS, beta_multiple,
+                      beta_tiled, beta_sparse, SPARSE_METRICS,
+                      nearest_neighbors)
 
 
 __all__ = [
     'beta_phylogenetic', 'beta', 'bioenv', 'beta_group_significance', 'mantel',
     'beta_rarefaction', 'beta_correlation', 'adonis', 'METRICS',
+    'beta_rarefaction_iterations', 'extend_distance_matrix',
+    'EXTEND_METRICS', 'beta_phylogenetic_multiple', 'beta_multiple',
+    'beta_tiled', 'beta_sparse', 'SPARSE_METRICS', 'beta_approximate',
+    'SKETCH_METRICS', 'nearest_neighbors', 'beta_cross',
+    'beta_phylogenetic_cross', 'CROSS_PHYLO_METRICS', 'beta_shard',
+    'beta_phylogenetic_shard', 'merge_distance_blocks',
 ]
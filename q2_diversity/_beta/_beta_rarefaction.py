@@ -21,6 +21,7 @@ import q2templates
 
 from . import METRICS
 from .._ordination import pcoa
+from .._rarefaction import _rarefaction_depth_key, _rarefaction_iteration_key
 
 TEMPLATES = pkg_resources.resource_filename('q2_diversity', '_beta')
 
@@ -30,11 +31,19 @@ def beta_rarefaction(output_dir: str, table: biom.Table, metric: str,
                      sampling_depth: int, iterations: int = 10,
                      phylogeny: skbio.TreeNode = None,
                      correlation_method: str = 'spearman',
-                     color_scheme: str = 'BrBG') -> None:
+                     color_scheme: str = 'BrBG',
+                     previous_iterations: skbio.DistanceMatrix = None
+                     ) -> None:
+    # previous_iterations is a collection: QIIME 2 passes it as a dict of
+    # iteration keys to distance matrices, each viewed as the annotated type
     ctx = qiime2.sdk.Context()
     if table.is_empty():
         raise ValueError("Input feature table is empty.")
 
+    if previous_iterations is not None:
+        _validate_previous_iterations(previous_iterations, metric,
+                                      sampling_depth)
+
     # Filter metadata to only include sample IDs present in the feature
     # table. Also ensures every feature table sample ID is present in the
     # metadata.
@@ -42,24 +51,16 @@ def beta_rarefaction(output_dir: str, table: biom.Table, metric: str,
 
     table = qiime2.Artifact.import_data('FeatureTable[Frequency]', table)
 
-    if metric in METRICS['PHYLO']['IMPL'] | METRICS['PHYLO']['UNIMPL']:
-        if phylogeny is None:
-            raise ValueError("A phylogenetic metric (%s) was requested, "
-                             "but a phylogenetic tree was not provided. "
-                             "Phylogeny must be provided when using a "
-                             "phylogenetic diversity metric." % metric)
-
+    if phylogeny is not None:
         phylogeny = qiime2.Artifact.import_data('Phylogeny[Rooted]',
                                                 phylogeny)
-        api_method = ctx.get_action('diversity', 'beta_phylogenetic')
-        beta_func = functools.partial(api_method, phylogeny=phylogeny)
-    else:
-        beta_func = ctx.get_action('diversity', 'beta')
+    beta_func = _get_beta_func(ctx, metric, phylogeny)
 
     rare_func = ctx.get_action('feature-table', 'rarefy')
 
     distance_matrices = _get_multiple_rarefaction(
-        beta_func, rare_func, metric, iterations, table, sampling_depth)
+        beta_func, rare_func, metric, iterations, table, sampling_depth,
+        previous_iterations)
 
     primary = distance_matrices[0]
     support = distance_matrices[1:]
@@ -99,13 +100,48 @@ def beta_rarefaction(output_dir: str, table: biom.Table, metric: str,
     q2templates.render(templates, output_dir, context=context)
 
 
+def _validate_previous_iterations(previous_iterations, metric,
+                                  sampling_depth):
+    prefix = _rarefaction_depth_key(metric, sampling_depth)
+    unknown = {k for k in previous_iterations
+               if k.rsplit('_iter-', 1)[0] != prefix}
+    if unknown:
+        raise ValueError('The following previous iterations were not '
+                         'computed with metric %s at a sampling depth of %d: '
+                         '%s' % (metric, sampling_depth,
+                                 ', '.join(sorted(unknown))))
+
+
+def _get_beta_func(ctx, metric, phylogeny):
+    if metric in METRICS['PHYLO']['IMPL'] | METRICS['PHYLO']['UNIMPL']:
+        if phylogeny is None:
+            raise ValueError("A phylogenetic metric (%s) was requested, "
+                             "but a phylogenetic tree was not provided. "
+                             "Phylogeny must be provided when using a "
+                             "phylogenetic diversity metric." % metric)
+
+        api_method = ctx.get_action('diversity', 'beta_phylogenetic')
+        return functools.partial(api_method, phylogeny=phylogeny)
+    else:
+        return ctx.get_action('diversity', 'beta')
+
+
 def _get_multiple_rarefaction(beta_func, rare_func, metric, iterations, table,
-                              sampling_depth):
+                              sampling_depth, previous_iterations=None):
+    if previous_iterations is None:
+        previous_iterations = {}
+
     distance_matrices = []
-    for _ in range(iterations):
-        rarefied_table, = rare_func(table=table, sampling_depth=sampling_depth)
-        distance_matrix, = beta_func(table=rarefied_table, metric=metric)
-        distance_matrices.append(distance_matrix.view(skbio.DistanceMatrix))
+    for i in range(1, iterations + 1):
+        key = _rarefaction_iteration_key(metric, sampling_depth, i)
+        if key in previous_iterations:
+            distance_matrix = previous_iterations[key]
+        else:
+            rarefied_table, = rare_func(table=table,
+                                        sampling_depth=sampling_depth)
+            distance_matrix, = beta_func(table=rarefied_table, metric=metric)
+            distance_matrix = distance_matrix.view(skbio.DistanceMatrix)
+        distance_matrices.append(distance_matrix)
     return distance_matrices
 
 
@@ -0,0 +1,170 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import concurrent.futures
+
+import biom
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import scipy.spatial.distance
+import skbio
+
+from .._alpha._method import _tip_ranges, _tip_columns
+from ._method import (_aligned_sample_major, _shared_preparations, _tile,
+                      _resolve_n_jobs)
+
+
+CROSS_PHYLO_METRICS = {'unweighted_unifrac', 'weighted_unifrac',
+                       'weighted_normalized_unifrac'}
+
+
+def _blocks(n, block_size):
+    return [slice(start, min(start + block_size, n))
+            for start in range(0, n, block_size)]
+
+
+def _validate_tables(query_table, reference_table):
+    if query_table.is_empty():
+        raise ValueError('The provided query table is empty')
+    if reference_table.is_empty():
+        raise ValueError('The provided reference table is empty')
+
+
+def _cross(tile, n_queries, reference_blocks, n_jobs):
+    # The query rows against each block of reference columns, one task per
+    # block. `tile(columns)` computes one block.
+    n = reference_blocks[-1].stop
+    distances = np.empty((n_queries, n))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        tasks = {pool.submit(tile, columns): columns
+                 for columns in reference_blocks}
+        for task in concurrent.futures.as_completed(tasks):
+            distances[:, tasks[task]] = task.result()
+    return distances
+
+
+def beta_cross(query_table: biom.Table, reference_table: biom.Table,
+               metric: str, pseudocount: int = 1, n_jobs: int = 1,
+               block_size: int = 1024) -> pd.DataFrame:
+    _validate_tables(query_table, reference_table)
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    queries, references = _aligned_sample_major(
+        [query_table, reference_table])
+    m = queries.shape[0]
+    # Preparations that depend on all samples, like the variances of
+    # seuclidean, are those of the two tables together, as if they were
+    # merged.
+    counts = scipy.sparse.vstack([queries, references]).tocsr()
+    shared = _shared_preparations(counts, metric)
+    rows = slice(0, m)
+
+    def tile(columns):
+        return _tile(counts, metric, pseudocount, shared, rows,
+                     slice(m + columns.start, m + columns.stop))
+
+    distances = _cross(tile, m, _blocks(references.shape[0], block_size),
+                       n_jobs)
+    return pd.DataFrame(distances,
+                        index=pd.Index(query_table.ids(), dtype=object),
+                        columns=pd.Index(reference_table.ids(),
+                                         dtype=object))
+
+
+def _ancestry(n_tips, starts, ends):
+    # tips x branches indicator of the branches on each tip's path to the
+    # root
+    sizes = ends - starts
+    branches = np.repeat(np.arange(len(starts)), sizes)
+    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes,
+                                                 sizes)
+    tips = np.repeat(starts, sizes) + offsets
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(tips)), (tips, branches)), shape=(n_tips, len(starts)))
+
+
+def _branch_embedding(table, features, tips, ancestry, metric):
+    # Samples x branches: for unweighted UniFrac, the number of observed
+    # tips below each branch; otherwise, the proportion of the sample below
+    # it.
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    counts.eliminate_zeros()
+    if metric == 'unweighted_unifrac':
+        counts.data[:] = 1
+    else:
+        with np.errstate(divide='ignore'):
+            totals = 1 / np.asarray(counts.sum(axis=1)).ravel()
+        counts = scipy.sparse.diags(totals) @ counts
+    columns = _tip_columns(features, tips)
+    counts = scipy.sparse.csr_matrix(
+        (counts.data, columns[counts.indices], counts.indptr),
+        shape=(counts.shape[0], len(tips)))
+    return (counts @ ancestry).tocsr()
+
+
+def _unifrac_tile(queries, references, lengths, metric, normalizers):
+    # Only the branches observed in either side of the tile are densified.
+    observed = np.union1d(queries.indices, references.indices)
+    x = queries[:, observed].toarray()
+    y = references[:, observed].toarray()
+    lengths = lengths[observed]
+    if metric == 'unweighted_unifrac':
+        x, y = (x > 0) * lengths, (y > 0).astype(float)
+        shared = x @ y.T
+        union = x.sum(axis=1)[:, None] + (y @ lengths)[None, :] - shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = (union - shared) / union
+        distances[union == 0] = 0
+        return distances
+    distances = scipy.spatial.distance.cdist(x * lengths, y * lengths,
+                                             metric='cityblock')
+    if metric == 'weighted_normalized_unifrac':
+        query_normalizers, reference_normalizers = normalizers
+        distances /= (query_normalizers[:, None] +
+                      reference_normalizers[None, :])
+    return distances
+
+
+def beta_phylogenetic_cross(query_table: biom.Table,
+                            reference_table: biom.Table,
+                            phylogeny: skbio.TreeNode, metric: str,
+                            n_jobs: int = 1,
+                            block_size: int = 1024) -> pd.DataFrame:
+    if metric not in CROSS_PHYLO_METRICS:
+        raise ValueError('Query-versus-reference distances can only be '
+                         'computed for the following phylogenetic metrics: '
+                         '%s' % ', '.join(sorted(CROSS_PHYLO_METRICS)))
+    _validate_tables(query_table, reference_table)
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    tips, starts, ends, lengths = _tip_ranges(phylogeny)
+    ancestry = _ancestry(len(tips), starts, ends)
+    queries, references = (
+        _branch_embedding(table, table.ids(axis='observation'), tips,
+                          ancestry, metric)
+        for table in (query_table, reference_table))
+
+    normalizers = None
+    if metric == 'weighted_normalized_unifrac':
+        # The proportion-weighted distance of each sample's tips from the
+        # root. A tip's depth is the sum of the lengths of the branches above
+        # it, so this is the embedding weighted by branch length.
+        normalizers = (queries @ lengths, references @ lengths)
+
+    def tile(columns):
+        return _unifrac_tile(queries, references[columns], lengths, metric,
+                             None if normalizers is None else
+                             (normalizers[0], normalizers[1][columns]))
+
+    distances = _cross(tile, queries.shape[0],
+                       _blocks(references.shape[0], block_size), n_jobs)
+    return pd.DataFrame(distances,
+                        index=pd.Index(query_table.ids(), dtype=object),
+                        columns=pd.Index(reference_table.ids(),
+                                         dtype=object))
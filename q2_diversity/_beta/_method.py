@@ -0,0 +1,528 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import concurrent.futures
+import os
+
+import biom
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import scipy.spatial.distance
+import skbio
+from qiime2.plugin import get_available_cores
+
+from .._format import CondensedDistanceMatrixDirectoryFormat
+
+
+EXTEND_METRICS = {'jaccard', 'braycurtis'}
+
+# number of reference samples densified at once when computing Bray-Curtis
+# distances between two blocks of samples
+_BLOCK_SIZE = 1024
+
+
+def _aligned_sample_major(tables):
+    # Sample-major sparse matrices for each table, with columns aligned to
+    # the union of the tables' features.
+    features = {}
+    for table in tables:
+        for feature in table.ids(axis='observation'):
+            features.setdefault(feature, len(features))
+
+    matrices = []
+    for table in tables:
+        counts = scipy.sparse.coo_matrix(table.matrix_data)
+        columns = np.array([features[f]
+                            for f in table.ids(axis='observation')],
+                           dtype=np.int64)
+        matrices.append(scipy.sparse.csr_matrix(
+            (counts.data, (counts.col, columns[counts.row])),
+            shape=(counts.shape[1], len(features)), dtype=float))
+    return matrices
+
+
+def _jaccard_block(x, y):
+    # Jaccard distances on presence/absence, as computed by scipy for boolean
+    # vectors: 1 - |x & y| / |x | y|
+    x = (x > 0).astype(float)
+    y = (y > 0).astype(float)
+    intersection = (x @ y.T).toarray()
+    union = (np.asarray(x.sum(axis=1)) + np.asarray(y.sum(axis=1)).T -
+             intersection)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = 1 - intersection / union
+    distances[union == 0] = 0
+    return distances
+
+
+def _braycurtis_block(x, y):
+    x = x.toarray()
+    distances = np.empty((x.shape[0], y.shape[0]))
+    for start in range(0, y.shape[0], _BLOCK_SIZE):
+        stop = start + _BLOCK_SIZE
+        distances[:, start:stop] = scipy.spatial.distance.cdist(
+            x, y[start:stop].toarray(), metric='braycurtis')
+    return distances
+
+
+_BLOCK_FUNCS = {'jaccard': _jaccard_block, 'braycurtis': _braycurtis_block}
+
+
+def extend_distance_matrix(distance_matrix: skbio.DistanceMatrix,
+                           table: biom.Table, new_table: biom.Table,
+                           metric: str) -> skbio.DistanceMatrix:
+    if metric not in EXTEND_METRICS:
+        raise ValueError('Distance matrices can only be extended for the '
+                         'following metrics: %s'
+                         % ', '.join(sorted(EXTEND_METRICS)))
+
+    ids = list(distance_matrix.ids)
+    if set(ids) != set(table.ids()):
+        raise ValueError('The samples in the table must be the samples in '
+                         'the distance matrix.')
+    new_ids = list(new_table.ids())
+    overlap = set(ids) & set(new_ids)
+    if overlap:
+        raise ValueError('The new table contains samples that are already '
+                         'in the distance matrix: %s'
+                         % ', '.join(sorted(overlap)))
+    if not new_ids:
+        return distance_matrix
+
+    table = table.sort_order(ids)
+    counts, new_counts = _aligned_sample_major([table, new_table])
+
+    # only the new-vs-existing and new-vs-new blocks are computed; the
+    # existing block is copied from the provided distance matrix
+    block = _BLOCK_FUNCS[metric]
+    n = len(ids)
+    data = np.empty((n + len(new_ids), n + len(new_ids)))
+    data[:n, :n] = distance_matrix.data
+    data[n:, :n] = block(new_counts, counts)
+    data[:n, n:] = data[n:, :n].T
+    data[n:, n:] = block(new_counts, new_counts)
+    np.fill_diagonal(data[n:, n:], 0)
+
+    return skbio.DistanceMatrix(data, ids + new_ids)
+
+
+# Metrics that sklearn's pairwise_distances, and therefore q2-diversity-lib,
+# evaluate on presence/absence data.
+_BOOLEAN_METRICS = {'jaccard', 'dice', 'kulsinski', 'kulczynski1', 'matching',
+                    'rogerstanimoto', 'russellrao', 'sokalmichener',
+                    'sokalsneath', 'yule'}
+
+# number of distances each task computes, at most
+_TASK_SIZE = 2 ** 22
+
+
+def _presence(prepared):
+    return prepared['counts'] > 0
+
+
+def _observed(prepared):
+    return _prepared(prepared, 'presence').sum(axis=1)
+
+
+def _clr(prepared):
+    # the pseudocount is only applied for the compositional metric, as in
+    # q2-diversity-lib's passthrough
+    logs = np.log(prepared['counts'] + prepared['pseudocount'])
+    return logs - logs.mean(axis=1, keepdims=True)
+
+
+def _relative(prepared):
+    counts = prepared['counts']
+    return counts / counts.sum(axis=1, keepdims=True)
+
+
+def _variances(prepared):
+    return prepared['counts'].var(axis=0, ddof=1)
+
+
+def _inverse_covariance(prepared):
+    return np.linalg.inv(np.cov(prepared['counts'].T)).T
+
+
+_PREPARATIONS = {'presence': _presence, 'observed': _observed, 'clr': _clr,
+                 'relative': _relative, 'variances': _variances,
+                 'inverse_covariance': _inverse_covariance}
+
+
+def _prepared(prepared, name):
+    # each transformation of the table is computed at most once, on first
+    # use, and shared by every metric that needs it
+    if name not in prepared:
+        prepared[name] = _PREPARATIONS[name](prepared)
+    return prepared[name]
+
+
+def _canberra_adkins_block(prepared, rows, columns):
+    # Canberra distance normalized by the number of features observed in
+    # either sample
+    counts = prepared['counts']
+    presence = _prepared(prepared, 'presence')
+    observed = _prepared(prepared, 'observed')
+    canberra = scipy.spatial.distance.cdist(counts[rows], counts[columns],
+                                            metric='canberra')
+    union = (observed[rows][:, None] + observed[columns][None, :] -
+             presence[rows].astype(float) @ presence[columns].T.astype(float))
+    return canberra / union
+
+
+def _distance_block(prepared, metric, rows, columns):
+    cdist = scipy.spatial.distance.cdist
+    if metric == 'aitchison':
+        clr = _prepared(prepared, 'clr')
+        return cdist(clr[rows], clr[columns], metric='euclidean')
+    elif metric == 'canberra_adkins':
+        return _canberra_adkins_block(prepared, rows, columns)
+    elif metric == 'jensenshannon':
+        relative = _prepared(prepared, 'relative')
+        return cdist(relative[rows], relative[columns],
+                     metric='jensenshannon')
+    elif metric in _BOOLEAN_METRICS:
+        presence = _prepared(prepared, 'presence')
+        return cdist(presence[rows], presence[columns], metric=metric)
+    elif metric == 'seuclidean':
+        # the variances are those of the whole table, not of the block
+        counts = prepared['counts']
+        return cdist(counts[rows], counts[columns], metric=metric,
+                     V=_prepared(prepared, 'variances'))
+    elif metric == 'mahalanobis':
+        counts = prepared['counts']
+        return cdist(counts[rows], counts[columns], metric=metric,
+                     VI=_prepared(prepared, 'inverse_covariance'))
+    else:
+        counts = prepared['counts']
+        return cdist(counts[rows], counts[columns], metric=metric)
+
+
+def _row_blocks(n_samples, n_jobs):
+    # Row strips of the upper triangle, each covering the columns from the
+    # strip's first row onwards. There are enough strips to keep every
+    # worker busy, each bounded in size.
+    size = max(1, min(-(-n_samples // (4 * n_jobs)),
+                      _TASK_SIZE // max(1, n_samples)))
+    return [slice(start, min(start + size, n_samples))
+            for start in range(0, n_samples, size)]
+
+
+def _prepare_metrics(table, metrics, pseudocount):
+    prepared = {'counts': table.matrix_data.T.toarray().astype(float),
+                'pseudocount': pseudocount}
+    # preparations are made up front, so that tasks only ever read them
+    for metric in metrics:
+        if metric == 'aitchison':
+            _prepared(prepared, 'clr')
+        elif metric == 'jensenshannon':
+            _prepared(prepared, 'relative')
+        elif metric == 'canberra_adkins':
+            _prepared(prepared, 'observed')
+        elif metric in _BOOLEAN_METRICS:
+            _prepared(prepared, 'presence')
+        elif metric == 'seuclidean':
+            _prepared(prepared, 'variances')
+        elif metric == 'mahalanobis':
+            _prepared(prepared, 'inverse_covariance')
+    return prepared
+
+
+def _resolve_n_jobs(n_jobs):
+    if n_jobs in (0, 'auto'):
+        return get_available_cores()
+    return n_jobs
+
+
+def beta_multiple(table: biom.Table, metrics: set, pseudocount: int = 1,
+                  n_jobs: int = 1) -> skbio.DistanceMatrix:
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    ids = list(table.ids())
+    n = len(ids)
+    prepared = _prepare_metrics(table, metrics, pseudocount)
+    results = {metric: np.zeros((n, n)) for metric in metrics}
+
+    # every metric's row strips are scheduled on a single pool
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        tasks = {}
+        for metric in sorted(metrics):
+            for rows in _row_blocks(n, n_jobs):
+                columns = slice(rows.start, n)
+                task = pool.submit(_distance_block, prepared, metric, rows,
+                                   columns)
+                tasks[task] = (metric, rows, columns)
+        for task in concurrent.futures.as_completed(tasks):
+            metric, rows, columns = tasks[task]
+            results[metric][rows, columns] = task.result()
+
+    lower = np.tril_indices(n, -1)
+    distance_matrices = {}
+    for metric, data in results.items():
+        data[lower] = data.T[lower]
+        np.fill_diagonal(data, 0)
+        distance_matrices[metric] = skbio.DistanceMatrix(data, ids)
+    return distance_matrices
+
+
+SPARSE_METRICS = {'jaccard', 'braycurtis'}
+
+
+# largest number of co-occurring pairs of nonzeros handled at once
+_CO_OCCURRENCE_CHUNK_SIZE = 2 ** 22
+
+
+def _co_occurrences(left, right, start, stop):
+    # Every pair of a nonzero entry of `left` and one of `right` sharing a
+    # feature among the features in [start, stop) of the feature-major
+    # matrices, as the entries' positions in `left.data` and `right.data`.
+    left_indptr = left.indptr[start:stop + 1]
+    right_indptr = right.indptr[start:stop + 1]
+    left_sizes = np.diff(left_indptr)
+    right_sizes = np.diff(right_indptr)
+    entries = np.arange(left_indptr[0], left_indptr[-1])
+    repeats = np.repeat(right_sizes, left_sizes)
+    first = np.repeat(entries, repeats)
+    offsets = np.arange(len(first)) - np.repeat(
+        np.cumsum(repeats) - repeats, repeats)
+    second = np.repeat(np.repeat(right_indptr[:-1], left_sizes),
+                       repeats) + offsets
+    return first, second
+
+
+def _sparse_braycurtis(x, y):
+    # Bray-Curtis as 1 - 2 * sum(min(x, y)) / (sum(x) + sum(y)), where the
+    # sum of minima only has terms for the features observed in both
+    # samples. The work is proportional to the number of co-occurring pairs
+    # of nonzeros rather than to samples x features.
+    left = x.tocsc()
+    right = y.tocsc()
+    n_columns = right.shape[0]
+    pairs = (np.diff(left.indptr).astype(np.int64) *
+             np.diff(right.indptr).astype(np.int64))
+    cumulative = np.concatenate([[0], np.cumsum(pairs)])
+
+    minima = np.zeros(left.shape[0] * n_columns)
+    start = 0
+    while start < left.shape[1]:
+        # features are taken in chunks of about _CO_OCCURRENCE_CHUNK_SIZE
+        # pairs, and always at least one feature
+        stop = max(start + 1, int(np.searchsorted(
+            cumulative, cumulative[start] + _CO_OCCURRENCE_CHUNK_SIZE,
+            side='right')) - 1)
+        first, second = _co_occurrences(left, right, start, stop)
+        minima += np.bincount(
+            left.indices[first] * n_columns + right.indices[second],
+            weights=np.minimum(left.data[first], right.data[second]),
+            minlength=len(minima))
+        start = stop
+
+    totals_x = np.asarray(x.sum(axis=1)).ravel()
+    totals_y = np.asarray(y.sum(axis=1)).ravel()
+    denominator = totals_x[:, None] + totals_y[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = 1 - 2 * minima.reshape(denominator.shape) / denominator
+    distances[denominator == 0] = 0
+    return distances
+
+
+_SPARSE_BLOCK_FUNCS = {'jaccard': _jaccard_block,
+                       'braycurtis': _sparse_braycurtis}
+
+
+def beta_sparse(table: biom.Table, metric: str,
+                n_jobs: int = 1) -> skbio.DistanceMatrix:
+    if metric not in SPARSE_METRICS:
+        raise ValueError('The sparse implementation only supports the '
+                         'following metrics: %s'
+                         % ', '.join(sorted(SPARSE_METRICS)))
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    counts.eliminate_zeros()
+    n = counts.shape[0]
+    distances = np.zeros((n, n))
+
+    # Row strips of the upper triangle are computed concurrently, so that
+    # the dense intermediates of every task are bounded by the strip's size.
+    block_func = _SPARSE_BLOCK_FUNCS[metric]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        tasks = {pool.submit(block_func, counts[rows],
+                             counts[rows.start:]): rows
+                 for rows in _row_blocks(n, n_jobs)}
+        for task in concurrent.futures.as_completed(tasks):
+            rows = tasks[task]
+            distances[rows, rows.start:] = task.result()
+
+    lower = np.tril_indices(n, -1)
+    distances[lower] = distances.T[lower]
+    np.fill_diagonal(distances, 0)
+
+    return skbio.DistanceMatrix(distances, list(table.ids()))
+
+
+def _sparse_variances(counts):
+    n = counts.shape[0]
+    means = np.asarray(counts.mean(axis=0)).ravel()
+    squares = np.asarray(counts.multiply(counts).mean(axis=0)).ravel()
+    return (squares - means ** 2) * n / (n - 1)
+
+
+def _sparse_inverse_covariance(counts):
+    n = counts.shape[0]
+    means = np.asarray(counts.mean(axis=0)).ravel()
+    covariance = ((counts.T @ counts).toarray() -
+                  n * np.outer(means, means)) / (n - 1)
+    return np.linalg.inv(covariance).T
+
+
+def _shared_preparations(counts, metric):
+    # preparations of the sparse table that depend on all of its samples
+    shared = {}
+    if metric == 'seuclidean':
+        shared['variances'] = _sparse_variances(counts)
+    elif metric == 'mahalanobis':
+        shared['inverse_covariance'] = _sparse_inverse_covariance(counts)
+    return shared
+
+
+def _tile(counts, metric, pseudocount, shared, rows, columns):
+    # Only the rows of the two sides of the tile are densified. Preparations
+    # that depend on the whole table are computed once and shared.
+    n_rows = rows.stop - rows.start
+    prepared = dict(shared)
+    prepared.update({
+        'counts': scipy.sparse.vstack(
+            [counts[rows], counts[columns]]).toarray(),
+        'pseudocount': pseudocount})
+    return _distance_block(prepared, metric, slice(0, n_rows),
+                           slice(n_rows, prepared['counts'].shape[0]))
+
+
+def _condensed_index(n, i, j):
+    # the position of distance (i, j), i < j, in the condensed form of an
+    # n x n distance matrix
+    return i * n - i * (i + 1) // 2 + j - i - 1
+
+
+def _store_tile(distances, n, rows, columns, tile):
+    # Only the part of the tile above the diagonal is stored. Some metrics
+    # aren't exactly symmetric in floating point, so this also decides which
+    # of the two values of a pair on the diagonal tiles is kept.
+    i = np.arange(rows.start, rows.stop)[:, None]
+    j = np.arange(columns.start, columns.stop)[None, :]
+    upper = j > i
+    distances[_condensed_index(n, i, j)[upper]] = tile[upper]
+
+
+def _condensed_rows(distances, n, rows):
+    # rows of the square distance matrix, from its condensed form
+    i = np.arange(rows.start, rows.stop)[:, None]
+    j = np.arange(n)[None, :]
+    block = np.zeros((rows.stop - rows.start, n))
+    off_diagonal = i != j
+    block[off_diagonal] = distances[_condensed_index(
+        n, np.minimum(i, j), np.maximum(i, j))[off_diagonal]]
+    return block
+
+
+def beta_tiled(table: biom.Table, metric: str, pseudocount: int = 1,
+               n_jobs: int = 1, block_size: int = 1024
+               ) -> CondensedDistanceMatrixDirectoryFormat:
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    ids = [str(i) for i in table.ids()]
+    n = len(ids)
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    shared = _shared_preparations(counts, metric)
+
+    blocks = [slice(start, min(start + block_size, n))
+              for start in range(0, n, block_size)]
+
+    result = CondensedDistanceMatrixDirectoryFormat()
+    with open(os.path.join(str(result.path), 'ids.txt'), 'w') as fh:
+        fh.write(''.join('%s\n' % id_ for id_ in ids))
+    # Each tile of the upper triangle is computed once and its distances
+    # above the diagonal are written into the memory-mapped condensed
+    # distances of the result, so the working set is a few tiles regardless
+    # of the number of samples. The result is converted to the text
+    # distance matrix of the artifact a block of rows at a time.
+    distances = np.lib.format.open_memmap(
+        os.path.join(str(result.path), 'distances.npy'), mode='w+',
+        dtype=np.float64, shape=(n * (n - 1) // 2,))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for i, rows in enumerate(blocks):
+            tasks = {pool.submit(_tile, counts, metric, pseudocount, shared,
+                                 rows, columns): columns
+                     for columns in blocks[i:]}
+            for task in concurrent.futures.as_completed(tasks):
+                _store_tile(distances, n, rows, tasks[task], task.result())
+    distances.flush()
+    del distances
+
+    return result
+
+
+def _row_neighbors(counts, metric, pseudocount, shared, rows, blocks, k):
+    # The k nearest neighbors of each sample in `rows`, merged one tile at a
+    # time so that at most k + block_size candidates are held per sample.
+    # Ties are broken by position, so the result doesn't depend on the
+    # block size.
+    n_rows = rows.stop - rows.start
+    distances = np.empty((n_rows, 0))
+    neighbors = np.empty((n_rows, 0), dtype=np.int64)
+    for columns in blocks:
+        tile = _tile(counts, metric, pseudocount, shared, rows, columns)
+        if columns == rows:
+            np.fill_diagonal(tile, np.inf)
+        distances = np.hstack([distances, tile])
+        neighbors = np.hstack([neighbors, np.broadcast_to(
+            np.arange(columns.start, columns.stop), tile.shape)])
+        order = np.lexsort((neighbors, distances))[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        neighbors = np.take_along_axis(neighbors, order, axis=1)
+    return distances, neighbors
+
+
+def nearest_neighbors(table: biom.Table, metric: str, k: int = 15,
+                      pseudocount: int = 1, n_jobs: int = 1,
+                      block_size: int = 1024) -> pd.DataFrame:
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+    ids = np.asarray([str(i) for i in table.ids()], dtype=object)
+    n = len(ids)
+    if k >= n:
+        raise ValueError('The number of neighbors (%d) must be smaller than '
+                         'the number of samples (%d).' % (k, n))
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    shared = _shared_preparations(counts, metric)
+    blocks = [slice(start, min(start + block_size, n))
+              for start in range(0, n, block_size)]
+
+    distances = np.empty((n, k))
+    neighbors = np.empty((n, k), dtype=np.int64)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        tasks = {pool.submit(_row_neighbors, counts, metric, pseudocount,
+                             shared, rows, blocks, k): rows
+                 for rows in blocks}
+        for task in concurrent.futures.as_completed(tasks):
+            rows = tasks[task]
+            distances[rows], neighbors[rows] = task.result()
+
+    return pd.DataFrame({'sample-id': np.repeat(ids, k),
+                         'neighbor-id': ids[neighbors.ravel()],
+                         'distance': distances.ravel()})
@@ -7,6 +7,35 @@
 # ----------------------------------------------------------------------------
 
 from . import METRICS
+from .._core_metrics import _split_jobs
+from .._rarefaction import _rarefaction_iteration_key
+from ._beta_rarefaction import _get_beta_func, _validate_previous_iterations
+from ._method import SPARSE_METRICS
+from ._sketch import SKETCH_METRICS
+
+
+def _beta_phylogenetic_action(metric, variance_adjusted=False, alpha=None):
+    # Resolves a phylogenetic metric to the q2-diversity-lib action computing
+    # it and the keyword arguments that action needs beyond the table, tree,
+    # threads and bypass_tips. The passthrough runs the same multi-threaded,
+    # tip-bypassing UniFrac engine as the dedicated actions.
+    if metric in METRICS['PHYLO']['IMPL'] and not variance_adjusted:
+        return METRICS['NAME_TRANSLATIONS'][metric], {}
+
+    return 'beta_phylogenetic_passthrough', {
+        'metric': metric, 'variance_adjusted': variance_adjusted,
+        'alpha': alpha}
+
+
+def _beta_phylogenetic(ctx, table, phylogeny, metric, threads=1,
+                       variance_adjusted=False, alpha=None,
+                       bypass_tips=False):
+    action_name, kwargs = _beta_phylogenetic_action(
+        metric, variance_adjusted=variance_adjusted, alpha=alpha)
+    action = ctx.get_action('diversity_lib', action_name)
+    dm, = action(table, phylogeny, threads=threads, bypass_tips=bypass_tips,
+                 **kwargs)
+    return dm
 
 
 def beta_phylogenetic(ctx,
@@ -22,27 +51,80 @@ def beta_phylogenetic(ctx,
         raise ValueError('The alpha parameter is only allowed when the choice'
                          ' of metric is generalized_unifrac')
 
-    # TODO: this logic will be simpler once the remaining unifracs are
-    # implemented in q2-diversity-lib
-    if metric in ('unweighted_unifrac', 'weighted_unifrac') \
-            and not variance_adjusted:
-        metric = METRICS['NAME_TRANSLATIONS'][metric]
-        action = ctx.get_action('diversity_lib', metric)
-        dm, = action(table, phylogeny, threads=threads,
-                     bypass_tips=bypass_tips)
-    else:
-        # handle unimplemented unifracs
-        action = ctx.get_action('diversity_lib',
-                                'beta_phylogenetic_passthrough')
-        dm, = action(table, phylogeny, metric=metric, threads=threads,
-                     variance_adjusted=variance_adjusted, alpha=alpha,
-                     bypass_tips=bypass_tips)
+    return _beta_phylogenetic(ctx, table, phylogeny, metric, threads=threads,
+                              variance_adjusted=variance_adjusted,
+                              alpha=alpha, bypass_tips=bypass_tips)
+
+
+def _beta_phylogenetic_variant_key(metric, alpha=None):
+    if alpha is None:
+        return metric
+    return '%s_alpha-%s' % (metric, alpha)
 
-    return dm
 
+def beta_phylogenetic_multiple(ctx,
+                               table,
+                               phylogeny,
+                               metrics,
+                               threads=1,
+                               variance_adjusted=False,
+                               alphas=None,
+                               bypass_tips=False):
+    if alphas is not None and 'generalized_unifrac' not in metrics:
+        raise ValueError('The alphas parameter is only allowed when '
+                         'generalized_unifrac is one of the chosen metrics')
 
-def beta(ctx, table, metric, pseudocount=1, n_jobs=1):
-    if metric in METRICS['NONPHYLO']['IMPL']:
+    variants = []
+    for metric in sorted(metrics):
+        if metric == 'generalized_unifrac' and alphas is not None:
+            variants.extend((metric, alpha) for alpha in sorted(set(alphas)))
+        else:
+            variants.append((metric, None))
+
+    # every variant is submitted as an independent branch, so when run in
+    # parallel they are computed concurrently and share the thread budget
+    distance_matrices = {}
+    for (metric, alpha), variant_threads in zip(
+            variants, _split_jobs(ctx, threads, len(variants))):
+        key = _beta_phylogenetic_variant_key(metric, alpha)
+        distance_matrices[key] = _beta_phylogenetic(
+            ctx, table, phylogeny, metric, threads=variant_threads,
+            variance_adjusted=variance_adjusted, alpha=alpha,
+            bypass_tips=bypass_tips)
+
+    return distance_matrices
+
+
+def beta(ctx, table, metric, pseudocount=1, n_jobs=1, block_size=None,
+         approximate=False, sketch_size=256, sparse=False):
+    backends = [name for name, selected in (('block_size', block_size),
+                                            ('approximate', approximate),
+                                            ('sparse', sparse))
+                if selected not in (None, False)]
+    if len(backends) > 1:
+        raise ValueError('Only one of block_size, approximate and sparse can '
+                         'be set, but %s were.' % ' and '.join(backends))
+    if sparse and metric not in SPARSE_METRICS:
+        raise ValueError('The sparse implementation only supports the '
+                         'following metrics: %s'
+                         % ', '.join(sorted(SPARSE_METRICS)))
+
+    if approximate:
+        if metric not in SKETCH_METRICS:
+            raise ValueError('Approximate distances can only be computed for '
+                             'the following metrics: %s'
+                             % ', '.join(sorted(SKETCH_METRICS)))
+        action = ctx.get_action('diversity', 'beta_approximate')
+        dm, = action(table=table, metric=metric, sketch_size=sketch_size,
+                     n_jobs=n_jobs)
+    elif block_size is not None:
+        action = ctx.get_action('diversity', 'beta_tiled')
+        dm, = action(table=table, metric=metric, pseudocount=pseudocount,
+                     n_jobs=n_jobs, block_size=block_size)
+    elif sparse:
+        action = ctx.get_action('diversity', 'beta_sparse')
+        dm, = action(table=table, metric=metric, n_jobs=n_jobs)
+    elif metric in METRICS['NONPHYLO']['IMPL']:
         metric = METRICS['NAME_TRANSLATIONS'][metric]
         action = ctx.get_action('diversity_lib', metric)
         dm, = action(table=table, n_jobs=n_jobs)
@@ -52,3 +134,29 @@ def beta(ctx, table, metric, pseudocount=1, n_jobs=1):
                      n_jobs=n_jobs)
 
     return dm
+
+
+def beta_rarefaction_iterations(ctx, table, metric, sampling_depth,
+                                iterations=10, phylogeny=None,
+                                previous_iterations=None):
+    if previous_iterations is None:
+        previous_iterations = {}
+    else:
+        previous_iterations = dict(previous_iterations.items())
+        _validate_previous_iterations(previous_iterations, metric,
+                                      sampling_depth)
+
+    beta_func = _get_beta_func(ctx, metric, phylogeny)
+    rarefy = ctx.get_action('feature_table', 'rarefy')
+
+    distance_matrices = {}
+    for i in range(1, iterations + 1):
+        key = _rarefaction_iteration_key(metric, sampling_depth, i)
+        if key in previous_iterations:
+            distance_matrices[key] = previous_iterations[key]
+        else:
+            rarefied_table, = rarefy(table=table,
+                                     sampling_depth=sampling_depth)
+            distance_matrices[key], = beta_func(table=rarefied_table,
+                                                metric=metric)
+    return distance_matrices
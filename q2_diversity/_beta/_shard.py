@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import skbio
+import biom
+
+from .._alpha._method import _tip_ranges
+from ._method import _shared_preparations, _tile, _resolve_n_jobs
+from ._cross import (CROSS_PHYLO_METRICS, _ancestry, _branch_embedding,
+                     _unifrac_tile, _cross, _blocks)
+
+
+def _shard_rows(n_samples, shard, n_shards):
+    # Shard i computes the rows [start, stop) of the upper triangle, from
+    # each row's own column onwards. The boundaries split the triangle into
+    # shards of about the same number of distances.
+    if shard >= n_shards:
+        raise ValueError('The shard index (%d) must be smaller than the '
+                         'number of shards (%d).' % (shard, n_shards))
+    if n_shards > n_samples:
+        raise ValueError('The number of shards (%d) cannot exceed the number '
+                         'of samples (%d).' % (n_shards, n_samples))
+    # areas[i] is the number of distances in the rows up to and including i
+    areas = np.cumsum(np.arange(n_samples, 0, -1))
+    boundaries = np.searchsorted(
+        areas, areas[-1] * np.arange(1, n_shards) / n_shards) + 1
+    # every shard has at least one row
+    boundaries = np.maximum(boundaries, np.arange(1, n_shards))
+    boundaries = np.minimum(boundaries,
+                            n_samples - np.arange(n_shards - 1, 0, -1))
+    boundaries = np.concatenate([[0], boundaries, [n_samples]])
+    return slice(int(boundaries[shard]), int(boundaries[shard + 1]))
+
+
+def _shard_block(distances, ids, rows):
+    return pd.DataFrame(distances,
+                        index=pd.Index(ids[rows], dtype=object),
+                        columns=pd.Index(ids[rows.start:], dtype=object))
+
+
+def beta_shard(table: biom.Table, metric: str, shard: int, n_shards: int,
+               pseudocount: int = 1, n_jobs: int = 1,
+               block_size: int = 1024) -> pd.DataFrame:
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    ids = np.asarray(table.ids(), dtype=object)
+    n = len(ids)
+    rows = _shard_rows(n, shard, n_shards)
+    n_jobs = _resolve_n_jobs(n_jobs)
+    # preparations that depend on all samples are computed from the whole
+    # table, so that every shard agrees on them
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    shared = _shared_preparations(counts, metric)
+
+    def tile(columns):
+        return _tile(counts, metric, pseudocount, shared, rows,
+                     slice(rows.start + columns.start,
+                           rows.start + columns.stop))
+
+    distances = _cross(tile, rows.stop - rows.start,
+                       _blocks(n - rows.start, block_size), n_jobs)
+    return _shard_block(distances, ids, rows)
+
+
+def beta_phylogenetic_shard(table: biom.Table, phylogeny: skbio.TreeNode,
+                            metric: str, shard: int, n_shards: int,
+                            n_jobs: int = 1,
+                            block_size: int = 1024) -> pd.DataFrame:
+    if metric not in CROSS_PHYLO_METRICS:
+        raise ValueError('Sharded distances can only be computed for the '
+                         'following phylogenetic metrics: %s'
+                         % ', '.join(sorted(CROSS_PHYLO_METRICS)))
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    ids = np.asarray(table.ids(), dtype=object)
+    n = len(ids)
+    rows = _shard_rows(n, shard, n_shards)
+    n_jobs = _resolve_n_jobs(n_jobs)
+    tips, starts, ends, lengths = _tip_ranges(phylogeny)
+    embedding = _branch_embedding(table, table.ids(axis='observation'), tips,
+                                  _ancestry(len(tips), starts, ends), metric)
+    normalizers = embedding @ lengths
+
+    def tile(columns):
+        columns = slice(rows.start + columns.start, rows.start + columns.stop)
+        return _unifrac_tile(embedding[rows], embedding[columns], lengths,
+                             metric, (normalizers[rows], normalizers[columns]))
+
+    distances = _cross(tile, rows.stop - rows.start,
+                       _blocks(n - rows.start, block_size), n_jobs)
+    return _shard_block(distances, ids, rows)
+
+
+def merge_distance_blocks(blocks: pd.DataFrame,
+                          n_shards: int) -> skbio.DistanceMatrix:
+    blocks = sorted(blocks.values(), key=lambda block: -block.shape[1])
+    if len(blocks) != n_shards:
+        raise ValueError('%d distance blocks were provided, but the distance '
+                         'matrix was computed in %d shards.'
+                         % (len(blocks), n_shards))
+    # the first shard's columns are every sample, in the order of the
+    # table the shards were computed from
+    ids = list(blocks[0].columns)
+    n = len(ids)
+    data = np.zeros((n, n))
+    for shard, block in enumerate(blocks):
+        rows = _shard_rows(n, shard, n_shards)
+        if (list(block.columns) != ids[rows.start:] or
+                list(block.index) != ids[rows]):
+            raise ValueError('The distance blocks don\'t form the %d shards '
+                             'of a single distance matrix. Were they all '
+                             'computed from the same table, with the same '
+                             'number of shards?' % n_shards)
+        data[rows, rows.start:] = block.values
+
+    lower = np.tril_indices(n, -1)
+    data[lower] = data.T[lower]
+    np.fill_diagonal(data, 0)
+    return skbio.DistanceMatrix(data, ids)
@@ -0,0 +1,132 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import concurrent.futures
+
+import biom
+import numpy as np
+import scipy.sparse
+import skbio
+
+from ._method import _row_blocks, _resolve_n_jobs
+
+
+SKETCH_METRICS = {'jaccard', 'braycurtis'}
+
+# number of hash functions whose random values are drawn, for every
+# feature, at once
+_HASH_BLOCK_SIZE = 16
+
+
+def _approximation_error(metric, sketch_size):
+    # An estimated Jaccard index is the fraction of k matching sketch
+    # entries, a binomial proportion with standard error
+    # sqrt(J(1 - J) / k) <= 1 / (2 sqrt(k)). Bray-Curtis is (1 - J) / (1 + J)
+    # of the weighted Jaccard index, whose slope is at most 2 in magnitude.
+    bound = 1 / (2 * np.sqrt(sketch_size))
+    if metric == 'braycurtis':
+        bound *= 2
+    return bound
+
+
+def _hash_blocks(n_features, sketch_size, seed):
+    # The random values of every (feature, hash function) pair, drawn for a
+    # block of hash functions at a time. They depend only on the seed, so
+    # all samples are sketched with the same functions.
+    rng = np.random.default_rng(seed)
+    for start in range(0, sketch_size, _HASH_BLOCK_SIZE):
+        size = min(_HASH_BLOCK_SIZE, sketch_size - start)
+        yield (slice(start, start + size),
+               rng.random((n_features, size)),
+               rng.gamma(2, 1, (n_features, size)),
+               rng.gamma(2, 1, (n_features, size)))
+
+
+def _segment_argmin(values, counts):
+    # For every row of the sample-major `counts`, and every column of
+    # `values` (aligned with `counts.data`), the position in `counts.data`
+    # of the row's minimum.
+    lengths = np.diff(counts.indptr)
+    observed = lengths > 0
+    minima = np.minimum.reduceat(values, counts.indptr[:-1][observed])
+    entries, columns = np.nonzero(
+        values == np.repeat(minima, lengths[observed], axis=0))
+    rows = np.repeat(np.arange(counts.shape[0]), lengths)[entries]
+    positions = np.full((counts.shape[0], values.shape[1]), -1)
+    positions[rows, columns] = entries
+    return positions
+
+
+def _sketch(counts, metric, sketch_size, seed):
+    # MinHash signatures for Jaccard, on presence/absence, and improved
+    # consistent weighted sampling (Ioffe, 2010) for Bray-Curtis, on the
+    # counts. Samples without counts have no sketch (-1 everywhere).
+    n_samples, n_features = counts.shape
+    features = np.full((n_samples, sketch_size), -1)
+    levels = np.zeros((n_samples, sketch_size), dtype=np.int64)
+    for hashes, uniform, r, c in _hash_blocks(n_features, sketch_size, seed):
+        if metric == 'jaccard':
+            positions = _segment_argmin(uniform[counts.indices], counts)
+        else:
+            r, c = r[counts.indices], c[counts.indices]
+            beta = uniform[counts.indices]
+            t = np.floor(np.log(counts.data)[:, None] / r + beta)
+            a = c / np.exp(r * (t - beta + 1))
+            positions = _segment_argmin(a, counts)
+            t = np.vstack([t, np.zeros((1, t.shape[1]))])
+            levels[:, hashes] = np.take_along_axis(t, positions, axis=0)
+        features[:, hashes] = np.where(positions >= 0,
+                                       counts.indices[positions], -1)
+    return features, levels
+
+
+def _estimate_block(features, levels, metric, rows):
+    # the fraction of matching sketch entries estimates the (weighted)
+    # Jaccard index
+    n_rows = rows.stop - rows.start
+    matches = np.zeros((n_rows, features.shape[0]))
+    for j in range(features.shape[1]):
+        matches += ((features[rows, j][:, None] == features[:, j][None, :]) &
+                    (levels[rows, j][:, None] == levels[:, j][None, :]))
+    similarity = matches / features.shape[1]
+    if metric == 'jaccard':
+        return 1 - similarity
+    return (1 - similarity) / (1 + similarity)
+
+
+def beta_approximate(table: biom.Table, metric: str, sketch_size: int = 256,
+                     seed: int = 0, n_jobs: int = 1) -> skbio.DistanceMatrix:
+    if metric not in SKETCH_METRICS:
+        raise ValueError('Approximate distances can only be computed for the '
+                         'following metrics: %s'
+                         % ', '.join(sorted(SKETCH_METRICS)))
+    if table.is_empty():
+        raise ValueError('The provided table is empty')
+
+    n_jobs = _resolve_n_jobs(n_jobs)
+    ids = list(table.ids())
+    n = len(ids)
+    counts = scipy.sparse.csr_matrix(table.matrix_data.T, dtype=float)
+    counts.eliminate_zeros()
+    counts.sort_indices()
+    features, levels = _sketch(counts, metric, sketch_size, seed)
+
+    distances = np.zeros((n, n))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        tasks = {pool.submit(_estimate_block, features, levels, metric,
+                             rows): rows
+                 for rows in _row_blocks(n, n_jobs)}
+        for task in concurrent.futures.as_completed(tasks):
+            distances[tasks[task]] = task.result()
+    # samples without counts are identical to one another, as in the exact
+    # implementations
+    empty = features[:, 0] == -1
+    distances[np.ix_(empty, empty)] = 0
+    np.fill_diagonal(distances, 0)
+
+    return skbio.DistanceMatrix(distances, ids)
@@ -7,13 +7,17 @@
 # ----------------------------------------------------------------------------
 
 import os.path
+import gzip
 import collections
+import concurrent.futures
+from multiprocessing import shared_memory
 import urllib.parse
 import pkg_resources
 import itertools
 import tempfile
 import subprocess
 
+import numpy as np
 import skbio
 import skbio.diversity
 import pandas as pd
@@ -72,48 +76,305 @@ _beta_group_significance_fns = {'permanova': skbio.stats.distance.permanova,
                                 'permdisp': skbio.stats.distance.permdisp}
 
 
-def _get_distance_boxplot_data(distance_matrix, group_id, groupings):
-    x_ticklabels = []
-    all_group_distances = []
-
-    # extract the within group distances
-    within_group_distances = []
-    pairs_summary = []
-    group = groupings[group_id]
-    for i, sid1 in enumerate(group):
-        for sid2 in group[:i]:
-            dist = distance_matrix[sid1, sid2]
-            within_group_distances.append(dist)
-            pairs_summary.append((sid1, sid2, group_id, group_id, dist))
-    x_ticklabels.append('%s (n=%d)' %
-                        (group_id, len(within_group_distances)))
-    all_group_distances.append(within_group_distances)
-
-    # extract between group distances for group to each other group
+_PAIRS_SUMMARY_COLUMNS = ['SubjectID1', 'SubjectID2', 'Group1', 'Group2',
+                          'Distance']
+
+# rows of the pairs summary held in memory at a time when writing it
+_RAW_DATA_CHUNK_SIZE = 100000
+
+
+def _group_distances(distance_matrix, groupings):
+    # Every within group and between group distance, extracted once by
+    # integer position. Within group distances are the lower triangle of the
+    # group's block, as (rows, columns, distances) relative to the group.
+    # Between group blocks are kept for both orders, one a view of the other.
+    index = {id_: i for i, id_ in enumerate(distance_matrix.ids)}
+    positions = {group_id: np.array([index[sid] for sid in group],
+                                    dtype=np.intp)
+                 for group_id, group in groupings.items()}
+    data = distance_matrix.data
+
+    group_distances = {}
+    for group_id, group in positions.items():
+        rows, columns = np.tril_indices(len(group), -1)
+        group_distances[group_id, group_id] = (
+            rows, columns, data[group[rows], group[columns]])
+    for group1_id, group2_id in itertools.combinations(groupings, 2):
+        block = data[np.ix_(positions[group1_id], positions[group2_id])]
+        group_distances[group1_id, group2_id] = block
+        group_distances[group2_id, group1_id] = block.T
+    return group_distances
+
+
+def _group_boxplot_data(group_distances, group_id, groupings):
+    # the within group distances
+    distances = group_distances[group_id, group_id][2]
+    all_group_distances = [distances.tolist()]
+    x_ticklabels = ['%s (n=%d)' % (group_id, len(distances))]
+
+    # the between group distances for group to each other group
+    for other_group_id in groupings:
+        if group_id == other_group_id:
+            continue
+        distances = group_distances[group_id, other_group_id].ravel()
+        all_group_distances.append(distances.tolist())
+        x_ticklabels.append('%s (n=%d)' % (other_group_id, len(distances)))
+    return all_group_distances, x_ticklabels
+
+
+def _pairs_summary_chunks(group_distances, group_id, groupings,
+                          chunk_size=_RAW_DATA_CHUNK_SIZE):
+    # The pairs summary of a group, in the order of its boxplot data, as
+    # DataFrames of at most (about) chunk_size rows, so that only one chunk
+    # of it exists as Python objects at a time.
+    group = np.asarray(groupings[group_id], dtype=object)
+
+    rows, columns, distances = group_distances[group_id, group_id]
+    for start in range(0, len(distances), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        yield pd.DataFrame(
+            {'SubjectID1': group[rows[chunk]],
+             'SubjectID2': group[columns[chunk]],
+             'Group1': group_id, 'Group2': group_id,
+             'Distance': distances[chunk]},
+            columns=_PAIRS_SUMMARY_COLUMNS)
+
     for other_group_id, other_group in groupings.items():
-        between_group_distances = []
         if group_id == other_group_id:
             continue
-        for sid1 in group:
-            for sid2 in other_group:
-                dist = distance_matrix[sid1, sid2]
-                between_group_distances.append(dist)
-                pairs_summary.append(
-                    (sid1, sid2, group_id, other_group_id, dist))
-        x_ticklabels.append('%s (n=%d)' %
-                            (other_group_id, len(between_group_distances)))
-        all_group_distances.append(between_group_distances)
-    return all_group_distances, x_ticklabels, pairs_summary
+        block = group_distances[group_id, other_group_id]
+        other_group = np.asarray(other_group, dtype=object)
+        step = max(1, chunk_size // max(1, block.shape[1]))
+        for start in range(0, block.shape[0], step):
+            chunk = block[start:start + step]
+            yield pd.DataFrame(
+                {'SubjectID1': np.repeat(group[start:start + step],
+                                         chunk.shape[1]),
+                 'SubjectID2': np.tile(other_group, chunk.shape[0]),
+                 'Group1': group_id, 'Group2': other_group_id,
+                 'Distance': chunk.ravel()},
+                columns=_PAIRS_SUMMARY_COLUMNS)
+
+
+def _write_raw_data(output_dir, group_distances, groupings, compress=False,
+                    max_rows=None):
+    # Streams the pairs summary of every group to disk, one chunk at a time.
+    # The index restarts for every group, and writing stops after max_rows
+    # rows. Returns the file name, and the number of rows written and
+    # available.
+    fn = 'raw_data.tsv.gz' if compress else 'raw_data.tsv'
+    n_pairs = sum(group_distances[group_id, other_group_id].size
+                  if group_id != other_group_id else
+                  len(group_distances[group_id, group_id][2])
+                  for group_id in groupings for other_group_id in groupings)
+    remaining = n_pairs if max_rows is None else min(max_rows, n_pairs)
+    n_written = remaining
+
+    open_ = gzip.open if compress else open
+    with open_(os.path.join(output_dir, fn), 'wt', newline='') as fh:
+        fh.write('\t'.join([''] + _PAIRS_SUMMARY_COLUMNS) + '\n')
+        for group_id in groupings:
+            offset = 0
+            for chunk in _pairs_summary_chunks(group_distances, group_id,
+                                               groupings):
+                if remaining == 0:
+                    break
+                chunk = chunk.iloc[:remaining]
+                chunk.index += offset
+                chunk.to_csv(fh, sep='\t', header=False)
+                offset += len(chunk)
+                remaining -= len(chunk)
+    return fn, n_written, n_pairs
+
+
+def _seeded(seed, function, *args, **kwargs):
+    # The group significance tests draw their permutations from NumPy's
+    # global random state (directly, or to seed their own generator), which is
+    # seeded for the call and restored afterwards, so that the caller's random
+    # state is left as it was.
+    if seed is None:
+        return function(*args, **kwargs)
+    state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        np.random.set_state(state)
+
+
+def _pairwise_seeds(n_pairs):
+    # One seed per pair of groups, by the pair's position, so that results
+    # don't depend on how the pairs are distributed across workers. The seeds
+    # are derived from a draw of NumPy's global random state, so they differ
+    # from call to call unless that state was seeded, as the pairwise tests'
+    # permutations did when they drew from it directly.
+    entropy = np.random.randint(2 ** 32, size=4)
+    return [int(seed.generate_state(1)[0])
+            for seed in np.random.SeedSequence(entropy).spawn(n_pairs)]
 
 
 def _get_pairwise_group_significance_stats(
         distance_matrix, group1_id, group2_id, groupings, metadata,
-        beta_group_significance_fn, permutations):
+        beta_group_significance_fn, permutations, seed=None):
     group1_group2_samples = groupings[group1_id] + groupings[group2_id]
     metadata = metadata[group1_group2_samples]
     distance_matrix = distance_matrix.filter(group1_group2_samples)
-    return beta_group_significance_fn(distance_matrix, metadata,
-                                      permutations=permutations)
+    return _seeded(seed, beta_group_significance_fn, distance_matrix,
+                   metadata, permutations=permutations)
+
+
+# the state shared by the pairwise tests run in a worker process
+_pairwise_worker_state = {}
+
+
+def _init_pairwise_worker(shm_name, shape, ids, groupings, metadata, method,
+                          permutations):
+    # Attaches to the distance matrix in shared memory, which is only ever
+    # read, rather than receiving a copy of it.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _pairwise_worker_state.update(
+        shm=shm,
+        distance_matrix=skbio.DistanceMatrix(data, ids, validate=False),
+        groupings=groupings, metadata=metadata,
+        beta_group_significance_fn=_beta_group_significance_fns[method],
+        permutations=permutations)
+
+
+def _run_pairwise_worker(group1_id, group2_id, seed):
+    state = _pairwise_worker_state
+    return _get_pairwise_group_significance_stats(
+        distance_matrix=state['distance_matrix'], group1_id=group1_id,
+        group2_id=group2_id, groupings=state['groupings'],
+        metadata=state['metadata'],
+        beta_group_significance_fn=state['beta_group_significance_fn'],
+        permutations=state['permutations'], seed=seed)
+
+
+# permutations of a pair of groups evaluated in one matrix multiplication
+_PERMANOVA_BATCH_SIZE = 128
+
+
+def _pseudo_f(total, within1, within2, n1, n2):
+    # PERMANOVA's pseudo-F of two groups of n1 and n2 samples, from the sums
+    # of squared distances over all (ordered) pairs of their samples, and
+    # over the pairs within each group
+    n = n1 + n2
+    ss_total = total / (2 * n)
+    ss_within = within1 / (2 * n1) + within2 / (2 * n2)
+    return (ss_total - ss_within) / (ss_within / (n - 2))
+
+
+def _permanova_p_value(squared, n1, stat, permutations, seed):
+    # The permutations of the pair's samples are drawn as indicator vectors
+    # of the first group, a batch at a time, and the sum of squared distances
+    # within the first group is x^T D x for every indicator vector x at once.
+    # The second group's follows from the row sums of D.
+    if permutations == 0:
+        return np.nan
+    rng = np.random.default_rng(seed)
+    n = squared.shape[0]
+    row_sums = squared.sum(axis=1)
+    total = row_sums.sum()
+    indicator = np.zeros(n)
+    indicator[:n1] = 1
+
+    n_extreme = 0
+    for start in range(0, permutations, _PERMANOVA_BATCH_SIZE):
+        size = min(_PERMANOVA_BATCH_SIZE, permutations - start)
+        x = rng.permuted(np.tile(indicator[:, None], size), axis=0)
+        within1 = np.einsum('ij,ij->j', squared @ x, x)
+        within2 = total - 2 * (row_sums @ x) + within1
+        perm_stats = _pseudo_f(total, within1, within2, n1, n - n1)
+        # the observed statistic is derived from different sums, so it is
+        # compared with a tolerance for rounding
+        n_extreme += np.sum((perm_stats >= stat) |
+                            np.isclose(perm_stats, stat, rtol=1e-12, atol=0))
+    return (n_extreme + 1) / (permutations + 1)
+
+
+def _pairwise_permanova(distance_matrix, pairs, groupings, permutations,
+                        n_jobs=1):
+    # The observed pseudo-F of every pair of groups is derived from a single
+    # group by group matrix of sums of squared distances, I^T D I, where I is
+    # the sample by group indicator matrix. The permutations of each pair are
+    # batched (see _permanova_p_value).
+    for group1_id, group2_id in pairs:
+        if len(groupings[group1_id]) == len(groupings[group2_id]) == 1:
+            raise ValueError('Pairwise PERMANOVA cannot be computed for '
+                             'groups %r and %r, as each contains a single '
+                             'sample.' % (group1_id, group2_id))
+
+    index = {id_: i for i, id_ in enumerate(distance_matrix.ids)}
+    positions = {group_id: np.array([index[sid] for sid in group],
+                                    dtype=np.intp)
+                 for group_id, group in groupings.items()}
+    group_index = {group_id: i for i, group_id in enumerate(groupings)}
+    squared = distance_matrix.data ** 2
+    indicator = np.zeros((len(index), len(groupings)))
+    for group_id, group in positions.items():
+        indicator[group, group_index[group_id]] = 1
+    group_sums = indicator.T @ (squared @ indicator)
+
+    def _test(group1_id, group2_id, seed):
+        i, j = group_index[group1_id], group_index[group2_id]
+        n1, n2 = len(positions[group1_id]), len(positions[group2_id])
+        stat = _pseudo_f(group_sums[i, i] + group_sums[j, j] +
+                         2 * group_sums[i, j], group_sums[i, i],
+                         group_sums[j, j], n1, n2)
+        pair = np.concatenate([positions[group1_id], positions[group2_id]])
+        p_value = _permanova_p_value(squared[np.ix_(pair, pair)], n1, stat,
+                                     permutations, seed)
+        return pd.Series(['PERMANOVA', 'pseudo-F', n1 + n2, 2, stat,
+                          p_value, permutations],
+                         index=['method name', 'test statistic name',
+                                'sample size', 'number of groups',
+                                'test statistic', 'p-value',
+                                'number of permutations'],
+                         name='PERMANOVA results')
+
+    # the permutations are drawn from independent generators, so the pairs
+    # can share threads
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        tasks = [pool.submit(_test, group1_id, group2_id, seed)
+                 for (group1_id, group2_id), seed in zip(
+                     pairs, _pairwise_seeds(len(pairs)))]
+        return [task.result() for task in tasks]
+
+
+def _get_pairwise_group_significance_results(
+        distance_matrix, pairs, groupings, metadata, method, permutations,
+        n_jobs=1):
+    if method == 'permanova':
+        return _pairwise_permanova(distance_matrix, pairs, groupings,
+                                   permutations, n_jobs=n_jobs)
+
+    seeds = _pairwise_seeds(len(pairs))
+    if n_jobs == 1 or len(pairs) < 2:
+        return [_get_pairwise_group_significance_stats(
+                    distance_matrix=distance_matrix, group1_id=group1_id,
+                    group2_id=group2_id, groupings=groupings,
+                    metadata=metadata,
+                    beta_group_significance_fn=(
+                        _beta_group_significance_fns[method]),
+                    permutations=permutations, seed=seed)
+                for (group1_id, group2_id), seed in zip(pairs, seeds)]
+
+    data = distance_matrix.data
+    shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+    try:
+        np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(pairs)),
+                initializer=_init_pairwise_worker,
+                initargs=(shm.name, data.shape, distance_matrix.ids,
+                          groupings, metadata, method,
+                          permutations)) as pool:
+            return list(pool.map(_run_pairwise_worker,
+                                 *zip(*pairs), seeds))
+    finally:
+        shm.close()
+        shm.unlink()
 
 
 def beta_group_significance(output_dir: str,
@@ -121,7 +382,13 @@ def beta_group_significance(output_dir: str,
                             metadata: qiime2.CategoricalMetadataColumn,
                             method: str = 'permanova',
                             pairwise: bool = False,
-                            permutations: int = 999) -> None:
+                            permutations: int = 999,
+                            compress_raw_data: bool = False,
+                            max_raw_data_rows: int = None,
+                            n_jobs: int = 1) -> None:
+    if n_jobs in (0, 'auto'):
+        n_jobs = get_available_cores()
+
     try:
         beta_group_significance_fn = _beta_group_significance_fns[method]
     except KeyError:
@@ -161,17 +428,10 @@ def beta_group_significance(output_dir: str,
         [(id, list(series.index))
          for id, series in natsorted(metadata.groupby(metadata))])
 
-    pairs_summary = pd.DataFrame(columns=['SubjectID1', 'SubjectID2', 'Group1',
-                                          'Group2', 'Distance'])
+    all_distances = _group_distances(distance_matrix, groupings)
     for group_id in groupings:
-        group_distances, x_ticklabels, group_pairs_summary = \
-            _get_distance_boxplot_data(distance_matrix, group_id, groupings)
-
-        group_pairs_summary = pd.DataFrame(
-            group_pairs_summary, columns=['SubjectID1', 'SubjectID2',
-                                          'Group1', 'Group2', 'Distance'])
-
-        pairs_summary = pd.concat([pairs_summary, group_pairs_summary])
+        group_distances, x_ticklabels = _group_boxplot_data(
+            all_distances, group_id, groupings)
 
         ax = sns.boxplot(data=group_distances, flierprops={
             'marker': 'o', 'markeredgecolor': 'black', 'markeredgewidth': 0.5,
@@ -192,22 +452,23 @@ def beta_group_significance(output_dir: str,
                                  urllib.parse.quote(str(group_id))))
         fig.clear()
 
-    pairs_summary.to_csv(os.path.join(output_dir, 'raw_data.tsv'), sep='\t')
+    if max_raw_data_rows == 0:
+        raw_data_fn, raw_data_rows, raw_data_pairs = None, 0, 0
+    else:
+        raw_data_fn, raw_data_rows, raw_data_pairs = _write_raw_data(
+            output_dir, all_distances, groupings, compress=compress_raw_data,
+            max_rows=max_raw_data_rows)
 
     result_html = q2templates.df_to_html(result.to_frame())
 
     if pairwise:
+        pairs = list(itertools.combinations(groupings, 2))
+        pairwise_stats = _get_pairwise_group_significance_results(
+            distance_matrix, pairs, groupings, metadata, method,
+            permutations, n_jobs=n_jobs)
         pairwise_results = []
-        for group1_id, group2_id in itertools.combinations(groupings, 2):
-            pairwise_result = \
-                _get_pairwise_group_significance_stats(
-                    distance_matrix=distance_matrix,
-                    group1_id=group1_id,
-                    group2_id=group2_id,
-                    groupings=groupings,
-                    metadata=metadata,
-                    beta_group_significance_fn=beta_group_significance_fn,
-                    permutations=permutations)
+        for (group1_id, group2_id), pairwise_result in zip(pairs,
+                                                           pairwise_stats):
             pairwise_results.append([group1_id,
                                      group2_id,
                                      pairwise_result['sample size'],
@@ -255,7 +516,10 @@ def beta_group_significance(output_dir: str,
         'group_rows': group_rows,
         'bootstrap_group_col_size': int(12 / row_count),
         'result': result_html,
-        'pairwise_results': pairwise_results_html
+        'pairwise_results': pairwise_results_html,
+        'raw_data_fn': raw_data_fn,
+        'raw_data_rows': raw_data_rows,
+        'raw_data_pairs': raw_data_pairs
     })
 
 
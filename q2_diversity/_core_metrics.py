@@ -6,48 +6,127 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import h5py
+import numpy as np
+from qiime2.plugin import get_available_cores
+from q2_types.feature_table import BIOMV210Format
+
+# Above this many samples a full eigendecomposition of each distance matrix
+# dominates the runtime of the core-metrics pipelines, so PCoA falls back to
+# the truncated (fsvd) solver unless a number of dimensions is requested.
+_PCOA_AUTO_MAX_SAMPLES = 5000
+_PCOA_AUTO_DIMENSIONS = 10
+
+# number of counts read from the BIOM file at once when summing samples
+_TOTALS_BLOCK_SIZE = 2 ** 22
+
+# Metrics available to core_metrics_selected, in the order their results are
+# computed and emitted. Values are the q2-diversity-lib action names.
+_CORE_ALPHA_METRICS = ('observed_features', 'shannon', 'pielou_e')
+_CORE_PHYLO_ALPHA_METRICS = ('faith_pd',)
+_CORE_BETA_METRICS = {'jaccard': 'jaccard', 'braycurtis': 'bray_curtis'}
+_CORE_PHYLO_BETA_METRICS = {'unweighted_unifrac': 'unweighted_unifrac',
+                            'weighted_unifrac': 'weighted_unifrac'}
+CORE_METRICS = {
+    'NONPHYLO': set(_CORE_ALPHA_METRICS) | set(_CORE_BETA_METRICS),
+    'PHYLO': (set(_CORE_PHYLO_ALPHA_METRICS) |
+              set(_CORE_PHYLO_BETA_METRICS)),
+}
+
+
+def _split_jobs(ctx, n_jobs, n_branches):
+    # When the pipeline is executed in parallel, independent branches run at
+    # the same time, so they share the job budget instead of each receiving
+    # all of it. Run serially, every branch can use the whole budget.
+    if not ctx.parallel:
+        return [n_jobs] * n_branches
+    if n_jobs in (0, 'auto'):
+        n_jobs = get_available_cores()
+    share, remainder = divmod(n_jobs, n_branches)
+    return [max(1, share + (i < remainder)) for i in range(n_branches)]
+
+
+def _n_samples(table):
+    # read from the BIOM file's header, so that the table isn't loaded into
+    # the pipeline's process just to be counted
+    with h5py.File(str(table.view(BIOMV210Format)), 'r') as fh:
+        return int(fh.attrs['shape'][1])
+
+
+def _sample_totals(table):
+    # Summed from the sample-major counts of the BIOM file a slice at a time,
+    # so that the table isn't loaded into the pipeline's process either.
+    with h5py.File(str(table.view(BIOMV210Format)), 'r') as fh:
+        indptr = fh['sample/matrix/indptr'][:]
+        data = fh['sample/matrix/data']
+        totals = np.zeros(len(indptr) - 1)
+        for start in range(0, len(data), _TOTALS_BLOCK_SIZE):
+            counts = data[start:start + _TOTALS_BLOCK_SIZE]
+            samples = np.searchsorted(
+                indptr, np.arange(start, start + len(counts)),
+                side='right') - 1
+            totals += np.bincount(samples, weights=counts,
+                                  minlength=len(totals))
+    return totals
+
+
+def _pcoa_dimensions(table, pcoa_dimensions, n_samples=None):
+    if pcoa_dimensions is not None:
+        return pcoa_dimensions
+    # rarefaction can only drop samples, so the input table's sample count
+    # bounds the size of every distance matrix computed from it
+    if n_samples is None:
+        n_samples = _n_samples(table)
+    if n_samples > _PCOA_AUTO_MAX_SAMPLES:
+        return _PCOA_AUTO_DIMENSIONS
+    return None
+
+
+def _pcoa_kwargs(pcoa_dimensions):
+    if pcoa_dimensions is None:
+        return {}
+    return {'number_of_dimensions': pcoa_dimensions}
+
 
 def core_metrics(ctx, table, sampling_depth, metadata, with_replacement=False,
-                 n_jobs=1, ignore_missing_samples=False):
+                 n_jobs=1, ignore_missing_samples=False,
+                 pcoa_dimensions=None):
     rarefy = ctx.get_action('feature_table', 'rarefy')
-    observed_features = ctx.get_action('diversity_lib', 'observed_features')
-    pielou_e = ctx.get_action('diversity_lib', 'pielou_evenness')
-    shannon = ctx.get_action('diversity_lib', 'shannon_entropy')
+    core_alpha_metrics = ctx.get_action('diversity', 'core_alpha_metrics')
     braycurtis = ctx.get_action('diversity_lib', 'bray_curtis')
     jaccard = ctx.get_action('diversity_lib', 'jaccard')
     pcoa = ctx.get_action('diversity', 'pcoa')
     emperor_plot = ctx.get_action('emperor', 'plot')
 
-    results = []
+    pcoa_kwargs = _pcoa_kwargs(_pcoa_dimensions(table, pcoa_dimensions))
+
     rarefied_table, = rarefy(table=table, sampling_depth=sampling_depth,
                              with_replacement=with_replacement)
-    results.append(rarefied_table)
-
-    for metric in (observed_features, shannon, pielou_e):
-        results += metric(table=rarefied_table)
 
-    dms = []
-    for metric in (jaccard, braycurtis):
-        beta_results = metric(table=rarefied_table, n_jobs=n_jobs)
-        results += beta_results
-        dms += beta_results
+    # Everything below only depends on the rarefied table, so each metric
+    # (and each distance matrix's PCoA and Emperor plot) is submitted as an
+    # independent branch before any result is consumed. Observed features,
+    # Shannon's entropy and Pielou's evenness share a single pass over the
+    # rarefied table.
+    alpha_vectors = core_alpha_metrics(table=rarefied_table)
 
-    pcoas = []
-    for dm in dms:
-        pcoa_results = pcoa(distance_matrix=dm)
-        results += pcoa_results
-        pcoas += pcoa_results
-
-    for pcoa in pcoas:
-        results += emperor_plot(pcoa=pcoa, metadata=metadata,
-                                ignore_missing_samples=ignore_missing_samples)
+    dms, pcoas, plots = [], [], []
+    for metric, metric_jobs in zip((jaccard, braycurtis),
+                                   _split_jobs(ctx, n_jobs, 2)):
+        dm, = metric(table=rarefied_table, n_jobs=metric_jobs)
+        pcoa_results, = pcoa(distance_matrix=dm, **pcoa_kwargs)
+        plots += emperor_plot(pcoa=pcoa_results, metadata=metadata,
+                              ignore_missing_samples=ignore_missing_samples)
+        dms.append(dm)
+        pcoas.append(pcoa_results)
 
-    return tuple(results)
+    return (rarefied_table, *alpha_vectors, *dms, *pcoas, *plots)
 
 
 def core_metrics_phylogenetic(ctx, table, phylogeny, sampling_depth, metadata,
                               with_replacement=False, n_jobs_or_threads=1,
-                              ignore_missing_samples=False):
+                              ignore_missing_samples=False,
+                              pcoa_dimensions=None):
     faith_pd = ctx.get_action('diversity_lib', 'faith_pd')
     unweighted_unifrac = ctx.get_action('diversity_lib', 'unweighted_unifrac')
     weighted_unifrac = ctx.get_action(
@@ -57,33 +136,232 @@ def core_metrics_phylogenetic(ctx, table, phylogeny, sampling_depth, metadata,
     emperor_plot = ctx.get_action('emperor', 'plot')
     core_metrics = ctx.get_action('diversity', 'core_metrics')
 
-    cr = core_metrics(table=table, sampling_depth=sampling_depth,
-                      metadata=metadata, with_replacement=with_replacement,
-                      n_jobs=n_jobs_or_threads,
-                      ignore_missing_samples=ignore_missing_samples)
+    core_jobs, unweighted_threads, weighted_threads = _split_jobs(
+        ctx, n_jobs_or_threads, 3)
+    pcoa_dimensions = _pcoa_dimensions(table, pcoa_dimensions)
+    pcoa_kwargs = _pcoa_kwargs(pcoa_dimensions)
 
-    faith_pd_vector, = faith_pd(table=cr.rarefied_table,
-                                phylogeny=phylogeny)
+    # Only artifact handles are held here; the underlying data lives in the
+    # archives. The nested results are unpacked straight away so that nothing
+    # but the outputs of this pipeline stays referenced.
+    (rarefied_table, *alpha_vectors, jaccard_dm, bray_curtis_dm,
+     jaccard_pcoa, bray_curtis_pcoa, jaccard_emperor,
+     bray_curtis_emperor) = core_metrics(
+        table=table, sampling_depth=sampling_depth, metadata=metadata,
+        with_replacement=with_replacement, n_jobs=core_jobs,
+        ignore_missing_samples=ignore_missing_samples,
+        pcoa_dimensions=pcoa_dimensions)
 
-    dms = []
-    dms += unweighted_unifrac(table=cr.rarefied_table, phylogeny=phylogeny,
-                              threads=n_jobs_or_threads)
-    dms += weighted_unifrac(table=cr.rarefied_table,
-                            phylogeny=phylogeny,
-                            threads=n_jobs_or_threads)
+    faith_pd_vector, = faith_pd(table=rarefied_table, phylogeny=phylogeny)
 
-    pcoas = []
-    for dm in dms:
-        pcoas += pcoa(distance_matrix=dm)
-
-    plots = []
-    for pcoa in pcoas:
-        plots += emperor_plot(pcoa=pcoa, metadata=metadata,
+    dms, pcoas, plots = [], [], []
+    for metric, threads in ((unweighted_unifrac, unweighted_threads),
+                            (weighted_unifrac, weighted_threads)):
+        dm, = metric(table=rarefied_table, phylogeny=phylogeny,
+                     threads=threads)
+        pcoa_results, = pcoa(distance_matrix=dm, **pcoa_kwargs)
+        plots += emperor_plot(pcoa=pcoa_results, metadata=metadata,
                               ignore_missing_samples=ignore_missing_samples)
+        dms.append(dm)
+        pcoas.append(pcoa_results)
 
     return (
-        cr.rarefied_table, faith_pd_vector, cr.observed_features_vector,
-        cr.shannon_vector, cr.evenness_vector, *dms,
-        cr.jaccard_distance_matrix, cr.bray_curtis_distance_matrix,
-        *pcoas, cr.jaccard_pcoa_results, cr.bray_curtis_pcoa_results,
-        *plots, cr.jaccard_emperor, cr.bray_curtis_emperor)
+        rarefied_table, faith_pd_vector, *alpha_vectors,
+        *dms, jaccard_dm, bray_curtis_dm,
+        *pcoas, jaccard_pcoa, bray_curtis_pcoa,
+        *plots, jaccard_emperor, bray_curtis_emperor)
+
+
+def _validate_selected_metrics(metrics, phylogeny, metadata, with_pcoa,
+                               with_emperor):
+    if metrics is None:
+        metrics = set(CORE_METRICS['NONPHYLO'])
+        if phylogeny is not None:
+            metrics |= CORE_METRICS['PHYLO']
+    else:
+        metrics = set(metrics)
+
+    unknown = metrics - CORE_METRICS['NONPHYLO'] - CORE_METRICS['PHYLO']
+    if unknown:
+        raise ValueError('Unknown core metric(s): %s'
+                         % ', '.join(sorted(unknown)))
+    if phylogeny is None and metrics & CORE_METRICS['PHYLO']:
+        raise ValueError('Phylogenetic metric(s) %s require a phylogeny.'
+                         % ', '.join(sorted(metrics & CORE_METRICS['PHYLO'])))
+    if with_emperor and not with_pcoa:
+        raise ValueError('Emperor plots are generated from the PCoA results, '
+                         'so `with_emperor` requires `with_pcoa`.')
+    if with_emperor and metadata is None:
+        raise ValueError('Metadata must be provided to generate Emperor '
+                         'plots.')
+    return metrics
+
+
+def _compute_selected_metrics(ctx, rarefied_table, metrics, phylogeny=None,
+                              metadata=None, with_pcoa=True,
+                              with_emperor=False, n_jobs_or_threads=1,
+                              ignore_missing_samples=False, pcoa_kwargs=None):
+    # Computes only the requested metrics (and, optionally, their PCoAs and
+    # Emperor plots) from an already rarefied table. Results are returned as
+    # dicts keyed by metric name.
+    pcoa = ctx.get_action('diversity', 'pcoa')
+    emperor_plot = ctx.get_action('emperor', 'plot')
+    if pcoa_kwargs is None:
+        pcoa_kwargs = {}
+
+    alpha_vectors = {}
+    core_alpha = [m for m in _CORE_ALPHA_METRICS if m in metrics]
+    if core_alpha:
+        core_alpha_metrics = ctx.get_action('diversity', 'core_alpha_metrics')
+        vectors = dict(zip(_CORE_ALPHA_METRICS,
+                           core_alpha_metrics(table=rarefied_table)))
+        alpha_vectors.update({m: vectors[m] for m in core_alpha})
+    if 'faith_pd' in metrics:
+        faith_pd = ctx.get_action('diversity_lib', 'faith_pd')
+        alpha_vectors['faith_pd'], = faith_pd(table=rarefied_table,
+                                              phylogeny=phylogeny)
+
+    beta_metrics = [m for m in (*_CORE_BETA_METRICS,
+                                *_CORE_PHYLO_BETA_METRICS) if m in metrics]
+    dms, pcoas, plots = {}, {}, {}
+    if not beta_metrics:
+        return alpha_vectors, dms, pcoas, plots
+
+    for metric, jobs in zip(beta_metrics, _split_jobs(ctx, n_jobs_or_threads,
+                                                      len(beta_metrics))):
+        if metric in _CORE_PHYLO_BETA_METRICS:
+            action = ctx.get_action('diversity_lib',
+                                    _CORE_PHYLO_BETA_METRICS[metric])
+            dms[metric], = action(table=rarefied_table, phylogeny=phylogeny,
+                                  threads=jobs)
+        else:
+            action = ctx.get_action('diversity_lib',
+                                    _CORE_BETA_METRICS[metric])
+            dms[metric], = action(table=rarefied_table, n_jobs=jobs)
+
+        if with_pcoa:
+            pcoas[metric], = pcoa(distance_matrix=dms[metric], **pcoa_kwargs)
+        if with_emperor:
+            plots[metric], = emperor_plot(
+                pcoa=pcoas[metric], metadata=metadata,
+                ignore_missing_samples=ignore_missing_samples)
+
+    return alpha_vectors, dms, pcoas, plots
+
+
+def core_metrics_selected(ctx, table, sampling_depth, phylogeny=None,
+                          metrics=None, metadata=None, with_replacement=False,
+                          with_pcoa=True, with_emperor=False,
+                          n_jobs_or_threads=1, ignore_missing_samples=False,
+                          pcoa_dimensions=None):
+    rarefy = ctx.get_action('feature_table', 'rarefy')
+
+    metrics = _validate_selected_metrics(metrics, phylogeny, metadata,
+                                         with_pcoa, with_emperor)
+    pcoa_kwargs = {}
+    if with_pcoa:
+        pcoa_kwargs = _pcoa_kwargs(_pcoa_dimensions(table, pcoa_dimensions))
+
+    rarefied_table, = rarefy(table=table, sampling_depth=sampling_depth,
+                             with_replacement=with_replacement)
+
+    alpha_vectors, dms, pcoas, plots = _compute_selected_metrics(
+        ctx, rarefied_table, metrics, phylogeny=phylogeny, metadata=metadata,
+        with_pcoa=with_pcoa, with_emperor=with_emperor,
+        n_jobs_or_threads=n_jobs_or_threads,
+        ignore_missing_samples=ignore_missing_samples,
+        pcoa_kwargs=pcoa_kwargs)
+
+    return rarefied_table, alpha_vectors, dms, pcoas, plots
+
+
+def _core_metrics_depth_key(name, depth):
+    return '%s_depth-%d' % (name, depth)
+
+
+def core_metrics_multiple_depths(ctx, table, sampling_depths, phylogeny=None,
+                                 metrics=None, metadata=None,
+                                 with_replacement=False, with_pcoa=True,
+                                 with_emperor=False, n_jobs_or_threads=1,
+                                 ignore_missing_samples=False,
+                                 pcoa_dimensions=None):
+    rarefy = ctx.get_action('feature_table', 'rarefy')
+
+    metrics = _validate_selected_metrics(metrics, phylogeny, metadata,
+                                         with_pcoa, with_emperor)
+    depths = sorted(set(sampling_depths), reverse=True)
+    if not depths:
+        raise ValueError('At least one sampling depth must be provided.')
+    totals = _sample_totals(table)
+    pcoa_kwargs = {}
+    if with_pcoa:
+        pcoa_kwargs = _pcoa_kwargs(_pcoa_dimensions(
+            table, pcoa_dimensions, n_samples=len(totals)))
+
+    rarefied_tables, alpha_vectors, dms, pcoas, plots = {}, {}, {}, {}, {}
+    # Subsampling without replacement is nested: rarefying a table that was
+    # already rarefied to a larger depth is equivalent to rarefying the
+    # original table, so each depth is drawn from the next larger one, which
+    # holds far fewer counts. That only holds if the larger depth didn't drop
+    # any sample that this depth keeps. Multinomial subsampling (with
+    # replacement) isn't nested, so every depth is drawn from the original.
+    source, previous_depth = table, None
+    for depth, jobs in zip(depths, _split_jobs(ctx, n_jobs_or_threads,
+                                               len(depths))):
+        if previous_depth is not None and \
+                ((totals >= depth) & (totals < previous_depth)).any():
+            source = table
+        rarefied_table, = rarefy(table=source, sampling_depth=depth,
+                                 with_replacement=with_replacement)
+        if not with_replacement:
+            source, previous_depth = rarefied_table, depth
+
+        results = _compute_selected_metrics(
+            ctx, rarefied_table, metrics, phylogeny=phylogeny,
+            metadata=metadata, with_pcoa=with_pcoa, with_emperor=with_emperor,
+            n_jobs_or_threads=jobs,
+            ignore_missing_samples=ignore_missing_samples,
+            pcoa_kwargs=pcoa_kwargs)
+
+        rarefied_tables['depth-%d' % depth] = rarefied_table
+        for collection, computed in zip(
+                (alpha_vectors, dms, pcoas, plots), results):
+            collection.update(
+                {_core_metrics_depth_key(metric, depth): result
+                 for metric, result in computed.items()})
+
+    return rarefied_tables, alpha_vectors, dms, pcoas, plots
+
+
+def core_metrics_incremental(ctx, table, rarefied_table,
+                             jaccard_distance_matrix,
+                             bray_curtis_distance_matrix, sampling_depth,
+                             jaccard_pcoa_results=None,
+                             bray_curtis_pcoa_results=None,
+                             with_replacement=False):
+    rarefy = ctx.get_action('feature_table', 'rarefy')
+    merge = ctx.get_action('feature_table', 'merge')
+    extend_distance_matrix = ctx.get_action('diversity',
+                                            'extend_distance_matrix')
+    pcoa_project = ctx.get_action('diversity', 'pcoa_project')
+
+    # only the new samples are rarefied, and only their distances to the
+    # previously rarefied samples (and to each other) are computed
+    new_rarefied_table, = rarefy(table=table, sampling_depth=sampling_depth,
+                                 with_replacement=with_replacement)
+    merged_table, = merge(tables=[rarefied_table, new_rarefied_table])
+
+    dms, pcoas = [], {}
+    for metric, dm, pcoa_results in (
+            ('jaccard', jaccard_distance_matrix, jaccard_pcoa_results),
+            ('braycurtis', bray_curtis_distance_matrix,
+             bray_curtis_pcoa_results)):
+        extended_dm, = extend_distance_matrix(
+            distance_matrix=dm, table=rarefied_table,
+            new_table=new_rarefied_table, metric=metric)
+        dms.append(extended_dm)
+        if pcoa_results is not None:
+            pcoas[metric], = pcoa_project(pcoa=pcoa_results,
+                                          distance_matrix=extended_dm)
+
+    return (merged_table, *dms, pcoas)
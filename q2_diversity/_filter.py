@@ -9,24 +9,58 @@
 import skbio
 import qiime2
 
+import numpy as np
 import pandas as pd
+from natsort import natsorted
 
 
 def filter_distance_matrix(distance_matrix: skbio.DistanceMatrix,
                            metadata: qiime2.Metadata,
                            where: str = None,
                            exclude_ids: bool = False) -> skbio.DistanceMatrix:
-    ids_to_keep = metadata.get_ids(where=where)
+    selected = metadata.get_ids(where=where)
+    ids = distance_matrix.ids
+    keep = np.fromiter((i in selected for i in ids), dtype=bool,
+                       count=len(ids))
     if exclude_ids:
-        ids_to_keep = set(distance_matrix.ids) - set(ids_to_keep)
-    # NOTE: there is no guaranteed ordering to output distance matrix because
-    # `ids_to_keep` is a set, and `DistanceMatrix.filter` uses its iteration
-    # order.
-    try:
-        return distance_matrix.filter(ids_to_keep, strict=False)
-    except skbio.stats.distance.DissimilarityMatrixError:
+        keep = ~keep
+    if not keep.any():
         raise ValueError(
             "All samples were filtered out of the distance matrix.")
+    if keep.all():
+        return distance_matrix
+
+    # The samples keep their order in the input distance matrix. The
+    # submatrix of a valid distance matrix is valid, so it isn't validated
+    # again.
+    positions = np.flatnonzero(keep)
+    return skbio.DistanceMatrix(
+        distance_matrix.data[np.ix_(positions, positions)],
+        [ids[i] for i in positions], validate=False)
+
+
+def partition_distance_matrix(
+        distance_matrix: skbio.DistanceMatrix,
+        metadata: qiime2.CategoricalMetadataColumn) -> skbio.DistanceMatrix:
+    groups = metadata.drop_missing_values().to_series()
+    groups = groups.reindex(distance_matrix.ids).dropna()
+    if groups.empty:
+        raise ValueError('None of the samples in the distance matrix have a '
+                         'value in the metadata column.')
+
+    # the samples of each group are taken in the order of the distance
+    # matrix, so that the partitions are deterministic
+    positions = pd.Series(np.arange(len(distance_matrix.ids)),
+                          index=distance_matrix.ids)[groups.index]
+    ids = np.asarray(distance_matrix.ids, dtype=object)
+    partitions = {}
+    grouped = positions.groupby(groups.values).indices
+    for value in natsorted(grouped):
+        members = positions.values[grouped[value]]
+        partitions[str(value)] = skbio.DistanceMatrix(
+            distance_matrix.data[np.ix_(members, members)], ids[members],
+            validate=False)
+    return partitions
 
 
 def filter_alpha_diversity(alpha_diversity: pd.Series,
@@ -55,10 +89,57 @@ def filter_alpha_diversity(alpha_diversity: pd.Series,
 
     """
     ids_to_keep = metadata.get_ids(where=where)
-    if exclude_ids:
-        ids_to_keep = set(alpha_diversity.index) - set(ids_to_keep)
-    filtered_metric = alpha_diversity[alpha_diversity.index.isin(ids_to_keep)]
+    filtered_metric = _filter_alpha_diversity(alpha_diversity, ids_to_keep,
+                                              exclude_ids)
     if filtered_metric.empty:
         raise ValueError(
             "All samples were filtered out of the alpha diversity artifact.")
     return filtered_metric
+
+
+def _filter_alpha_diversity(alpha_diversity, ids_to_keep, exclude_ids):
+    keep = alpha_diversity.index.isin(ids_to_keep)
+    if exclude_ids:
+        keep = ~keep
+    return alpha_diversity[keep]
+
+
+def filter_alpha_diversity_multiple(alpha_diversities: pd.Series,
+                                    metadata: qiime2.Metadata,
+                                    where: str = None,
+                                    exclude_ids: bool = False) -> pd.Series:
+    """
+    Filters a collection of SampleData[AlphaDiversity] using `metadata`.
+
+    The samples to keep are selected from the metadata once, and applied to
+    every alpha diversity vector.
+
+    Parameters
+    ----------
+    alpha_diversities : dict of str -> pd.Series
+        The alpha diversity metrics, indexed by sample.
+    metadata : qiime2.Metadata
+        The metadata object to be used for filtering.
+    where : str, optional
+        A SQLite WHERE clause specifying which samples to select from the
+        metadata.
+    exclude_ids : bool, optional
+        Whether to keep (default) or exclude the selected IDs in the metadata.
+
+    Returns
+    -------
+    dict of str -> pd.Series
+        The filtered alpha diversity values, with the keys of
+        `alpha_diversities`.
+
+    """
+    ids_to_keep = metadata.get_ids(where=where)
+    filtered = {}
+    for key, alpha_diversity in alpha_diversities.items():
+        filtered[key] = _filter_alpha_diversity(alpha_diversity, ids_to_keep,
+                                                exclude_ids)
+        if filtered[key].empty:
+            raise ValueError(
+                "All samples were filtered out of the alpha diversity "
+                "artifact %r." % key)
+    return filtered
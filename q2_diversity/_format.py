@@ -0,0 +1,119 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import qiime2.plugin.model as model
+from qiime2.plugin import ValidationError
+
+
+NEIGHBOR_GRAPH_COLUMNS = ['sample-id', 'neighbor-id', 'distance']
+
+
+class NeighborGraphFormat(model.TextFileFormat):
+    # One line per edge, from each sample to each of its nearest neighbors.
+    def _validate_(self, level):
+        n_records = {'min': 5, 'max': None}[level]
+        with self.open() as fh:
+            header = fh.readline().rstrip('\n').split('\t')
+            if header != NEIGHBOR_GRAPH_COLUMNS:
+                raise ValidationError(
+                    'The header must contain the columns %s, found %s.'
+                    % (', '.join(NEIGHBOR_GRAPH_COLUMNS), ', '.join(header)))
+            for line_number, line in enumerate(fh, start=2):
+                if n_records is not None and line_number - 1 > n_records:
+                    break
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != len(NEIGHBOR_GRAPH_COLUMNS):
+                    raise ValidationError(
+                        'Line %d has %d fields, expected %d.'
+                        % (line_number, len(fields),
+                           len(NEIGHBOR_GRAPH_COLUMNS)))
+                try:
+                    float(fields[2])
+                except ValueError:
+                    raise ValidationError(
+                        'The distance on line %d is not a number: %r.'
+                        % (line_number, fields[2]))
+
+
+NeighborGraphDirectoryFormat = model.SingleFileDirectoryFormat(
+    'NeighborGraphDirectoryFormat', 'neighbor-graph.tsv', NeighborGraphFormat)
+
+
+class DistanceBlockFormat(model.TextFileFormat):
+    # A rectangular block of distances, from the samples labelling the rows
+    # to the samples labelling the columns.
+    def _validate_(self, level):
+        n_records = {'min': 5, 'max': None}[level]
+        with self.open() as fh:
+            header = fh.readline().rstrip('\n').split('\t')
+            if header[0] != '':
+                raise ValidationError(
+                    'The first field of the header must be empty, found %r.'
+                    % header[0])
+            for line_number, line in enumerate(fh, start=2):
+                if n_records is not None and line_number - 1 > n_records:
+                    break
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != len(header):
+                    raise ValidationError(
+                        'Line %d has %d fields, expected %d.'
+                        % (line_number, len(fields), len(header)))
+                try:
+                    [float(field) for field in fields[1:]]
+                except ValueError:
+                    raise ValidationError(
+                        'Line %d contains a distance that is not a number.'
+                        % line_number)
+
+
+DistanceBlockDirectoryFormat = model.SingleFileDirectoryFormat(
+    'DistanceBlockDirectoryFormat', 'distance-block.tsv', DistanceBlockFormat)
+
+
+class DistanceMatrixIdsFormat(model.TextFileFormat):
+    # One sample id per line, in the order of the distance matrix.
+    def _validate_(self, level):
+        with self.open() as fh:
+            for line_number, line in enumerate(fh, start=1):
+                if not line.rstrip('\n'):
+                    raise ValidationError('Line %d is empty.' % line_number)
+
+
+class CondensedDistancesFormat(model.BinaryFileFormat):
+    # The distances above the diagonal of a distance matrix, row by row (the
+    # condensed form of scipy.spatial.distance), as a one-dimensional NumPy
+    # array of double precision floats.
+    def _validate_(self, level):
+        try:
+            distances = np.load(str(self), mmap_mode='r')
+        except (OSError, ValueError) as e:
+            raise ValidationError('Not a NumPy array file: %s' % e)
+        if distances.ndim != 1:
+            raise ValidationError('The distances must be a one-dimensional '
+                                  'array, found %d dimensions.'
+                                  % distances.ndim)
+        if distances.dtype != np.float64:
+            raise ValidationError('The distances must be double precision '
+                                  'floats, found %s.' % distances.dtype)
+
+
+class CondensedDistanceMatrixDirectoryFormat(model.DirectoryFormat):
+    # The distance matrix written by beta_tiled, which fills the distances
+    # through a memory map one tile at a time. It is only an intermediate:
+    # it is converted to the text DistanceMatrixDirectoryFormat when saved.
+    ids = model.File('ids.txt', format=DistanceMatrixIdsFormat)
+    distances = model.File('distances.npy', format=CondensedDistancesFormat)
+
+    def _validate_(self, level):
+        with open(str(self.path / 'ids.txt')) as fh:
+            n = sum(1 for _ in fh)
+        size = np.load(str(self.path / 'distances.npy'), mmap_mode='r').size
+        if size != n * (n - 1) // 2:
+            raise ValidationError('%d samples have %d distances, found %d.'
+                                  % (n, n * (n - 1) // 2, size))
@@ -10,6 +10,7 @@ from sklearn.manifold import TSNE
 import skbio.stats.ordination
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
 # Ignore warnings related to deprecated behavior umap is using in numba
 import warnings
@@ -35,27 +36,116 @@ def pcoa(distance_matrix: skbio.DistanceMatrix,
             inplace=False)
 
 
+def pcoa_project(pcoa: skbio.OrdinationResults,
+                 distance_matrix: skbio.DistanceMatrix
+                 ) -> skbio.OrdinationResults:
+    ordinated = pcoa.samples.index
+    missing = ordinated.difference(distance_matrix.ids)
+    if len(missing) > 0:
+        raise ValueError('The distance matrix must contain all of the '
+                         'ordinated samples. Missing: %s'
+                         % ', '.join(sorted(missing)))
+    ordinated_ids = set(ordinated)
+    new_ids = [i for i in distance_matrix.ids if i not in ordinated_ids]
+    if not new_ids:
+        return pcoa
+
+    # Gower's (1968) add-a-point: the new samples' squared distances to the
+    # ordinated samples are double-centered against the original Gower
+    # matrix and projected onto the existing eigenvectors.
+    positions = {id_: i for i, id_ in enumerate(distance_matrix.ids)}
+    rows = [positions[i] for i in new_ids]
+    columns = [positions[i] for i in ordinated]
+    squared = distance_matrix.data[np.ix_(columns, columns)] ** 2
+    new_squared = distance_matrix.data[np.ix_(rows, columns)] ** 2
+    centered = -0.5 * (new_squared - new_squared.mean(axis=1, keepdims=True)
+                       - squared.mean(axis=0) + squared.mean())
+
+    eigvals = pcoa.eigvals.values
+    coordinates = pcoa.samples.values
+    projected = np.zeros((len(new_ids), coordinates.shape[1]))
+    positive = eigvals > 0
+    projected[:, positive] = \
+        centered @ coordinates[:, positive] / eigvals[positive]
+
+    samples = pd.concat([
+        pcoa.samples,
+        pd.DataFrame(projected, index=new_ids, columns=pcoa.samples.columns)])
+    return skbio.OrdinationResults(
+        short_method_name=pcoa.short_method_name,
+        long_method_name=pcoa.long_method_name,
+        eigvals=pcoa.eigvals,
+        proportion_explained=pcoa.proportion_explained,
+        samples=samples)
+
+
 def pcoa_biplot(pcoa: skbio.OrdinationResults,
                 features: pd.DataFrame) -> skbio.OrdinationResults:
     return skbio.stats.ordination.pcoa_biplot(pcoa, features)
 
 
-def tsne(distance_matrix: skbio.DistanceMatrix,
+def _validate_ordination_inputs(distance_matrix, neighbor_graph):
+    if (distance_matrix is None) == (neighbor_graph is None):
+        raise ValueError('Exactly one of a distance matrix or a neighbor '
+                         'graph must be provided.')
+
+
+def _neighbor_graph(neighbor_graph):
+    # The graph's samples, in order of first appearance, and its k nearest
+    # neighbor indices and distances as (samples x k) arrays.
+    ids = pd.unique(neighbor_graph['sample-id'])
+    positions = pd.Index(ids)
+    rows = positions.get_indexer(neighbor_graph['sample-id'])
+    columns = positions.get_indexer(neighbor_graph['neighbor-id'])
+    if (columns < 0).any():
+        raise ValueError('Every neighbor in the graph must also be a sample '
+                         'of the graph.')
+    k = np.bincount(rows, minlength=len(ids))
+    if (k != k[0]).any():
+        raise ValueError('Every sample in the graph must have the same '
+                         'number of neighbors.')
+
+    order = np.argsort(rows, kind='stable')
+    shape = (len(ids), k[0])
+    neighbors = columns[order].reshape(shape)
+    distances = neighbor_graph['distance'].values[order].reshape(shape)
+    return ids, neighbors, distances
+
+
+def _sparse_distances(neighbors, distances):
+    # a sparse precomputed distance matrix, where the distances that aren't
+    # stored are treated as infinite
+    n, k = neighbors.shape
+    return scipy.sparse.csr_matrix(
+        (distances.ravel(), neighbors.ravel(), np.arange(0, n * k + 1, k)),
+        shape=(n, n))
+
+
+def tsne(distance_matrix: skbio.DistanceMatrix = None,
          number_of_dimensions: int = 2,
          perplexity: float = 25.0,
          n_iter: int = 1000,
          learning_rate: float = 200.0,
          early_exaggeration: float = 12.0,
-         random_state: int = None) -> skbio.OrdinationResults:
-
-    data = distance_matrix.data
-    ids = distance_matrix.ids
+         random_state: int = None,
+         neighbor_graph: pd.DataFrame = None) -> skbio.OrdinationResults:
+    _validate_ordination_inputs(distance_matrix, neighbor_graph)
+
+    if neighbor_graph is None:
+        data = distance_matrix.data
+        ids = distance_matrix.ids
+        kwargs = {}
+    else:
+        # only the distances to each sample's nearest neighbors are used
+        ids, neighbors, distances = _neighbor_graph(neighbor_graph)
+        data = _sparse_distances(neighbors, distances)
+        kwargs = {'metric': 'precomputed', 'init': 'random'}
 
     tsne = TSNE(number_of_dimensions, perplexity=perplexity,
                 learning_rate=learning_rate,
                 n_iter=n_iter,
                 early_exaggeration=early_exaggeration,
-                random_state=random_state).fit_transform(data)
+                random_state=random_state, **kwargs).fit_transform(data)
 
     if number_of_dimensions == 2:
         number_of_dimensions = 3
@@ -74,19 +164,39 @@ def tsne(distance_matrix: skbio.DistanceMatrix,
     )
 
 
-def umap(distance_matrix: skbio.DistanceMatrix,
+def umap(distance_matrix: skbio.DistanceMatrix = None,
          number_of_dimensions: int = 2,
          n_neighbors: int = 15,
          min_dist: float = 0.4,
-         random_state: int = None) -> skbio.OrdinationResults:
-
-    data = distance_matrix.data
-    ids = distance_matrix.ids
+         random_state: int = None,
+         neighbor_graph: pd.DataFrame = None) -> skbio.OrdinationResults:
+    _validate_ordination_inputs(distance_matrix, neighbor_graph)
+
+    if neighbor_graph is None:
+        data = distance_matrix.data
+        ids = distance_matrix.ids
+        kwargs = {}
+    else:
+        # UMAP's neighbor search is replaced by the graph, in which UMAP
+        # expects every sample to be its own nearest neighbor
+        ids, neighbors, distances = _neighbor_graph(neighbor_graph)
+        n = len(ids)
+        neighbors = np.hstack([np.arange(n)[:, None], neighbors])
+        distances = np.hstack([np.zeros((n, 1)), distances])
+        if n_neighbors > neighbors.shape[1]:
+            raise ValueError('n_neighbors (%d) cannot exceed the number of '
+                             'neighbors in the graph plus one (%d).'
+                             % (n_neighbors, neighbors.shape[1]))
+        data = _sparse_distances(neighbors, distances)
+        kwargs = {'metric': 'precomputed',
+                  'precomputed_knn': (neighbors[:, :n_neighbors],
+                                      distances[:, :n_neighbors], None)}
 
     umap_results = up.UMAP(n_components=number_of_dimensions,
                            n_neighbors=n_neighbors,
                            min_dist=min_dist,
-                           random_state=random_state).fit_transform(data)
+                           random_state=random_state,
+                           **kwargs).fit_transform(data)
 
     if number_of_dimensions == 2:
         number_of_dimensions = 3
@@ -0,0 +1,17 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+
+# The keys of the rarefied iterations in the collections produced by (and
+# passed back to) the alpha and beta rarefaction actions.
+def _rarefaction_depth_key(metric, depth):
+    return '%s_depth-%d' % (metric, depth)
+
+
+def _rarefaction_iteration_key(metric, depth, iteration):
+    return '%s_iter-%d' % (_rarefaction_depth_key(metric, depth), iteration)
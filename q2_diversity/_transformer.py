@@ -0,0 +1,78 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from q2_types.distance_matrix import DistanceMatrixDirectoryFormat
+
+from .plugin_setup import plugin
+from ._format import (NeighborGraphFormat, NEIGHBOR_GRAPH_COLUMNS,
+                      DistanceBlockFormat,
+                      CondensedDistanceMatrixDirectoryFormat)
+from ._beta._method import _condensed_rows
+
+# number of distances of the square matrix formatted at once when writing a
+# condensed distance matrix as text
+_LSMAT_BLOCK_SIZE = 2 ** 22
+
+
+@plugin.register_transformer
+def _1(data: pd.DataFrame) -> NeighborGraphFormat:
+    ff = NeighborGraphFormat()
+    data.to_csv(str(ff), sep='\t', index=False,
+                columns=NEIGHBOR_GRAPH_COLUMNS)
+    return ff
+
+
+@plugin.register_transformer
+def _2(ff: NeighborGraphFormat) -> pd.DataFrame:
+    return pd.read_csv(str(ff), sep='\t',
+                       dtype={'sample-id': str, 'neighbor-id': str,
+                              'distance': float})
+
+
+@plugin.register_transformer
+def _3(data: pd.DataFrame) -> DistanceBlockFormat:
+    ff = DistanceBlockFormat()
+    data.to_csv(str(ff), sep='\t', index_label='')
+    return ff
+
+
+@plugin.register_transformer
+def _4(ff: DistanceBlockFormat) -> pd.DataFrame:
+    data = pd.read_csv(str(ff), sep='\t', index_col=0, dtype=str)
+    data.index.name = None
+    return data.astype(float)
+
+
+def _read_ids(ff):
+    with open(str(ff.path / 'ids.txt')) as fh:
+        return [line.rstrip('\n') for line in fh]
+
+
+@plugin.register_transformer
+def _5(ff: CondensedDistanceMatrixDirectoryFormat
+       ) -> DistanceMatrixDirectoryFormat:
+    # Written a block of rows at a time, each row formatted with a single
+    # string operation (as np.savetxt does), so that only the block is held
+    # in memory.
+    ids = _read_ids(ff)
+    n = len(ids)
+    distances = np.load(str(ff.path / 'distances.npy'), mmap_mode='r')
+    row_format = '\t'.join(['%.17g'] * n)
+    block_size = max(1, _LSMAT_BLOCK_SIZE // max(1, n))
+
+    result = DistanceMatrixDirectoryFormat()
+    with open(str(result.path / 'distance-matrix.tsv'), 'w') as fh:
+        fh.write('\t%s\n' % '\t'.join(ids))
+        for start in range(0, n, block_size):
+            rows = slice(start, min(start + block_size, n))
+            block = _condensed_rows(distances, n, rows)
+            fh.writelines('%s\t%s\n' % (id_, row_format % tuple(row))
+                          for id_, row in zip(ids[rows], block))
+    return result
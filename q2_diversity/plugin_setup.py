@@ -6,9 +6,12 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import importlib
+
 from qiime2.plugin import (Plugin, Str, Properties, Choices, Int, Bool, Range,
                            Float, Set, Visualization, Metadata, MetadataColumn,
-                           Categorical, Numeric, Citations, Threads)
+                           Categorical, Numeric, Citations, Threads,
+                           Collection, List)
 import q2_diversity
 from q2_diversity import _alpha as alpha
 from q2_diversity import _beta as beta
@@ -20,6 +23,15 @@ from q2_types.sample_data import AlphaDiversity, SampleData
 from q2_types.tree import Phylogeny, Rooted
 from q2_types.ordination import PCoAResults, ProcrustesStatistics
 
+from q2_diversity._type import NeighborGraph, DistanceBlock
+from q2_diversity._format import (NeighborGraphFormat,
+                                  NeighborGraphDirectoryFormat,
+                                  DistanceBlockFormat,
+                                  DistanceBlockDirectoryFormat,
+                                  DistanceMatrixIdsFormat,
+                                  CondensedDistancesFormat,
+                                  CondensedDistanceMatrixDirectoryFormat)
+
 citations = Citations.load('citations.bib', package='q2_diversity')
 
 
@@ -50,6 +62,34 @@ n_jobs_or_threads_description = (
     'created for each identified CPU core on the host.'
 )
 
+pcoa_dimensions_description = (
+    'The number of dimensions to compute for each PCoA. If provided, the '
+    'fast, heuristic eigendecomposition algorithm fsvd is used instead of '
+    'computing the full decomposition. By default the full decomposition is '
+    'computed, unless the table contains more than %d samples, in which case '
+    'only the first %d dimensions are computed with fsvd.'
+    % (q2_diversity._core_metrics._PCOA_AUTO_MAX_SAMPLES,
+       q2_diversity._core_metrics._PCOA_AUTO_DIMENSIONS)
+)
+
+sketch_size_description = (
+    'The number of entries in each sample\'s sketch. The standard error of '
+    'each estimated distance is at most 1 / (2 * sqrt(sketch_size)) for '
+    'jaccard and 1 / sqrt(sketch_size) for braycurtis.'
+)
+
+block_size_description = (
+    'The number of samples per block when the distance matrix is computed in '
+    'tiles. Tiles are written to a memory-mapped file on disk as they are '
+    'computed, so memory use is bounded by the block size rather than by the '
+    'number of samples.'
+)
+
+parallel_budget_description = (
+    'When this pipeline is run in parallel, independent metrics are computed '
+    'concurrently and share this budget rather than each using all of it.'
+)
+
 plugin = Plugin(
     name='diversity',
     version=q2_diversity.__version__,
@@ -62,6 +102,16 @@ plugin = Plugin(
     short_description='Plugin for exploring community diversity.',
 )
 
+plugin.register_formats(NeighborGraphFormat, NeighborGraphDirectoryFormat,
+                        DistanceBlockFormat, DistanceBlockDirectoryFormat,
+                        DistanceMatrixIdsFormat, CondensedDistancesFormat,
+                        CondensedDistanceMatrixDirectoryFormat)
+plugin.register_semantic_types(NeighborGraph, DistanceBlock)
+plugin.register_semantic_type_to_format(
+    NeighborGraph, artifact_format=NeighborGraphDirectoryFormat)
+plugin.register_semantic_type_to_format(
+    DistanceBlock, artifact_format=DistanceBlockDirectoryFormat)
+
 plugin.pipelines.register_function(
     function=q2_diversity.beta_phylogenetic,
     inputs={'table':
@@ -108,6 +158,55 @@ plugin.pipelines.register_function(
                  " for all pairs of samples in a feature table.")
 )
 
+plugin.pipelines.register_function(
+    function=q2_diversity.beta_phylogenetic_multiple,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metrics': Set[Str % Choices(beta.METRICS['PHYLO']['IMPL'] |
+                                             beta.METRICS['PHYLO']['UNIMPL'])],
+                'threads': Threads,
+                'variance_adjusted': Bool,
+                'alphas': List[Float % Range(0, 1, inclusive_end=True)],
+                'bypass_tips': Bool},
+    outputs=[('distance_matrices', Collection[DistanceMatrix])],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.'),
+        'phylogeny': ('Phylogenetic tree containing tip identifiers that '
+                      'correspond to the feature identifiers in the table. '
+                      'This tree can contain tip ids that are not present in '
+                      'the table, but all feature ids in the table must be '
+                      'present in this tree.')
+    },
+    parameter_descriptions={
+        'metrics': 'The beta diversity metrics to be computed.',
+        'threads': '%s %s' % (threads_description,
+                              parallel_budget_description),
+        'variance_adjusted': ('Perform variance adjustment based on Chang et '
+                              'al. BMC Bioinformatics 2011. Applies to every '
+                              'metric.'),
+        'alphas': ('The values of alpha for which generalized_unifrac is '
+                   'computed. Only allowed when generalized_unifrac is one '
+                   'of the chosen metrics. By default generalized_unifrac is '
+                   'computed once, with alpha=1.0.'),
+        'bypass_tips': ('In a bifurcating tree, the tips make up about 50% of '
+                        'the nodes in a tree. By ignoring them, specificity '
+                        'can be traded for reduced compute time. This has the'
+                        ' effect of collapsing the phylogeny, and is analogous'
+                        ' (in concept) to moving from 99% to 97% OTUs')
+    },
+    output_descriptions={
+        'distance_matrices': ('The resulting distance matrices, keyed by '
+                              'metric, and by alpha for generalized_unifrac '
+                              '(e.g. `generalized_unifrac_alpha-0.5`).')
+    },
+    name='Beta diversity (multiple phylogenetic metrics)',
+    description=("Computes several phylogenetic beta diversity metrics, or "
+                 "generalized UniFrac at several values of alpha, for all "
+                 "pairs of samples in a feature table in one invocation.")
+)
+
 plugin.pipelines.register_function(
     function=q2_diversity.beta,
     inputs={'table':
@@ -117,6 +216,10 @@ plugin.pipelines.register_function(
                                 beta.METRICS['NONPHYLO']['UNIMPL']),
         'pseudocount': Int % Range(1, None),
         'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+        'approximate': Bool,
+        'sketch_size': Int % Range(1, None),
+        'sparse': Bool,
     },
     outputs=[('distance_matrix', DistanceMatrix)],
     input_descriptions={
@@ -127,7 +230,21 @@ plugin.pipelines.register_function(
         'metric': 'The beta diversity metric to be computed.',
         'pseudocount': ('A pseudocount to handle zeros for compositional '
                         'metrics.  This is ignored for other metrics.'),
-        'n_jobs': n_jobs_description
+        'n_jobs': n_jobs_description,
+        'block_size': ('%s By default the distance matrix is computed in '
+                       'memory. Cannot be combined with `approximate` or '
+                       '`sparse`.' % block_size_description),
+        'approximate': ('Estimate the distances from per-sample sketches '
+                        'instead of computing them exactly. Only supported '
+                        'for jaccard and braycurtis. Cannot be combined '
+                        'with `block_size` or `sparse`.'),
+        'sketch_size': ('%s This is ignored unless `approximate` is True.'
+                        % sketch_size_description),
+        'sparse': ('Compute the distances without densifying the table, in '
+                   'time proportional to its number of nonzero entries. '
+                   'This is faster for tables where most entries are zero. '
+                   'Only supported for jaccard and braycurtis. Cannot be '
+                   'combined with `block_size` or `approximate`.')
     },
     output_descriptions={'distance_matrix': 'The resulting distance matrix.'},
     name='Beta diversity',
@@ -135,6 +252,128 @@ plugin.pipelines.register_function(
                  "pairs of samples in a feature table.")
 )
 
+plugin.methods.register_function(
+    function=q2_diversity.beta_multiple,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={
+        'metrics': Set[Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
+                                     beta.METRICS['NONPHYLO']['UNIMPL'])],
+        'pseudocount': Int % Range(1, None),
+        'n_jobs': Threads,
+    },
+    outputs=[('distance_matrices', Collection[DistanceMatrix])],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={
+        'metrics': 'The beta diversity metrics to be computed.',
+        'pseudocount': ('A pseudocount to handle zeros for compositional '
+                        'metrics.  This is ignored for other metrics.'),
+        'n_jobs': ('%s All metrics are computed on a single pool of this '
+                   'many threads.' % n_jobs_description)
+    },
+    output_descriptions={
+        'distance_matrices': ('The resulting distance matrices, keyed by '
+                              'metric.')
+    },
+    name='Beta diversity (multiple metrics)',
+    description=("Computes several non-phylogenetic beta diversity metrics "
+                 "for all pairs of samples in a feature table. The table is "
+                 "loaded once, and each transformation of it (e.g. "
+                 "presence/absence or centered log-ratio) is computed once "
+                 "and shared by the metrics that need it.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.beta_tiled,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={
+        'metric': Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
+                                beta.METRICS['NONPHYLO']['UNIMPL']),
+        'pseudocount': Int % Range(1, None),
+        'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+    },
+    outputs=[('distance_matrix', DistanceMatrix)],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'pseudocount': ('A pseudocount to handle zeros for compositional '
+                        'metrics.  This is ignored for other metrics.'),
+        'n_jobs': n_jobs_description,
+        'block_size': block_size_description
+    },
+    output_descriptions={'distance_matrix': 'The resulting distance matrix.'},
+    name='Beta diversity (tiled)',
+    description=("Computes a user-specified beta diversity metric for all "
+                 "pairs of samples in a feature table, one tile of the "
+                 "distance matrix at a time, for tables with too many "
+                 "samples for the distance matrix to be held in memory.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.beta_approximate,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={
+        'metric': Str % Choices(beta.SKETCH_METRICS),
+        'sketch_size': Int % Range(1, None),
+        'seed': Int % Range(0, None),
+        'n_jobs': Threads,
+    },
+    outputs=[('distance_matrix', DistanceMatrix)],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be estimated.',
+        'sketch_size': sketch_size_description,
+        'seed': ('The seed of the random hash functions used to sketch the '
+                 'samples.'),
+        'n_jobs': n_jobs_description
+    },
+    output_descriptions={'distance_matrix': 'The estimated distance matrix.'},
+    name='Approximate beta diversity',
+    description=("Estimates Jaccard or Bray-Curtis distances between all "
+                 "pairs of samples in a feature table from per-sample "
+                 "sketches: MinHash signatures for Jaccard, and consistent "
+                 "weighted samples for Bray-Curtis. Sketches are built in a "
+                 "single pass over the table, and distances are estimated "
+                 "from them in time proportional to the sketch size rather "
+                 "than to the number of features.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.beta_sparse,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={'metric': Str % Choices(beta.SPARSE_METRICS),
+                'n_jobs': Threads},
+    outputs=[('distance_matrix', DistanceMatrix)],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'n_jobs': n_jobs_description
+    },
+    output_descriptions={'distance_matrix': 'The resulting distance matrix.'},
+    name='Beta diversity (sparse)',
+    description=("Computes a user-specified beta diversity metric for all "
+                 "pairs of samples in a sparse feature table, without "
+                 "densifying it. The time taken scales with the number of "
+                 "nonzero entries in the table rather than with the number "
+                 "of samples times the number of features.")
+)
+
 plugin.pipelines.register_function(
     function=q2_diversity.alpha_phylogenetic,
     inputs={'table':
@@ -188,6 +427,60 @@ plugin.pipelines.register_function(
                  'samples in a feature table.')
 )
 
+plugin.methods.register_function(
+    function=q2_diversity.alpha_multiple,
+    inputs={'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={'metrics': Set[Str % Choices(
+        alpha.METRICS['NONPHYLO']['IMPL'] |
+        alpha.METRICS['NONPHYLO']['UNIMPL'] | {'faith_pd'})]},
+    outputs=[('alpha_diversities', Collection[SampleData[AlphaDiversity]])],
+    input_descriptions={
+        'table': ('The feature table containing the samples for which alpha '
+                  'diversity should be computed.'),
+        'phylogeny': ('Phylogenetic tree containing tip identifiers that '
+                      'correspond to the feature identifiers in the table. '
+                      'Required if faith_pd is one of the chosen metrics.')
+    },
+    parameter_descriptions={
+        'metrics': 'The alpha diversity metrics to be computed. Information '
+        'about specific metrics is available at '
+        'https://data.qiime2.org/a_diversity_metrics'
+    },
+    output_descriptions={
+        'alpha_diversities': 'Vectors containing per-sample alpha '
+                             'diversities, keyed by metric.'
+    },
+    name='Alpha diversity (multiple metrics)',
+    description=('Computes several alpha diversity metrics, phylogenetic or '
+                 'not, for all samples in a feature table. The table is '
+                 'loaded once and shared by all metrics.')
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.core_alpha_metrics,
+    inputs={'table': FeatureTable[Frequency | RelativeFrequency]},
+    parameters={},
+    outputs=[('observed_features_vector', SampleData[AlphaDiversity]),
+             ('shannon_vector', SampleData[AlphaDiversity]),
+             ('evenness_vector', SampleData[AlphaDiversity])],
+    input_descriptions={
+        'table': ('The feature table containing the samples for which alpha '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={},
+    output_descriptions={
+        'observed_features_vector': 'Vector of Observed Features values by '
+                                    'sample.',
+        'shannon_vector': 'Vector of Shannon diversity values by sample.',
+        'evenness_vector': 'Vector of Pielou\'s evenness values by sample.',
+    },
+    name='Core alpha diversity metrics',
+    description=('Computes observed features, Shannon\'s entropy and '
+                 'Pielou\'s evenness for all samples in a feature table in a '
+                 'single pass over the table.')
+)
+
 plugin.methods.register_function(
     function=q2_diversity.pcoa,
     inputs={'distance_matrix': DistanceMatrix},
@@ -225,6 +518,34 @@ plugin.methods.register_function(
                citations['halko2011']]
 )
 
+plugin.methods.register_function(
+    function=q2_diversity.pcoa_project,
+    inputs={'pcoa': PCoAResults,
+            'distance_matrix': DistanceMatrix},
+    parameters={},
+    outputs=[('projected_pcoa', PCoAResults)],
+    input_descriptions={
+        'pcoa': 'The PCoA results into which new samples should be '
+                'projected.',
+        'distance_matrix': ('A distance matrix containing all samples in the '
+                            'PCoA results as well as the samples to '
+                            'project. This is typically the distance matrix '
+                            'the PCoA was computed from, extended with the '
+                            'new samples.')
+    },
+    parameter_descriptions={},
+    output_descriptions={
+        'projected_pcoa': ('The PCoA results with the new samples added, '
+                           'using the original axes.')
+    },
+    name='Project samples into a PCoA',
+    description=('Adds samples to existing PCoA results without recomputing '
+                 'the ordination, by projecting their distances to the '
+                 'ordinated samples onto the existing axes (Gower\'s '
+                 'add-a-point method). The axes, eigenvalues and coordinates '
+                 'of the ordinated samples are unchanged.')
+)
+
 plugin.methods.register_function(
     function=q2_diversity.pcoa_biplot,
     inputs={'pcoa': PCoAResults,
@@ -246,9 +567,243 @@ plugin.methods.register_function(
     citations=[citations['legendrelegendre']]
 )
 
+plugin.methods.register_function(
+    function=q2_diversity.beta_cross,
+    inputs={'query_table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence],
+            'reference_table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={
+        'metric': Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
+                                beta.METRICS['NONPHYLO']['UNIMPL']),
+        'pseudocount': Int % Range(1, None),
+        'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+    },
+    outputs=[('distances', DistanceBlock)],
+    input_descriptions={
+        'query_table': ('The feature table containing the samples whose '
+                        'distances to the reference samples should be '
+                        'computed.'),
+        'reference_table': ('The feature table containing the reference '
+                            'samples.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'pseudocount': ('A pseudocount to handle zeros for compositional '
+                        'metrics.  This is ignored for other metrics.'),
+        'n_jobs': n_jobs_description,
+        'block_size': ('The number of reference samples whose distances are '
+                       'computed at once.')
+    },
+    output_descriptions={
+        'distances': ('The distances from each query sample (rows) to each '
+                      'reference sample (columns).')
+    },
+    name='Beta diversity between query and reference samples',
+    description=("Computes a user-specified beta diversity metric between "
+                 "every sample in a query table and every sample in a "
+                 "reference table. Only the query-versus-reference block is "
+                 "computed, so placing new samples against a fixed reference "
+                 "doesn't recompute the distances between reference "
+                 "samples. Metrics that depend on all samples, like "
+                 "seuclidean, are computed as if the tables were merged.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.beta_phylogenetic_cross,
+    inputs={'query_table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence],
+            'reference_table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={
+        'metric': Str % Choices(beta.CROSS_PHYLO_METRICS),
+        'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+    },
+    outputs=[('distances', DistanceBlock)],
+    input_descriptions={
+        'query_table': ('The feature table containing the samples whose '
+                        'distances to the reference samples should be '
+                        'computed.'),
+        'reference_table': ('The feature table containing the reference '
+                            'samples.'),
+        'phylogeny': ('Phylogenetic tree containing tip identifiers that '
+                      'correspond to the feature identifiers in both '
+                      'tables.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'n_jobs': n_jobs_description,
+        'block_size': ('The number of reference samples whose distances are '
+                       'computed at once.')
+    },
+    output_descriptions={
+        'distances': ('The distances from each query sample (rows) to each '
+                      'reference sample (columns).')
+    },
+    name='Phylogenetic beta diversity between query and reference samples',
+    description=("Computes a user-specified UniFrac metric between every "
+                 "sample in a query table and every sample in a reference "
+                 "table. Only the query-versus-reference block is computed, "
+                 "from the branches of the phylogeny observed in each "
+                 "sample."),
+    citations=[citations['lozupone2005unifrac'],
+               citations['lozupone2007quantitative']]
+)
+
+shard_description = (
+    'The index of the shard to compute, from 0 to n_shards - 1. Each shard '
+    'computes a contiguous range of rows of the upper triangle of the '
+    'distance matrix, and the shards contain about the same number of '
+    'distances.'
+)
+
+n_shards_description = (
+    'The number of shards the distance matrix is split into.'
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.beta_shard,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={
+        'metric': Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
+                                beta.METRICS['NONPHYLO']['UNIMPL']),
+        'shard': Int % Range(0, None),
+        'n_shards': Int % Range(1, None),
+        'pseudocount': Int % Range(1, None),
+        'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+    },
+    outputs=[('distances', DistanceBlock)],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'shard': shard_description,
+        'n_shards': n_shards_description,
+        'pseudocount': ('A pseudocount to handle zeros for compositional '
+                        'metrics.  This is ignored for other metrics.'),
+        'n_jobs': n_jobs_description,
+        'block_size': ('The number of columns of the shard whose distances '
+                       'are computed at once.')
+    },
+    output_descriptions={
+        'distances': 'The rows of the distance matrix computed by the shard.'
+    },
+    name='Beta diversity shard',
+    description=("Computes one shard of the distance matrix of a "
+                 "user-specified beta diversity metric. Every shard is "
+                 "independent of the others, so they can be computed by "
+                 "separate processes or machines, and retried individually. "
+                 "The shards are assembled into the distance matrix with "
+                 "merge-distance-blocks.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.beta_phylogenetic_shard,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence],
+            'phylogeny': Phylogeny[Rooted]},
+    parameters={
+        'metric': Str % Choices(beta.CROSS_PHYLO_METRICS),
+        'shard': Int % Range(0, None),
+        'n_shards': Int % Range(1, None),
+        'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+    },
+    outputs=[('distances', DistanceBlock)],
+    input_descriptions={
+        'table': ('The feature table containing the samples over which beta '
+                  'diversity should be computed.'),
+        'phylogeny': ('Phylogenetic tree containing tip identifiers that '
+                      'correspond to the feature identifiers in the table.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'shard': shard_description,
+        'n_shards': n_shards_description,
+        'n_jobs': n_jobs_description,
+        'block_size': ('The number of columns of the shard whose distances '
+                       'are computed at once.')
+    },
+    output_descriptions={
+        'distances': 'The rows of the distance matrix computed by the shard.'
+    },
+    name='Phylogenetic beta diversity shard',
+    description=("Computes one shard of the distance matrix of a "
+                 "user-specified UniFrac metric. Every shard is independent "
+                 "of the others, so they can be computed by separate "
+                 "processes or machines, and retried individually. The "
+                 "shards are assembled into the distance matrix with "
+                 "merge-distance-blocks."),
+    citations=[citations['lozupone2005unifrac'],
+               citations['lozupone2007quantitative']]
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.merge_distance_blocks,
+    inputs={'blocks': Collection[DistanceBlock]},
+    parameters={'n_shards': Int % Range(1, None)},
+    outputs=[('distance_matrix', DistanceMatrix)],
+    input_descriptions={
+        'blocks': 'The distance blocks computed by every shard.'
+    },
+    parameter_descriptions={'n_shards': n_shards_description},
+    output_descriptions={'distance_matrix': 'The merged distance matrix.'},
+    name='Merge distance matrix shards',
+    description=("Assembles the shards of a distance matrix computed by "
+                 "beta-shard or beta-phylogenetic-shard into the distance "
+                 "matrix. The shards are validated to contain every row "
+                 "exactly once, with the same sample order.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.nearest_neighbors,
+    inputs={'table':
+            FeatureTable[Frequency | RelativeFrequency | PresenceAbsence]},
+    parameters={
+        'metric': Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
+                                beta.METRICS['NONPHYLO']['UNIMPL']),
+        'k': Int % Range(1, None),
+        'pseudocount': Int % Range(1, None),
+        'n_jobs': Threads,
+        'block_size': Int % Range(1, None),
+    },
+    outputs=[('neighbor_graph', NeighborGraph)],
+    input_descriptions={
+        'table': ('The feature table containing the samples whose nearest '
+                  'neighbors should be found.')
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'k': 'The number of nearest neighbors to find for each sample.',
+        'pseudocount': ('A pseudocount to handle zeros for compositional '
+                        'metrics.  This is ignored for other metrics.'),
+        'n_jobs': n_jobs_description,
+        'block_size': block_size_description
+    },
+    output_descriptions={
+        'neighbor_graph': ('The k nearest neighbors of each sample, and their '
+                           'distances to it.')
+    },
+    name='Nearest neighbors',
+    description=("Finds the k nearest neighbors of every sample in a feature "
+                 "table under a user-specified beta diversity metric. The "
+                 "distances are computed one tile at a time, and only the "
+                 "nearest k of each sample are kept, so the full distance "
+                 "matrix is never held in memory. The resulting graph can be "
+                 "embedded with UMAP or t-SNE.")
+)
+
 plugin.methods.register_function(
     function=q2_diversity.tsne,
-    inputs={'distance_matrix': DistanceMatrix},
+    inputs={'distance_matrix': DistanceMatrix,
+            'neighbor_graph': NeighborGraph},
     parameters={
         'number_of_dimensions': Int % Range(2, None),
         'perplexity': Float % Range(1, None),
@@ -260,7 +815,11 @@ plugin.methods.register_function(
     outputs=[('tsne', PCoAResults)],
     input_descriptions={
         'distance_matrix': ('The distance matrix on which t-SNE should be '
-                            'computed.')
+                            'computed.'),
+        'neighbor_graph': ('The nearest neighbor graph on which t-SNE should '
+                           'be computed, instead of a distance matrix. Each '
+                           'sample needs at least 3 * perplexity '
+                           'neighbors.')
     },
     parameter_descriptions={
         'number_of_dimensions': "Dimensions to reduce the distance matrix to.",
@@ -285,7 +844,8 @@ plugin.methods.register_function(
 
 plugin.methods.register_function(
     function=q2_diversity.umap,
-    inputs={'distance_matrix': DistanceMatrix},
+    inputs={'distance_matrix': DistanceMatrix,
+            'neighbor_graph': NeighborGraph},
     parameters={
         'number_of_dimensions': Int % Range(2, None),
         'n_neighbors': Int % Range(1, None),
@@ -295,7 +855,11 @@ plugin.methods.register_function(
     outputs=[('umap', PCoAResults)],
     input_descriptions={
         'distance_matrix': ('The distance matrix on which UMAP should be '
-                            'computed.')
+                            'computed.'),
+        'neighbor_graph': ('The nearest neighbor graph on which UMAP should '
+                           'be computed, instead of a distance matrix. '
+                           'n_neighbors may not exceed the number of '
+                           'neighbors of each sample plus one.')
     },
     parameter_descriptions={
         'number_of_dimensions': "Dimensions to reduce the distance matrix to.",
@@ -402,7 +966,8 @@ plugin.pipelines.register_function(
         'metadata': Metadata,
         'with_replacement': Bool,
         'n_jobs_or_threads': Threads,
-        'ignore_missing_samples': Bool
+        'ignore_missing_samples': Bool,
+        'pcoa_dimensions': Int % Range(1, None)
     },
     outputs=[
         ('rarefied_table', FeatureTable[Frequency]),
@@ -437,8 +1002,9 @@ plugin.pipelines.register_function(
                           'rarefied to prior to computing diversity metrics.',
         'metadata': 'The sample metadata to use in the emperor plots.',
         'with_replacement': with_replacement_description,
-        'n_jobs_or_threads': '[beta/beta-phylogenetic methods only] - %s'
-                          % n_jobs_or_threads_description,
+        'n_jobs_or_threads': '[beta/beta-phylogenetic methods only] - %s %s'
+                          % (n_jobs_or_threads_description,
+                             parallel_budget_description),
         'ignore_missing_samples': 'If set to `True` samples and features '
                                   'without metadata are included by '
                                   'setting all metadata values to: '
@@ -446,7 +1012,8 @@ plugin.pipelines.register_function(
                                   'default an exception will be raised if '
                                   'missing elements are encountered. Note, '
                                   'this flag only takes effect if there is at '
-                                  'least one overlapping element.'
+                                  'least one overlapping element.',
+        'pcoa_dimensions': pcoa_dimensions_description
     },
     output_descriptions={
         'rarefied_table': 'The resulting rarefied feature table.',
@@ -500,7 +1067,8 @@ plugin.pipelines.register_function(
         'metadata': Metadata,
         'with_replacement': Bool,
         'n_jobs': Threads,
-        'ignore_missing_samples': Bool
+        'ignore_missing_samples': Bool,
+        'pcoa_dimensions': Int % Range(1, None)
     },
     outputs=[
         ('rarefied_table', FeatureTable[Frequency]),
@@ -523,7 +1091,8 @@ plugin.pipelines.register_function(
                           'rarefied to prior to computing diversity metrics.',
         'metadata': 'The sample metadata to use in the emperor plots.',
         'with_replacement': with_replacement_description,
-        'n_jobs': '[beta methods only] - %s' % n_jobs_description,
+        'n_jobs': '[beta methods only] - %s %s' % (
+            n_jobs_description, parallel_budget_description),
         'ignore_missing_samples': 'If set to `True` samples and features '
                                   'without metadata are included by '
                                   'setting all metadata values to: '
@@ -531,7 +1100,8 @@ plugin.pipelines.register_function(
                                   'default an exception will be raised if '
                                   'missing elements are encountered. Note, '
                                   'this flag only takes effect if there is at '
-                                  'least one overlapping element.'
+                                  'least one overlapping element.',
+        'pcoa_dimensions': pcoa_dimensions_description
     },
     output_descriptions={
         'rarefied_table': 'The resulting rarefied feature table.',
@@ -557,6 +1127,255 @@ plugin.pipelines.register_function(
                  "(non-phylogenetic) to a feature table.")
 )
 
+_core_metrics = q2_diversity._core_metrics.CORE_METRICS
+
+plugin.pipelines.register_function(
+    function=q2_diversity.core_metrics_selected,
+    inputs={
+        'table': FeatureTable[Frequency],
+        'phylogeny': Phylogeny[Rooted]
+    },
+    parameters={
+        'sampling_depth': Int % Range(1, None),
+        'metrics': Set[Str % Choices(_core_metrics['NONPHYLO'] |
+                                     _core_metrics['PHYLO'])],
+        'metadata': Metadata,
+        'with_replacement': Bool,
+        'with_pcoa': Bool,
+        'with_emperor': Bool,
+        'n_jobs_or_threads': Threads,
+        'ignore_missing_samples': Bool,
+        'pcoa_dimensions': Int % Range(1, None)
+    },
+    outputs=[
+        ('rarefied_table', FeatureTable[Frequency]),
+        ('alpha_diversities', Collection[SampleData[AlphaDiversity]]),
+        ('distance_matrices', Collection[DistanceMatrix]),
+        ('pcoa_results', Collection[PCoAResults]),
+        ('emperor_plots', Collection[Visualization]),
+    ],
+    input_descriptions={
+        'table': 'The feature table containing the samples over which '
+                 'diversity metrics should be computed.',
+        'phylogeny': 'Phylogenetic tree containing tip identifiers that '
+                     'correspond to the feature identifiers in the table. '
+                     'Required for faith_pd, unweighted_unifrac and '
+                     'weighted_unifrac.'
+    },
+    parameter_descriptions={
+        'sampling_depth': 'The total frequency that each sample should be '
+                          'rarefied to prior to computing diversity metrics.',
+        'metrics': 'The core metrics to compute. By default all '
+                   'non-phylogenetic core metrics are computed, along with '
+                   'the phylogenetic ones if a phylogeny is provided.',
+        'metadata': 'The sample metadata to use in the emperor plots. '
+                    'Required if `with_emperor` is set.',
+        'with_replacement': with_replacement_description,
+        'with_pcoa': 'Compute a PCoA for each distance matrix.',
+        'with_emperor': 'Generate an Emperor plot for each PCoA. Requires '
+                        '`with_pcoa` and `metadata`.',
+        'n_jobs_or_threads': '[beta/beta-phylogenetic methods only] - %s %s'
+                             % (n_jobs_or_threads_description,
+                                parallel_budget_description),
+        'ignore_missing_samples': 'If set to `True` samples and features '
+                                  'without metadata are included by '
+                                  'setting all metadata values to: '
+                                  '"This element has no metadata". By '
+                                  'default an exception will be raised if '
+                                  'missing elements are encountered. Note, '
+                                  'this flag only takes effect if there is at '
+                                  'least one overlapping element.',
+        'pcoa_dimensions': pcoa_dimensions_description
+    },
+    output_descriptions={
+        'rarefied_table': 'The resulting rarefied feature table.',
+        'alpha_diversities': 'The requested alpha diversity vectors, keyed '
+                             'by metric.',
+        'distance_matrices': 'The requested distance matrices, keyed by '
+                             'metric.',
+        'pcoa_results': 'PCoA results for each distance matrix, keyed by '
+                        'metric. Empty unless `with_pcoa` is set.',
+        'emperor_plots': 'Emperor plots of each PCoA, keyed by metric. Empty '
+                         'unless `with_emperor` is set.',
+    },
+    name='Core diversity metrics (selected)',
+    description=("Applies a user-selected subset of the core diversity "
+                 "metrics to a feature table. Only the requested metrics, "
+                 "and optionally their ordinations and plots, are computed.")
+)
+
+plugin.pipelines.register_function(
+    function=q2_diversity.core_metrics_multiple_depths,
+    inputs={
+        'table': FeatureTable[Frequency],
+        'phylogeny': Phylogeny[Rooted]
+    },
+    parameters={
+        'sampling_depths': List[Int % Range(1, None)],
+        'metrics': Set[Str % Choices(_core_metrics['NONPHYLO'] |
+                                     _core_metrics['PHYLO'])],
+        'metadata': Metadata,
+        'with_replacement': Bool,
+        'with_pcoa': Bool,
+        'with_emperor': Bool,
+        'n_jobs_or_threads': Threads,
+        'ignore_missing_samples': Bool,
+        'pcoa_dimensions': Int % Range(1, None)
+    },
+    outputs=[
+        ('rarefied_tables', Collection[FeatureTable[Frequency]]),
+        ('alpha_diversities', Collection[SampleData[AlphaDiversity]]),
+        ('distance_matrices', Collection[DistanceMatrix]),
+        ('pcoa_results', Collection[PCoAResults]),
+        ('emperor_plots', Collection[Visualization]),
+    ],
+    input_descriptions={
+        'table': 'The feature table containing the samples over which '
+                 'diversity metrics should be computed.',
+        'phylogeny': 'Phylogenetic tree containing tip identifiers that '
+                     'correspond to the feature identifiers in the table. '
+                     'Required for faith_pd, unweighted_unifrac and '
+                     'weighted_unifrac.'
+    },
+    parameter_descriptions={
+        'sampling_depths': 'The total frequencies that each sample should be '
+                           'rarefied to prior to computing diversity '
+                           'metrics. The metrics are computed separately at '
+                           'each depth.',
+        'metrics': 'The core metrics to compute. By default all '
+                   'non-phylogenetic core metrics are computed, along with '
+                   'the phylogenetic ones if a phylogeny is provided.',
+        'metadata': 'The sample metadata to use in the emperor plots. '
+                    'Required if `with_emperor` is set.',
+        'with_replacement': with_replacement_description,
+        'with_pcoa': 'Compute a PCoA for each distance matrix.',
+        'with_emperor': 'Generate an Emperor plot for each PCoA. Requires '
+                        '`with_pcoa` and `metadata`.',
+        'n_jobs_or_threads': '[beta/beta-phylogenetic methods only] - %s %s'
+                             % (n_jobs_or_threads_description,
+                                parallel_budget_description),
+        'ignore_missing_samples': 'If set to `True` samples and features '
+                                  'without metadata are included by '
+                                  'setting all metadata values to: '
+                                  '"This element has no metadata". By '
+                                  'default an exception will be raised if '
+                                  'missing elements are encountered. Note, '
+                                  'this flag only takes effect if there is at '
+                                  'least one overlapping element.',
+        'pcoa_dimensions': pcoa_dimensions_description
+    },
+    output_descriptions={
+        'rarefied_tables': 'The rarefied feature tables, keyed by depth '
+                           '(e.g. `depth-1000`).',
+        'alpha_diversities': 'The requested alpha diversity vectors, keyed '
+                             'by metric and depth (e.g. '
+                             '`shannon_depth-1000`).',
+        'distance_matrices': 'The requested distance matrices, keyed by '
+                             'metric and depth.',
+        'pcoa_results': 'PCoA results for each distance matrix, keyed by '
+                        'metric and depth. Empty unless `with_pcoa` is set.',
+        'emperor_plots': 'Emperor plots of each PCoA, keyed by metric and '
+                         'depth. Empty unless `with_emperor` is set.',
+    },
+    name='Core diversity metrics at multiple sampling depths',
+    description=("Applies a user-selected subset of the core diversity "
+                 "metrics to a feature table rarefied to each of several "
+                 "sampling depths. When rarefying without replacement, each "
+                 "depth is subsampled from the table rarefied to the next "
+                 "larger depth whenever this retains the same samples.")
+)
+
+plugin.methods.register_function(
+    function=q2_diversity.extend_distance_matrix,
+    inputs={
+        'distance_matrix': DistanceMatrix,
+        'table': FeatureTable[Frequency],
+        'new_table': FeatureTable[Frequency]
+    },
+    parameters={
+        'metric': Str % Choices(beta.EXTEND_METRICS)
+    },
+    outputs=[('extended_distance_matrix', DistanceMatrix)],
+    input_descriptions={
+        'distance_matrix': 'The distance matrix to extend.',
+        'table': 'The feature table the distance matrix was computed from.',
+        'new_table': 'A feature table containing the samples to add to the '
+                     'distance matrix. These must not already be present in '
+                     'the distance matrix.'
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric the distance matrix was '
+                  'computed with.'
+    },
+    output_descriptions={
+        'extended_distance_matrix': 'The distance matrix including the new '
+                                    'samples.'
+    },
+    name='Extend a distance matrix with new samples',
+    description=('Adds samples to an existing distance matrix by computing '
+                 'only their distances to the existing samples and to each '
+                 'other.')
+)
+
+plugin.pipelines.register_function(
+    function=q2_diversity.core_metrics_incremental,
+    inputs={
+        'table': FeatureTable[Frequency],
+        'rarefied_table': FeatureTable[Frequency],
+        'jaccard_distance_matrix': DistanceMatrix,
+        'bray_curtis_distance_matrix': DistanceMatrix,
+        'jaccard_pcoa_results': PCoAResults,
+        'bray_curtis_pcoa_results': PCoAResults
+    },
+    parameters={
+        'sampling_depth': Int % Range(1, None),
+        'with_replacement': Bool
+    },
+    outputs=[
+        ('rarefied_table', FeatureTable[Frequency]),
+        ('jaccard_distance_matrix', DistanceMatrix),
+        ('bray_curtis_distance_matrix', DistanceMatrix),
+        ('pcoa_results', Collection[PCoAResults]),
+    ],
+    input_descriptions={
+        'table': 'A feature table containing only the new samples.',
+        'rarefied_table': 'The rarefied table from a previous core-metrics '
+                          'run.',
+        'jaccard_distance_matrix': 'The Jaccard distance matrix from a '
+                                   'previous core-metrics run.',
+        'bray_curtis_distance_matrix': 'The Bray-Curtis distance matrix from '
+                                       'a previous core-metrics run.',
+        'jaccard_pcoa_results': 'Optional Jaccard PCoA results from a '
+                                'previous core-metrics run, into which the '
+                                'new samples will be projected.',
+        'bray_curtis_pcoa_results': 'Optional Bray-Curtis PCoA results from '
+                                    'a previous core-metrics run, into which '
+                                    'the new samples will be projected.'
+    },
+    parameter_descriptions={
+        'sampling_depth': 'The total frequency that each new sample should '
+                          'be rarefied to. This should match the depth of '
+                          'the previous run.',
+        'with_replacement': with_replacement_description
+    },
+    output_descriptions={
+        'rarefied_table': 'The previous rarefied table merged with the '
+                          'rarefied new samples.',
+        'jaccard_distance_matrix': 'The Jaccard distance matrix extended '
+                                   'with the new samples.',
+        'bray_curtis_distance_matrix': 'The Bray-Curtis distance matrix '
+                                       'extended with the new samples.',
+        'pcoa_results': 'The provided PCoA results with the new samples '
+                        'projected onto their axes, keyed by metric '
+                        '(`jaccard`, `braycurtis`).'
+    },
+    name='Core diversity metrics (incremental)',
+    description=("Adds new samples to the outputs of a previous "
+                 "non-phylogenetic core-metrics run. Only the new samples "
+                 "are rarefied, and only their distances to the existing "
+                 "samples and to each other are computed.")
+)
+
 plugin.pipelines.register_function(
     function=q2_diversity.beta_correlation,
     inputs={'distance_matrix': DistanceMatrix},
@@ -644,6 +1463,37 @@ plugin.methods.register_function(
     }
 )
 
+plugin.methods.register_function(
+    function=q2_diversity.partition_distance_matrix,
+    inputs={
+        'distance_matrix': DistanceMatrix
+    },
+    parameters={
+        'metadata': MetadataColumn[Categorical]
+    },
+    outputs=[
+        ('partitioned_distance_matrices', Collection[DistanceMatrix])
+    ],
+    name="Partition a distance matrix by a metadata column.",
+    description="Split a distance matrix into one distance matrix per value "
+                "of a categorical metadata column, containing the samples "
+                "with that value. Samples without a value in the column are "
+                "omitted. The distance matrices are keyed and ordered by "
+                "value, and the samples in each of them keep the order of "
+                "the input distance matrix.",
+    input_descriptions={
+        'distance_matrix': 'Distance matrix to partition by sample.'
+    },
+    parameter_descriptions={
+        'metadata': 'Categorical sample metadata column whose values define '
+                    'the partitions.'
+    },
+    output_descriptions={
+        'partitioned_distance_matrices': 'One distance matrix per value of '
+                                         'the metadata column.'
+    }
+)
+
 plugin.methods.register_function(
     function=q2_diversity.filter_alpha_diversity,
     inputs={
@@ -681,6 +1531,51 @@ plugin.methods.register_function(
     }
 )
 
+plugin.methods.register_function(
+    function=q2_diversity.filter_alpha_diversity_multiple,
+    inputs={
+        'alpha_diversities': Collection[SampleData[AlphaDiversity]]
+    },
+    parameters={
+        'metadata': Metadata,
+        'exclude_ids': Bool,
+        'where': Str
+    },
+    outputs=[
+        ('filtered_alpha_diversities',
+         Collection[SampleData[AlphaDiversity]])
+    ],
+    name="Filter samples from several alpha diversity metrics.",
+    description="Filter samples from a collection of alpha diversity "
+                "metrics, retaining samples with corresponding `metadata` "
+                "(or retaining samples without metadata, if `exclude_ids` is "
+                "True). The samples are selected from the metadata once, and "
+                "the selection is applied to every metric. See the filtering "
+                "tutorial on https://docs.qiime2.org for additional details.",
+    input_descriptions={
+        'alpha_diversities': 'Alpha diversity sample data to filter by '
+                             'sample.'
+    },
+    parameter_descriptions={
+       'metadata': 'Sample metadata used to select samples to retain from '
+                   'the sample data (default) or select samples to exclude '
+                   'using the `exclude_ids` parameter.',
+       'where': 'SQLite WHERE clause specifying sample metadata criteria '
+                'that must be met to be included in the filtered alpha '
+                'diversity artifacts. If not provided, all samples in '
+                '`metadata` that are also in the input alpha diversity '
+                'artifacts will be retained.',
+       'exclude_ids': 'If `True`, the samples selected by `metadata` or the '
+                      '`where` parameters will be excluded from the filtered '
+                      'alpha diversity artifacts instead of being retained.'
+    },
+    output_descriptions={
+        'filtered_alpha_diversities': 'The filtered alpha diversity sample '
+                                      'data, with the keys of the input '
+                                      'collection.'
+    }
+)
+
 plugin.visualizers.register_function(
     function=q2_diversity.alpha_group_significance,
     inputs={'alpha_diversity': SampleData[AlphaDiversity]},
@@ -729,7 +1624,10 @@ plugin.visualizers.register_function(
     parameters={'method': Str % Choices(beta_group_significance_methods),
                 'permutations': Int,
                 'metadata': MetadataColumn[Categorical],
-                'pairwise': Bool},
+                'pairwise': Bool,
+                'compress_raw_data': Bool,
+                'max_raw_data_rows': Int % Range(0, None),
+                'n_jobs': Threads},
     input_descriptions={
         'distance_matrix': 'Matrix of distances between pairs of samples.'
     },
@@ -741,7 +1639,18 @@ plugin.visualizers.register_function(
         'pairwise': ('Perform pairwise tests between all pairs of groups '
                      'in addition to the test across all groups. '
                      'This can be very slow if there are a lot of groups '
-                     'in the metadata column.')
+                     'in the metadata column.'),
+        'compress_raw_data': ('Write the within and between group distances '
+                              'of every pair of samples as a gzip-compressed '
+                              'TSV.'),
+        'max_raw_data_rows': ('The maximum number of pairs of samples written '
+                              'to the raw data TSV. Use 0 to skip writing it, '
+                              'e.g. for very large distance matrices. By '
+                              'default, all pairs are written.'),
+        'n_jobs': ('%s Pairwise tests are distributed across this many '
+                   'jobs. The permutations of each pair of groups are '
+                   'seeded by the pair, so the results don\'t depend on '
+                   'n_jobs.' % n_jobs_description)
     },
     name='Beta diversity group significance',
     description=('Determine whether groups of samples are significantly '
@@ -823,6 +1732,12 @@ plugin.visualizers.register_function(
     examples={'alpha_correlation_faith_pd': ex.alpha_correlation_faith_pd}
 )
 
+previous_alpha_iterations_description = (
+    'Alpha diversity vectors from a previous run of '
+    '`alpha-rarefaction-iterations`. Vectors for iterations that are already '
+    'present are reused, and only the remaining iterations are computed.'
+)
+
 _metric_set = Set[Str % Choices((alpha.METRICS['PHYLO']['IMPL'] |
                                  alpha.METRICS['PHYLO']['UNIMPL'] |
                                  alpha.METRICS['NONPHYLO']['IMPL'] |
@@ -831,7 +1746,8 @@ _metric_set = Set[Str % Choices((alpha.METRICS['PHYLO']['IMPL'] |
 plugin.visualizers.register_function(
     function=q2_diversity.alpha_rarefaction,
     inputs={'table': FeatureTable[Frequency],
-            'phylogeny': Phylogeny[Rooted]},
+            'phylogeny': Phylogeny[Rooted],
+            'previous_iterations': Collection[SampleData[AlphaDiversity]]},
     parameters={'metrics': _metric_set,
                 'metadata': Metadata,
                 'min_depth': Int % Range(1, None),
@@ -841,6 +1757,7 @@ plugin.visualizers.register_function(
     input_descriptions={
         'table': 'Feature table to compute rarefaction curves from.',
         'phylogeny': 'Optional phylogeny for phylogenetic metrics.',
+        'previous_iterations': previous_alpha_iterations_description,
     },
     parameter_descriptions={
         'metrics': ('The metrics to be measured. By default computes '
@@ -853,7 +1770,8 @@ plugin.visualizers.register_function(
         'steps': ('The number of rarefaction depths to include '
                   'between min_depth and max_depth.'),
         'iterations': ('The number of rarefied feature tables to '
-                       'compute at each step.'),
+                       'compute at each step, including any provided as '
+                       '`previous_iterations`.'),
     },
     name='Alpha rarefaction curves',
     description=('Generate interactive alpha rarefaction curves by computing '
@@ -865,6 +1783,55 @@ plugin.visualizers.register_function(
                  'metadata column.'),
 )
 
+plugin.pipelines.register_function(
+    function=q2_diversity.alpha_rarefaction_iterations,
+    inputs={'table': FeatureTable[Frequency],
+            'phylogeny': Phylogeny[Rooted],
+            'previous_iterations': Collection[SampleData[AlphaDiversity]]},
+    parameters={'metrics': _metric_set,
+                'min_depth': Int % Range(1, None),
+                'max_depth': Int % Range(1, None),
+                'steps': Int % Range(2, None),
+                'iterations': Int % Range(1, None)},
+    outputs=[('alpha_diversities', Collection[SampleData[AlphaDiversity]])],
+    input_descriptions={
+        'table': 'Feature table to compute rarefaction iterations from.',
+        'phylogeny': 'Optional phylogeny for phylogenetic metrics.',
+        'previous_iterations': previous_alpha_iterations_description,
+    },
+    parameter_descriptions={
+        'metrics': ('The metrics to be measured. By default computes '
+                    'observed_features, shannon, and if phylogeny is '
+                    'provided, faith_pd.'),
+        'min_depth': 'The minimum rarefaction depth.',
+        'max_depth': ('The maximum rarefaction depth. '
+                      'Must be greater than min_depth.'),
+        'steps': ('The number of rarefaction depths to include '
+                  'between min_depth and max_depth.'),
+        'iterations': ('The total number of rarefied feature tables to '
+                       'compute at each step, including any provided as '
+                       '`previous_iterations`.'),
+    },
+    output_descriptions={
+        'alpha_diversities': ('Alpha diversity vectors for every metric, '
+                              'rarefaction depth and iteration. These can be '
+                              'provided as `previous_iterations` to '
+                              '`alpha-rarefaction` or to this action.'),
+    },
+    name='Alpha rarefaction iterations',
+    description=('Compute the alpha diversity vectors underlying the alpha '
+                 'rarefaction curves, so that they can be reused to render '
+                 'the curves or extended with additional iterations. Only '
+                 'the iterations that are not already present in '
+                 '`previous_iterations` are computed.'),
+)
+
+previous_beta_iterations_description = (
+    'Distance matrices from a previous run of `beta-rarefaction-iterations`. '
+    'Distance matrices for iterations that are already present are reused, '
+    'and only the remaining iterations are computed.'
+)
+
 _beta_rarefaction_color_schemes = [
     'BrBG', 'BrBG_r', 'PRGn', 'PRGn_r', 'PiYG', 'PiYG_r',
     'PuOr', 'PuOr_r', 'RdBu', 'RdBu_r', 'RdGy', 'RdGy_r',
@@ -874,7 +1841,8 @@ plugin.visualizers.register_function(
     function=q2_diversity._beta.beta_rarefaction,
     inputs={
         'table': FeatureTable[Frequency],
-        'phylogeny': Phylogeny[Rooted]},
+        'phylogeny': Phylogeny[Rooted],
+        'previous_iterations': Collection[DistanceMatrix]},
     parameters={
         'metric': Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
                                 beta.METRICS['NONPHYLO']['UNIMPL'] |
@@ -896,7 +1864,8 @@ plugin.visualizers.register_function(
                      'This tree can contain tip ids that are not present in '
                      'the table, but all feature ids in the table must be '
                      'present in this tree. [required for phylogenetic '
-                     'metrics]'
+                     'metrics]',
+        'previous_iterations': previous_beta_iterations_description,
     },
     parameter_descriptions={
         'metric': 'The beta diversity metric to be computed.',
@@ -911,7 +1880,8 @@ plugin.visualizers.register_function(
         'metadata': 'The sample metadata used for the Emperor jackknifed PCoA '
                     'plot.',
         'iterations': 'Number of times to rarefy the feature table at a given '
-                      'sampling depth.',
+                      'sampling depth, including any iterations provided as '
+                      '`previous_iterations`.',
         'correlation_method': 'The Mantel correlation test to be applied when '
                               'computing correlation between beta diversity '
                               'distance matrices.',
@@ -932,6 +1902,55 @@ plugin.visualizers.register_function(
         citations['spearman1904proof']]
 )
 
+plugin.pipelines.register_function(
+    function=q2_diversity.beta_rarefaction_iterations,
+    inputs={
+        'table': FeatureTable[Frequency],
+        'phylogeny': Phylogeny[Rooted],
+        'previous_iterations': Collection[DistanceMatrix]},
+    parameters={
+        'metric': Str % Choices(beta.METRICS['NONPHYLO']['IMPL'] |
+                                beta.METRICS['NONPHYLO']['UNIMPL'] |
+                                beta.METRICS['PHYLO']['IMPL'] |
+                                beta.METRICS['PHYLO']['UNIMPL']),
+        'sampling_depth': Int % Range(1, None),
+        'iterations': Int % Range(1, None),
+    },
+    outputs=[('distance_matrices', Collection[DistanceMatrix])],
+    input_descriptions={
+        'table': 'Feature table upon which to perform beta diversity '
+                 'rarefaction.',
+        'phylogeny': 'Phylogenetic tree containing tip identifiers that '
+                     'correspond to the feature identifiers in the table. '
+                     'This tree can contain tip ids that are not present in '
+                     'the table, but all feature ids in the table must be '
+                     'present in this tree. [required for phylogenetic '
+                     'metrics]',
+        'previous_iterations': previous_beta_iterations_description,
+    },
+    parameter_descriptions={
+        'metric': 'The beta diversity metric to be computed.',
+        'sampling_depth': 'The total frequency that each sample should be '
+                          'rarefied to prior to computing the diversity '
+                          'metric.',
+        'iterations': 'The total number of times to rarefy the feature table '
+                      'at the given sampling depth, including any iterations '
+                      'provided as `previous_iterations`.',
+    },
+    output_descriptions={
+        'distance_matrices': 'One distance matrix per rarefaction iteration. '
+                             'These can be provided as `previous_iterations` '
+                             'to `beta-rarefaction` or to this action.',
+    },
+    name='Beta diversity rarefaction iterations',
+    description='Repeatedly rarefy a feature table and compute a beta '
+                'diversity metric on each rarefied table, so that the '
+                'resulting distance matrices can be reused to render a beta '
+                'rarefaction visualization or extended with additional '
+                'iterations. Only the iterations that are not already '
+                'present in `previous_iterations` are computed.'
+)
+
 plugin.visualizers.register_function(
     function=q2_diversity.adonis,
     inputs={'distance_matrix': DistanceMatrix},
@@ -973,3 +1992,5 @@ plugin.visualizers.register_function(
                  'https://CRAN.R-project.org/package=vegan'),
     citations=[citations['anderson2001new'], citations['Oksanen2018']]
 )
+
+importlib.import_module('q2_diversity._transformer')
@@ -20,7 +20,9 @@ import pandas as pd
 import pandas.testing as pdt
 
 from qiime2 import Artifact
-from q2_diversity import (alpha_correlation, alpha_group_significance)
+from q2_diversity import (alpha_correlation, alpha_group_significance,
+                          core_alpha_metrics, alpha_multiple)
+from q2_diversity._alpha._method import _VECTORIZED_METRICS
 
 
 class TestExamples(TestPluginBase):
@@ -118,6 +120,127 @@ class AlphaTests(TestPluginBase):
                                     metric='faith_pd')
 
 
+class CoreAlphaMetricsTests(unittest.TestCase):
+
+    def test_core_alpha_metrics(self):
+        t = biom.Table(np.array([[150, 100, 100, 0], [50, 100, 100, 7]]),
+                       ['O1', 'O2'],
+                       ['S1', 'S2', 'S3', 'S4'])
+
+        observed, shannon, evenness = core_alpha_metrics(t)
+
+        pdt.assert_series_equal(
+            observed, pd.Series({'S1': 2, 'S2': 2, 'S3': 2, 'S4': 1},
+                                name='observed_features'))
+        pdt.assert_series_equal(
+            shannon, pd.Series({'S1': 0.811278124459, 'S2': 1., 'S3': 1.,
+                                'S4': 0.}, name='shannon_entropy'))
+        # evenness is undefined for a single observed feature
+        pdt.assert_series_equal(
+            evenness, pd.Series({'S1': 0.811278124459, 'S2': 1., 'S3': 1.,
+                                 'S4': np.nan}, name='pielou_evenness'))
+
+    def test_core_alpha_metrics_matches_skbio(self):
+        counts = np.array([[0, 3, 1, 9, 2],
+                           [4, 0, 1, 1, 0],
+                           [1, 8, 0, 6, 2],
+                           [0, 2, 5, 0, 1]])
+        t = biom.Table(counts, ['O1', 'O2', 'O3', 'O4'],
+                       ['S1', 'S2', 'S3', 'S4', 'S5'])
+
+        observed, shannon, evenness = core_alpha_metrics(t)
+
+        for i, sample in enumerate(counts.T):
+            self.assertEqual(observed.iloc[i], np.count_nonzero(sample))
+            self.assertAlmostEqual(shannon.iloc[i],
+                                   skbio.diversity.alpha.shannon(sample,
+                                                                 base=2))
+            self.assertAlmostEqual(evenness.iloc[i],
+                                   skbio.diversity.alpha.pielou_e(sample))
+
+    def test_core_alpha_metrics_empty_table(self):
+        with self.assertRaisesRegex(ValueError, 'empty'):
+            core_alpha_metrics(biom.Table(np.array([]), [], []))
+
+
+class AlphaMultipleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.counts = np.array([[0, 3, 1, 9, 2],
+                                [4, 0, 1, 1, 0],
+                                [1, 8, 0, 6, 2],
+                                [0, 2, 5, 0, 1]])
+        self.ids = ['S1', 'S2', 'S3', 'S4', 'S5']
+        self.table = biom.Table(self.counts, ['O1', 'O2', 'O3', 'O4'],
+                                self.ids)
+        self.tree = skbio.TreeNode.read(io.StringIO(
+            '(((O1:0.25,O2:0.5):0.25,O3:0.75):0.5,(O4:0.1,O5:0.2):0.3)root;'))
+
+    def test_alpha_multiple(self):
+        metrics = {'observed_features', 'shannon', 'pielou_e', 'simpson',
+                   'chao1', 'brillouin_d', 'fisher_alpha'}
+
+        observed = alpha_multiple(self.table, metrics)
+
+        self.assertEqual(set(observed), metrics)
+        self.assertEqual(observed['shannon'].name, 'shannon_entropy')
+        self.assertEqual(observed['pielou_e'].name, 'pielou_evenness')
+        self.assertEqual(observed['chao1'].name, 'chao1')
+        pdt.assert_series_equal(
+            observed['shannon'],
+            skbio.diversity.alpha_diversity('shannon', self.counts.T,
+                                            ids=self.ids, base=2),
+            check_names=False)
+        for metric in ('simpson', 'chao1', 'brillouin_d', 'fisher_alpha'):
+            pdt.assert_series_equal(
+                observed[metric],
+                skbio.diversity.alpha_diversity(metric, self.counts.T,
+                                                ids=self.ids),
+                check_names=False, check_dtype=False)
+
+    def test_alpha_multiple_matches_skbio(self):
+        # S6 has no counts, S7 a single count, and S8 a single feature
+        counts = np.array([[0, 3, 1, 9, 2, 0, 0, 0],
+                           [4, 0, 1, 1, 0, 0, 0, 7],
+                           [1, 8, 0, 6, 2, 0, 1, 0],
+                           [0, 2, 5, 0, 1, 0, 0, 0]])
+        ids = ['S1', 'S2', 'S3', 'S4', 'S5', 'S6', 'S7', 'S8']
+        table = biom.Table(counts, ['O1', 'O2', 'O3', 'O4'], ids)
+
+        observed = alpha_multiple(table, set(_VECTORIZED_METRICS))
+
+        for metric in _VECTORIZED_METRICS:
+            with self.subTest(metric=metric):
+                kwargs = {'base': 2} if metric == 'shannon' else {}
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    expected = skbio.diversity.alpha_diversity(
+                        metric, counts.T, ids=ids, **kwargs)
+                pdt.assert_series_equal(observed[metric], expected,
+                                        check_names=False, check_dtype=False)
+
+    def test_alpha_multiple_phylogenetic(self):
+        observed = alpha_multiple(self.table,
+                                  {'faith_pd', 'observed_features'},
+                                  self.tree)
+
+        self.assertEqual(observed['faith_pd'].name, 'faith_pd')
+        # e.g. S1 observes O2 and O3: 0.5 + 0.25 + 0.75 + 0.5
+        pdt.assert_series_equal(
+            observed['faith_pd'],
+            pd.Series({'S1': 2.0, 'S2': 2.15, 'S3': 1.9, 'S4': 2.25,
+                       'S5': 2.15}, name='faith_pd'))
+
+    def test_alpha_multiple_missing_phylogeny(self):
+        with self.assertRaisesRegex(ValueError, 'tree was not provided'):
+            alpha_multiple(self.table, {'faith_pd', 'shannon'})
+
+    def test_alpha_multiple_feature_not_in_phylogeny(self):
+        tree = skbio.TreeNode.read(io.StringIO(
+            '((O1:0.25,O2:0.5):0.25,O3:0.75)root;'))
+        with self.assertRaisesRegex(ValueError, 'not present.*O4'):
+            alpha_multiple(self.table, {'faith_pd'}, tree)
+
+
 class AlphaCorrelationTests(unittest.TestCase):
 
     def test_spearman(self):
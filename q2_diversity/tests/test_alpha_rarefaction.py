@@ -10,6 +10,7 @@ import io
 import os
 import tempfile
 import unittest
+from unittest import mock
 
 import biom
 import numpy as np
@@ -18,12 +19,13 @@ import qiime2
 import skbio
 import pandas as pd
 
+from qiime2.plugin.testing import TestPluginBase
 from qiime2.plugin.util import transform
 from q2_types.tree import NewickFormat
 from q2_diversity import alpha_rarefaction
 from q2_diversity._alpha._visualizer import (
     _compute_rarefaction_data, _compute_summary, _reindex_with_metadata,
-    _alpha_rarefaction_jsonp)
+    _alpha_rarefaction_jsonp, _compute_rarefaction_iterations)
 
 
 class AlphaRarefactionTests(unittest.TestCase):
@@ -333,6 +335,97 @@ class ComputeRarefactionDataTests(unittest.TestCase):
                            index=['S1', 'S2', 'S3'])
         pdt.assert_frame_equal(obs['shannon'], exp)
 
+    def test_previous_iterations(self):
+        t = biom.Table(np.array([[150, 100, 100], [50, 100, 100]]),
+                       ['O1', 'O2'],
+                       ['S1', 'S2', 'S3'])
+        # values that could not have been computed from this table, so that
+        # reuse is detectable
+        previous = {
+            'observed_features_depth-1_iter-1':
+                pd.Series([42, 42, 42], index=['S1', 'S2', 'S3']),
+            'observed_features_depth-200_iter-1':
+                pd.Series([43, 43, 43], index=['S1', 'S2', 'S3']),
+            # iterations beyond the requested number are ignored
+            'observed_features_depth-200_iter-3':
+                pd.Series([44, 44, 44], index=['S1', 'S2', 'S3'])}
+        obs = _compute_rarefaction_data(feature_table=t,
+                                        min_depth=1,
+                                        max_depth=200,
+                                        steps=2,
+                                        iterations=2,
+                                        phylogeny=None,
+                                        metrics=['observed_features'],
+                                        previous_iterations=previous)
+
+        exp_ind = pd.MultiIndex.from_product(
+            [[1, 200], [1, 2]],
+            names=['_alpha_rarefaction_depth_column_', 'iter'])
+        exp = pd.DataFrame(data=[[42, 1, 43, 2], [42, 1, 43, 2],
+                                 [42, 1, 43, 2]],
+                           columns=exp_ind,
+                           index=['S1', 'S2', 'S3'])
+        pdt.assert_frame_equal(obs['observed_features'], exp)
+
+    def test_previous_iterations_mismatched(self):
+        t = biom.Table(np.array([[150, 100, 100], [50, 100, 100]]),
+                       ['O1', 'O2'],
+                       ['S1', 'S2', 'S3'])
+        previous = {'shannon_depth-150_iter-1':
+                    pd.Series([1., 1., 1.], index=['S1', 'S2', 'S3'])}
+        with tempfile.TemporaryDirectory() as output_dir:
+            with self.assertRaisesRegex(ValueError,
+                                        'shannon_depth-150_iter-1'):
+                alpha_rarefaction(output_dir, t, max_depth=200, steps=2,
+                                  metrics={'shannon'},
+                                  previous_iterations=previous)
+
+
+class AlphaRarefactionIterationsTests(TestPluginBase):
+    package = 'q2_diversity.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.alpha_rarefaction_iterations = self.plugin.pipelines[
+            'alpha_rarefaction_iterations']
+        table = biom.Table(np.array([[150, 100, 100], [50, 100, 100]]),
+                           ['O1', 'O2'], ['S1', 'S2', 'S3'])
+        self.table = qiime2.Artifact.import_data('FeatureTable[Frequency]',
+                                                 table)
+
+    def test_previous_iterations(self):
+        first, = self.alpha_rarefaction_iterations(
+            table=self.table, max_depth=200, steps=2, metrics={'shannon'},
+            iterations=2)
+
+        computed = []
+
+        def compute(*args, **kwargs):
+            vectors = _compute_rarefaction_iterations(*args, **kwargs)
+            computed.extend(vectors)
+            return vectors
+
+        target = ('q2_diversity._alpha._pipeline.'
+                  '_compute_rarefaction_iterations')
+        with mock.patch(target, side_effect=compute):
+            second, = self.alpha_rarefaction_iterations(
+                table=self.table, max_depth=200, steps=2,
+                metrics={'shannon'}, iterations=4, previous_iterations=first)
+
+        self.assertEqual(set(first.keys()),
+                         {'shannon_depth-%d_iter-%d' % (depth, i)
+                          for depth in (1, 200) for i in (1, 2)})
+        self.assertEqual(set(second.keys()),
+                         {'shannon_depth-%d_iter-%d' % (depth, i)
+                          for depth in (1, 200) for i in (1, 2, 3, 4)})
+        # only the new iterations are computed, and the others are reused
+        self.assertEqual(set(computed),
+                         {'shannon_depth-%d_iter-%d' % (depth, i)
+                          for depth in (1, 200) for i in (3, 4)})
+        for key in first.keys():
+            pdt.assert_series_equal(second[key].view(pd.Series),
+                                    first[key].view(pd.Series))
+
 
 class ComputeSummaryTests(unittest.TestCase):
     def test_one_iteration_no_metadata(self):
@@ -7,24 +7,40 @@
 # ----------------------------------------------------------------------------
 
 import unittest
+from unittest import mock
 import io
 import os
 import tempfile
 import glob
 import collections
+import itertools
 
 import skbio
 import numpy as np
 import numpy.testing as npt
 from biom.table import Table
 import pandas as pd
+import pandas.testing as pdt
+import scipy.spatial.distance
 import qiime2
 from qiime2.plugin.testing import TestPluginBase
 
 
 from qiime2 import Artifact
-from q2_diversity import (bioenv, beta_group_significance, mantel)
-from q2_diversity._beta._visualizer import _get_distance_boxplot_data
+from q2_diversity import (bioenv, beta_group_significance, mantel,
+                          extend_distance_matrix, beta_multiple, beta_tiled,
+                          beta_sparse, beta_approximate, nearest_neighbors,
+                          beta_cross, beta_phylogenetic_cross, beta_shard,
+                          beta_phylogenetic_shard, merge_distance_blocks)
+from q2_diversity._beta._visualizer import (_group_boxplot_data,
+                                            _group_distances,
+                                            _pairs_summary_chunks,
+                                            _pairwise_permanova,
+                                            _pairwise_seeds, _seeded)
+from q2_diversity._beta._method import _co_occurrences
+from q2_diversity._beta._pipeline import _beta_phylogenetic_action
+from q2_diversity._beta._sketch import _approximation_error
+from q2_diversity._beta._shard import _shard_rows
 
 
 class BetaDiversityTests(TestPluginBase):
@@ -35,6 +51,8 @@ class BetaDiversityTests(TestPluginBase):
         super().setUp()
         self.beta = self.plugin.pipelines['beta']
         self.beta_phylogenetic = self.plugin.pipelines['beta_phylogenetic']
+        self.beta_phylogenetic_multiple = self.plugin.pipelines[
+            'beta_phylogenetic_multiple']
 
         two_feature_table = self.get_data_path('two_feature_table.biom')
         self.two_feature_table = Artifact.import_data(
@@ -95,6 +113,60 @@ class BetaDiversityTests(TestPluginBase):
                 npt.assert_almost_equal(single_thread[id1, id2],
                                         expected[id1, id2])
 
+    def test_beta_sparse_table(self):
+        counts = np.zeros((40, 4))
+        counts[[0, 1, 2], 0] = [3, 1, 2]
+        counts[[2, 3], 1] = [5, 1]
+        counts[[0, 3, 4], 2] = [1, 1, 7]
+        counts[[5], 3] = [2]
+        t = Table(counts, ['O%d' % i for i in range(40)],
+                  ['S1', 'S2', 'S3', 'S4'])
+        t = Artifact.import_data('FeatureTable[Frequency]', t)
+
+        for metric in ('braycurtis', 'jaccard'):
+            actual, = self.beta(table=t, metric=metric, sparse=True,
+                                n_jobs=2)
+            actual = actual.view(skbio.DistanceMatrix)
+            data = counts.T > 0 if metric == 'jaccard' else counts.T
+            expected = scipy.spatial.distance.squareform(
+                scipy.spatial.distance.pdist(data, metric=metric))
+
+            self.assertEqual(actual.ids, ('S1', 'S2', 'S3', 'S4'))
+            npt.assert_allclose(actual.data, expected)
+
+    def test_beta_sparse_unsupported_metric(self):
+        with self.assertRaisesRegex(ValueError, 'sparse.*braycurtis'):
+            self.beta(table=self.t, metric='canberra', sparse=True)
+
+    def test_beta_conflicting_backends(self):
+        for kwargs, message in (
+                ({'block_size': 2, 'sparse': True},
+                 'block_size and sparse were'),
+                ({'approximate': True, 'sparse': True},
+                 'approximate and sparse were'),
+                ({'block_size': 2, 'approximate': True},
+                 'block_size and approximate were'),
+                ({'block_size': 2, 'approximate': True, 'sparse': True},
+                 'block_size and approximate and sparse were')):
+            with self.assertRaisesRegex(ValueError, message):
+                self.beta(table=self.t, metric='braycurtis', **kwargs)
+
+    def test_beta_approximate(self):
+        actual, = self.beta(table=self.t, metric='jaccard', approximate=True,
+                            sketch_size=64)
+        actual = actual.view(skbio.DistanceMatrix)
+        bound = _approximation_error('jaccard', 64)
+
+        self.assertEqual(actual.ids, ('S1', 'S2', 'S3'))
+        # S2 and S3 observe the same features, and S1 half of them
+        self.assertEqual(actual['S2', 'S3'], 0.0)
+        self.assertAlmostEqual(actual['S1', 'S2'], 0.5, delta=4 * bound)
+        self.assertEqual(actual['S1', 'S2'], actual['S1', 'S3'])
+
+    def test_beta_approximate_unsupported_metric(self):
+        with self.assertRaisesRegex(ValueError, 'Approximate.*braycurtis'):
+            self.beta(table=self.t, metric='canberra', approximate=True)
+
     def test_beta_phylo_metric(self):
         with self.assertRaisesRegex(TypeError,
                                     'received \'unweighted_unifrac\''):
@@ -373,6 +445,45 @@ class BetaDiversityTests(TestPluginBase):
                                    metric='unweighted_unifrac',
                                    alpha=0.5)
 
+    def test_beta_phylogenetic_multiple(self):
+        bt_fp = self.get_data_path('vaw.biom')
+        bt = Artifact.import_data('FeatureTable[Frequency]', bt_fp)
+        tree_fp = self.get_data_path('vaw.nwk')
+        tree = Artifact.import_data('Phylogeny[Rooted]', tree_fp)
+
+        actual = self.beta_phylogenetic_multiple(
+            table=bt, phylogeny=tree,
+            metrics={'generalized_unifrac', 'weighted_normalized_unifrac',
+                     'unweighted_unifrac'},
+            alphas=[0.5, 1.0])
+        actual = actual.distance_matrices
+
+        self.assertEqual(set(actual.keys()),
+                         {'generalized_unifrac_alpha-0.5',
+                          'generalized_unifrac_alpha-1.0',
+                          'weighted_normalized_unifrac',
+                          'unweighted_unifrac'})
+
+        for key, metric, alpha in (
+                ('generalized_unifrac_alpha-0.5', 'generalized_unifrac', 0.5),
+                ('unweighted_unifrac', 'unweighted_unifrac', None),
+                ('generalized_unifrac_alpha-1.0', 'generalized_unifrac', 1.0),
+                ('weighted_normalized_unifrac',
+                 'weighted_normalized_unifrac', None)):
+            expected, = self.beta_phylogenetic(table=bt, phylogeny=tree,
+                                               metric=metric, alpha=alpha)
+            expected = expected.view(skbio.DistanceMatrix)
+            observed = actual[key].view(skbio.DistanceMatrix)
+            self.assertEqual(observed.ids, expected.ids)
+            npt.assert_almost_equal(observed.data, expected.data)
+
+    def test_beta_phylogenetic_multiple_alphas_without_generalized(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "alphas.*only allowed.*generalized"):
+            self.beta_phylogenetic_multiple(
+                table=self.crawford_table, phylogeny=self.crawford_tree,
+                metrics={'unweighted_unifrac'}, alphas=[0.5])
+
     def test_beta_phylogenetic_too_many_jobs(self):
         with self.assertRaises(ValueError):
             # cannot guarantee that this will always be true, but it would be
@@ -382,6 +493,508 @@ class BetaDiversityTests(TestPluginBase):
                                    metric='unweighted_unifrac', threads=11117)
 
 
+class BetaPhylogeneticActionTests(unittest.TestCase):
+
+    def test_implemented_metrics(self):
+        for metric in ('unweighted_unifrac', 'weighted_unifrac'):
+            self.assertEqual(_beta_phylogenetic_action(metric), (metric, {}))
+
+    def test_variance_adjusted(self):
+        self.assertEqual(
+            _beta_phylogenetic_action('weighted_unifrac',
+                                      variance_adjusted=True),
+            ('beta_phylogenetic_passthrough',
+             {'metric': 'weighted_unifrac', 'variance_adjusted': True,
+              'alpha': None}))
+
+    def test_generalized_unifrac(self):
+        self.assertEqual(
+            _beta_phylogenetic_action('generalized_unifrac', alpha=0.5),
+            ('beta_phylogenetic_passthrough',
+             {'metric': 'generalized_unifrac', 'variance_adjusted': False,
+              'alpha': 0.5}))
+
+    def test_generalized_unifrac_no_alpha(self):
+        self.assertEqual(
+            _beta_phylogenetic_action('generalized_unifrac'),
+            ('beta_phylogenetic_passthrough',
+             {'metric': 'generalized_unifrac', 'variance_adjusted': False,
+              'alpha': None}))
+
+
+class BetaMultipleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.counts = np.array([[0, 3, 1, 9, 2, 4],
+                                [4, 0, 1, 1, 0, 7],
+                                [1, 8, 0, 6, 2, 3],
+                                [0, 2, 5, 0, 1, 1]])
+        self.ids = ['S1', 'S2', 'S3', 'S4', 'S5', 'S6']
+        self.table = Table(self.counts, ['O1', 'O2', 'O3', 'O4'], self.ids)
+
+    def assertDistanceMatrixEqual(self, observed, expected):
+        self.assertEqual(observed.ids, expected.ids)
+        npt.assert_allclose(observed.data, expected.data, atol=1e-12)
+
+    def test_beta_multiple(self):
+        metrics = {'braycurtis', 'jaccard', 'canberra', 'euclidean',
+                   'seuclidean'}
+
+        observed = beta_multiple(self.table, metrics, n_jobs=2)
+
+        self.assertEqual(set(observed), metrics)
+        for metric in metrics:
+            counts = self.counts.T
+            if metric == 'jaccard':
+                counts = counts > 0
+            self.assertDistanceMatrixEqual(
+                observed[metric],
+                skbio.diversity.beta_diversity(metric, counts, ids=self.ids,
+                                               validate=False))
+
+    def test_beta_multiple_passthrough_metrics(self):
+        def aitchison(x, y):
+            x, y = np.log(x + 2), np.log(y + 2)
+            return np.sqrt(((x - x.mean() - y + y.mean()) ** 2).sum())
+
+        def canberra_adkins(x, y):
+            nz = (x > 0) | (y > 0)
+            x, y = x[nz], y[nz]
+            return np.sum(np.abs(x - y) / (x + y)) / nz.sum()
+
+        observed = beta_multiple(
+            self.table, {'aitchison', 'canberra_adkins', 'jensenshannon'},
+            pseudocount=2)
+
+        for metric, func in (
+                ('aitchison', aitchison),
+                ('canberra_adkins', canberra_adkins),
+                ('jensenshannon', scipy.spatial.distance.jensenshannon)):
+            self.assertDistanceMatrixEqual(
+                observed[metric],
+                skbio.diversity.beta_diversity(func, self.counts.T,
+                                               ids=self.ids))
+
+    def test_beta_multiple_empty_table(self):
+        with self.assertRaisesRegex(ValueError, 'empty'):
+            beta_multiple(Table(np.array([]), [], []), {'braycurtis'})
+
+
+class BetaTiledTests(unittest.TestCase):
+
+    def setUp(self):
+        self.counts = np.array([[0, 3, 1, 9, 2, 4, 1],
+                                [4, 0, 1, 1, 0, 7, 2],
+                                [1, 8, 0, 6, 2, 3, 0],
+                                [0, 2, 5, 0, 1, 1, 3]])
+        self.ids = ['S1', 'S2', 'S3', 'S4', 'S5', 'S6', 'S7']
+        self.table = Table(self.counts, ['O1', 'O2', 'O3', 'O4'], self.ids)
+
+    def test_beta_tiled(self):
+        for metric in ('braycurtis', 'jaccard', 'aitchison',
+                       'jensenshannon'):
+            expected = beta_multiple(self.table, {metric})[metric]
+            for block_size in (1, 3, 7, 10):
+                result = beta_tiled(self.table, metric, n_jobs=2,
+                                    block_size=block_size)
+                observed = self._read(result)
+
+                self.assertEqual(observed.ids, expected.ids)
+                npt.assert_allclose(observed.data, expected.data,
+                                    atol=1e-12)
+
+    def _read(self, result):
+        with open(str(result.path / 'ids.txt')) as fh:
+            ids = [line.rstrip('\n') for line in fh]
+        distances = np.load(str(result.path / 'distances.npy'))
+        return skbio.DistanceMatrix(
+            scipy.spatial.distance.squareform(distances), ids)
+
+    def test_beta_tiled_empty_table(self):
+        with self.assertRaisesRegex(ValueError, 'empty'):
+            beta_tiled(Table(np.array([]), [], []), 'braycurtis')
+
+
+class BetaSparseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.counts = np.array([[0, 3, 0, 9, 0, 0, 1],
+                                [4, 0, 0, 1, 0, 7, 0],
+                                [0, 8, 0, 0, 2, 0, 0],
+                                [0, 2, 5, 0, 0, 1, 0],
+                                [0, 0, 0, 0, 0, 0, 0]])
+        self.ids = ['S1', 'S2', 'S3', 'S4', 'S5', 'S6', 'S7']
+        self.table = Table(self.counts, ['O1', 'O2', 'O3', 'O4', 'O5'],
+                           self.ids)
+
+    def test_beta_sparse(self):
+        for metric in ('braycurtis', 'jaccard'):
+            observed = beta_sparse(self.table, metric)
+            expected = beta_multiple(self.table, {metric})[metric]
+
+            self.assertEqual(observed.ids, expected.ids)
+            npt.assert_allclose(observed.data, expected.data, atol=1e-12)
+
+    def test_beta_sparse_chunked(self):
+        target = 'q2_diversity._beta._method._co_occurrences'
+        with mock.patch(target, wraps=_co_occurrences) as co_occurrences:
+            expected = beta_sparse(self.table, 'braycurtis')
+        n_unchunked = co_occurrences.call_count
+
+        with mock.patch(
+                'q2_diversity._beta._method._CO_OCCURRENCE_CHUNK_SIZE', 1), \
+                mock.patch(target, wraps=_co_occurrences) as co_occurrences:
+            observed = beta_sparse(self.table, 'braycurtis')
+
+        # the features of a row strip are split across several chunks
+        self.assertGreater(co_occurrences.call_count, n_unchunked)
+        npt.assert_allclose(observed.data, expected.data, atol=1e-12)
+
+    def test_beta_sparse_n_jobs(self):
+        for metric in ('braycurtis', 'jaccard'):
+            expected = beta_multiple(self.table, {metric})[metric]
+            # one sample per row strip
+            with mock.patch('q2_diversity._beta._method._TASK_SIZE', 1):
+                observed = beta_sparse(self.table, metric, n_jobs=2)
+
+            npt.assert_allclose(observed.data, expected.data, atol=1e-12)
+
+    def test_beta_sparse_relative_frequency(self):
+        table = self.table.norm(axis='sample', inplace=False)
+        observed = beta_sparse(table, 'braycurtis')
+        expected = scipy.spatial.distance.squareform(
+            scipy.spatial.distance.pdist(self.counts.T /
+                                         self.counts.sum(axis=0)[:, None],
+                                         metric='braycurtis'))
+
+        npt.assert_allclose(observed.data, expected, atol=1e-12)
+
+    def test_beta_sparse_unsupported_metric(self):
+        with self.assertRaisesRegex(ValueError, 'only supports'):
+            beta_sparse(self.table, 'canberra')
+
+    def test_beta_sparse_empty_table(self):
+        with self.assertRaisesRegex(ValueError, 'empty'):
+            beta_sparse(Table(np.array([]), [], []), 'jaccard')
+
+
+class BetaApproximateTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.counts = rng.poisson(0.5, (200, 12)) * rng.integers(1, 10,
+                                                                 (200, 12))
+        self.counts[:, 10] = 0
+        self.counts[:, 11] = self.counts[:, 9]
+        self.ids = ['S%d' % i for i in range(12)]
+        self.table = Table(self.counts, ['O%d' % i for i in range(200)],
+                           self.ids)
+
+    def test_beta_approximate(self):
+        for metric in ('jaccard', 'braycurtis'):
+            observed = beta_approximate(self.table, metric, sketch_size=512,
+                                        n_jobs=2)
+            expected = beta_sparse(self.table, metric)
+
+            self.assertEqual(observed.ids, expected.ids)
+            npt.assert_allclose(observed.data, expected.data,
+                                atol=4 * _approximation_error(metric, 512))
+            # identical samples have identical sketches
+            self.assertEqual(observed['S9', 'S11'], 0)
+            # a sample without counts shares nothing with the others
+            npt.assert_array_equal(
+                observed[self.ids.index('S10')],
+                [1] * 10 + [0, 1])
+
+    def test_beta_approximate_seed(self):
+        first = beta_approximate(self.table, 'braycurtis', sketch_size=32,
+                                 seed=1)
+        second = beta_approximate(self.table, 'braycurtis', sketch_size=32,
+                                  seed=1)
+
+        npt.assert_array_equal(first.data, second.data)
+
+    def test_approximation_error(self):
+        self.assertEqual(_approximation_error('jaccard', 100), 0.05)
+        self.assertEqual(_approximation_error('braycurtis', 100), 0.1)
+
+    def test_beta_approximate_unsupported_metric(self):
+        with self.assertRaisesRegex(ValueError, 'Approximate'):
+            beta_approximate(self.table, 'canberra')
+
+    def test_beta_approximate_empty_table(self):
+        with self.assertRaisesRegex(ValueError, 'empty'):
+            beta_approximate(Table(np.array([]), [], []), 'jaccard')
+
+
+class NearestNeighborsTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.counts = rng.poisson(2, (15, 9))
+        self.ids = ['S%d' % i for i in range(9)]
+        self.table = Table(self.counts, ['O%d' % i for i in range(15)],
+                           self.ids)
+
+    def test_nearest_neighbors(self):
+        for metric in ('braycurtis', 'aitchison', 'seuclidean'):
+            expected = beta_multiple(self.table, {metric})[metric].data
+            for block_size in (1, 2, 4, 9):
+                observed = nearest_neighbors(self.table, metric, k=3,
+                                             n_jobs=2, block_size=block_size)
+
+                self.assertEqual(list(observed.columns),
+                                 ['sample-id', 'neighbor-id', 'distance'])
+                self.assertEqual(list(observed['sample-id']),
+                                 [i for i in self.ids for _ in range(3)])
+                for i, sample_id in enumerate(self.ids):
+                    neighbors = observed[observed['sample-id'] == sample_id]
+                    positions = [self.ids.index(j)
+                                 for j in neighbors['neighbor-id']]
+                    self.assertNotIn(i, positions)
+                    npt.assert_allclose(neighbors['distance'],
+                                        expected[i, positions])
+                    others = np.delete(expected[i], [i] + positions)
+                    self.assertTrue(
+                        (neighbors['distance'].max() <= others).all())
+
+    def test_nearest_neighbors_ties(self):
+        # every sample is equally distant from the others, and the ones that
+        # come first are chosen regardless of the block size
+        table = Table(np.eye(4), ['O1', 'O2', 'O3', 'O4'],
+                      ['S1', 'S2', 'S3', 'S4'])
+        for block_size in (1, 3):
+            observed = nearest_neighbors(table, 'jaccard', k=2,
+                                         block_size=block_size)
+
+            self.assertEqual(list(observed['neighbor-id']),
+                             ['S2', 'S3', 'S1', 'S3', 'S1', 'S2', 'S1',
+                              'S2'])
+            npt.assert_array_equal(observed['distance'], np.ones(8))
+
+    def test_nearest_neighbors_too_many_neighbors(self):
+        with self.assertRaisesRegex(ValueError, 'neighbors.*9'):
+            nearest_neighbors(self.table, 'braycurtis', k=9)
+
+    def test_nearest_neighbors_empty_table(self):
+        with self.assertRaisesRegex(ValueError, 'empty'):
+            nearest_neighbors(Table(np.array([]), [], []), 'braycurtis')
+
+
+class BetaCrossTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.features = ['O%d' % i for i in range(1, 9)]
+        self.query_counts = rng.poisson(1, (6, 4)) + 1
+        self.reference_counts = rng.poisson(1, (8, 7))
+        self.reference_counts[0] += 1
+        # the query table doesn't observe the first two features
+        self.query_table = Table(self.query_counts, self.features[2:],
+                                 ['Q1', 'Q2', 'Q3', 'Q4'])
+        self.reference_table = Table(self.reference_counts, self.features,
+                                     ['R%d' % i for i in range(1, 8)])
+        self.tree = skbio.TreeNode.read(io.StringIO(
+            '(((O1:0.25,O2:0.5):0.25,O3:0.75):0.1,((O4:0.3,O5:0.2):0.6,'
+            '(O6:1.0,(O7:0.1,O8:0.4):0.2):0.3):0.5)root;'))
+
+    def test_beta_cross(self):
+        merged = self.query_table.merge(self.reference_table)
+        for metric in ('braycurtis', 'jaccard', 'aitchison', 'seuclidean'):
+            expected = beta_multiple(merged, {metric})[metric]
+            for block_size in (1, 3, 7):
+                observed = beta_cross(self.query_table, self.reference_table,
+                                      metric, n_jobs=2,
+                                      block_size=block_size)
+
+                self.assertEqual(list(observed.index),
+                                 ['Q1', 'Q2', 'Q3', 'Q4'])
+                self.assertEqual(list(observed.columns),
+                                 ['R%d' % i for i in range(1, 8)])
+                for query in observed.index:
+                    for reference in observed.columns:
+                        self.assertAlmostEqual(
+                            observed.loc[query, reference],
+                            expected[query, reference])
+
+    def test_beta_phylogenetic_cross(self):
+        queries = np.vstack([np.zeros((2, 4), dtype=int), self.query_counts])
+        for metric, func, kwargs in (
+                ('unweighted_unifrac',
+                 skbio.diversity.beta.unweighted_unifrac, {}),
+                ('weighted_unifrac',
+                 skbio.diversity.beta.weighted_unifrac, {}),
+                ('weighted_normalized_unifrac',
+                 skbio.diversity.beta.weighted_unifrac,
+                 {'normalized': True})):
+            for block_size in (1, 4, 7):
+                observed = beta_phylogenetic_cross(
+                    self.query_table, self.reference_table, self.tree, metric,
+                    n_jobs=2, block_size=block_size)
+
+                self.assertEqual(observed.shape, (4, 7))
+                for i in range(4):
+                    for j in range(7):
+                        expected = func(queries[:, i],
+                                        self.reference_counts[:, j],
+                                        self.features, self.tree, **kwargs)
+                        self.assertAlmostEqual(observed.iloc[i, j], expected)
+
+    def test_beta_phylogenetic_cross_unsupported_metric(self):
+        with self.assertRaisesRegex(ValueError, 'weighted_normalized_unifrac'):
+            beta_phylogenetic_cross(self.query_table, self.reference_table,
+                                    self.tree, 'generalized_unifrac')
+
+    def test_beta_phylogenetic_cross_missing_feature(self):
+        table = Table(np.array([[1, 2]]), ['O9'], ['Q1', 'Q2'])
+        with self.assertRaisesRegex(ValueError, 'not present.*O9'):
+            beta_phylogenetic_cross(table, self.reference_table, self.tree,
+                                    'unweighted_unifrac')
+
+    def test_beta_cross_empty_table(self):
+        empty = Table(np.array([]), [], [])
+        with self.assertRaisesRegex(ValueError, 'query table is empty'):
+            beta_cross(empty, self.reference_table, 'braycurtis')
+        with self.assertRaisesRegex(ValueError, 'reference table is empty'):
+            beta_cross(self.query_table, empty, 'braycurtis')
+
+
+class BetaShardTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.counts = rng.poisson(1, (8, 13))
+        self.counts[0] += 1
+        self.features = ['O%d' % i for i in range(1, 9)]
+        self.ids = ['S%d' % i for i in range(13)]
+        self.table = Table(self.counts, self.features, self.ids)
+        self.tree = skbio.TreeNode.read(io.StringIO(
+            '(((O1:0.25,O2:0.5):0.25,O3:0.75):0.1,((O4:0.3,O5:0.2):0.6,'
+            '(O6:1.0,(O7:0.1,O8:0.4):0.2):0.3):0.5)root;'))
+
+    def test_shard_rows(self):
+        for n_samples, n_shards in ((10, 3), (5, 5), (100, 7), (2, 1)):
+            rows = [_shard_rows(n_samples, shard, n_shards)
+                    for shard in range(n_shards)]
+
+            self.assertEqual(rows[0].start, 0)
+            self.assertEqual(rows[-1].stop, n_samples)
+            for previous, current in zip(rows, rows[1:]):
+                self.assertEqual(previous.stop, current.start)
+            self.assertTrue(all(r.stop > r.start for r in rows))
+
+        # about the same number of distances in every shard
+        sizes = [(r.stop - r.start) * (200 - r.start - r.stop + 1) / 2
+                 for r in (_shard_rows(100, shard, 7) for shard in range(7))]
+        self.assertLess(max(sizes) / min(sizes), 1.15)
+
+    def test_shard_rows_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'shard index'):
+            _shard_rows(10, 3, 3)
+        with self.assertRaisesRegex(ValueError, 'cannot exceed'):
+            _shard_rows(2, 0, 3)
+
+    def test_beta_shard(self):
+        for metric in ('braycurtis', 'seuclidean', 'aitchison'):
+            expected = beta_multiple(self.table, {metric})[metric]
+            for n_shards in (1, 3, 5):
+                blocks = {str(shard): beta_shard(self.table, metric, shard,
+                                                 n_shards, block_size=2)
+                          for shard in range(n_shards)}
+                observed = merge_distance_blocks(blocks, n_shards)
+
+                self.assertEqual(observed.ids, expected.ids)
+                npt.assert_allclose(observed.data, expected.data, atol=1e-12)
+
+    def test_beta_phylogenetic_shard(self):
+        for metric in ('unweighted_unifrac', 'weighted_normalized_unifrac'):
+            expected = beta_phylogenetic_cross(self.table, self.table,
+                                               self.tree, metric)
+            blocks = {str(shard): beta_phylogenetic_shard(
+                          self.table, self.tree, metric, shard, 4,
+                          block_size=3)
+                      for shard in range(4)}
+            observed = merge_distance_blocks(blocks, 4)
+
+            self.assertEqual(observed.ids, tuple(self.ids))
+            npt.assert_allclose(observed.data, expected.values, atol=1e-12)
+
+    def test_merge_distance_blocks_missing_shard(self):
+        blocks = {str(shard): beta_shard(self.table, 'braycurtis', shard, 3)
+                  for shard in range(3)}
+        del blocks['0']
+
+        with self.assertRaisesRegex(ValueError, '2 distance blocks.*3'):
+            merge_distance_blocks(blocks, 3)
+        with self.assertRaisesRegex(ValueError, 'same number of shards'):
+            merge_distance_blocks(blocks, 2)
+
+    def test_merge_distance_blocks_different_order(self):
+        blocks = {'0': beta_shard(self.table, 'braycurtis', 0, 2)}
+        table = self.table.sort_order(self.ids[::-1])
+        blocks['1'] = beta_shard(table, 'braycurtis', 1, 2)
+
+        with self.assertRaisesRegex(ValueError, 'same table'):
+            merge_distance_blocks(blocks, 2)
+
+
+class ExtendDistanceMatrixTests(unittest.TestCase):
+
+    def setUp(self):
+        self.counts = np.array([[0, 3, 1, 9, 2, 4],
+                                [4, 0, 1, 1, 0, 0],
+                                [1, 8, 0, 6, 2, 3],
+                                [0, 2, 5, 0, 1, 0]])
+        self.ids = ['S1', 'S2', 'S3', 'S4', 'S5', 'S6']
+        self.features = ['O1', 'O2', 'O3', 'O4']
+        # only the new samples observe O4, so it's not in the existing table
+        self.counts[3, :3] = 0
+        self.table = Table(self.counts[:3, :3], self.features[:3],
+                           self.ids[:3])
+        self.new_table = Table(self.counts[:, 3:], self.features,
+                               self.ids[3:])
+
+    def test_extend_distance_matrix(self):
+        for metric in ('jaccard', 'braycurtis'):
+            dm = skbio.diversity.beta_diversity(
+                metric, self.counts[:, :3].T, self.ids[:3])
+            expected = skbio.diversity.beta_diversity(
+                metric, self.counts.T, self.ids)
+
+            observed = extend_distance_matrix(dm, self.table,
+                                              self.new_table, metric)
+
+            self.assertEqual(observed.ids, expected.ids)
+            npt.assert_allclose(observed.data, expected.data)
+
+    def test_extend_distance_matrix_reordered_table(self):
+        dm = skbio.diversity.beta_diversity(
+            'braycurtis', self.counts[:, :3].T, self.ids[:3])
+        expected = skbio.diversity.beta_diversity(
+            'braycurtis', self.counts.T, self.ids)
+        table = self.table.sort_order(['S3', 'S1', 'S2'])
+
+        observed = extend_distance_matrix(dm, table, self.new_table,
+                                          'braycurtis')
+
+        npt.assert_allclose(observed.data, expected.data)
+
+    def test_extend_distance_matrix_overlapping_samples(self):
+        dm = skbio.diversity.beta_diversity(
+            'jaccard', self.counts[:, :3].T, self.ids[:3])
+        new_table = Table(self.counts[:, 2:], self.features, self.ids[2:])
+
+        with self.assertRaisesRegex(ValueError, 'already.*S3'):
+            extend_distance_matrix(dm, self.table, new_table, 'jaccard')
+
+    def test_extend_distance_matrix_mismatched_table(self):
+        dm = skbio.diversity.beta_diversity(
+            'jaccard', self.counts[:, :2].T, self.ids[:2])
+
+        with self.assertRaisesRegex(ValueError, 'samples in the table'):
+            extend_distance_matrix(dm, self.table, self.new_table, 'jaccard')
+
+
 class BioenvTests(TestPluginBase):
     package = 'q2_diversity.tests'
 
@@ -672,7 +1285,173 @@ class BetaGroupSignificanceTests(unittest.TestCase):
             index_fp = os.path.join(output_dir, 'index.html')
             self.assertTrue('<td>2</td>' in open(index_fp).read())
 
-    def test_get_distance_boxplot_data_two_groups(self):
+    def test_pairwise_n_jobs(self):
+        dm = skbio.DistanceMatrix(
+            scipy.spatial.distance.squareform(
+                scipy.spatial.distance.pdist(np.arange(12.)[:, None] ** 0.5)),
+            ids=['sample%d' % i for i in range(12)])
+        md = qiime2.CategoricalMetadataColumn(
+            pd.Series(list('abcabcabcabc'), name='abc',
+                      index=pd.Index(dm.ids, name='id')))
+
+        for method in ['permanova', 'anosim', 'permdisp']:
+            pairwise = []
+            for n_jobs in [1, 2, 1]:
+                np.random.seed(0)
+                with tempfile.TemporaryDirectory() as output_dir:
+                    beta_group_significance(output_dir, dm, md,
+                                            method=method, pairwise=True,
+                                            permutations=99, n_jobs=n_jobs)
+                    pairwise.append(pd.read_csv(os.path.join(
+                        output_dir, '%s-pairwise.csv' % method)))
+            self.assertEqual(len(pairwise[0]), 3)
+            pdt.assert_frame_equal(pairwise[0], pairwise[1])
+            pdt.assert_frame_equal(pairwise[0], pairwise[2])
+
+    def test_pairwise_seeds(self):
+        np.random.seed(0)
+        first = _pairwise_seeds(3)
+        second = _pairwise_seeds(3)
+        np.random.seed(0)
+
+        self.assertEqual(_pairwise_seeds(3), first)
+        self.assertEqual(len(set(first)), 3)
+        self.assertNotEqual(first, second)
+
+    def test_seeded_restores_random_state(self):
+        np.random.seed(0)
+        expected = np.random.random()
+        np.random.seed(0)
+        seeded = _seeded(42, np.random.random)
+
+        self.assertEqual(np.random.random(), expected)
+        self.assertEqual(_seeded(42, np.random.random), seeded)
+
+    def test_pairwise_permanova(self):
+        dm = skbio.DistanceMatrix(
+            scipy.spatial.distance.squareform(
+                scipy.spatial.distance.pdist(np.arange(12.)[:, None] ** 0.5)),
+            ids=['sample%d' % i for i in range(12)])
+        md = pd.Series(list('aaaabbbbcccd'), index=dm.ids, name='abcd')
+        groupings = collections.OrderedDict(
+            (group_id, list(group.index))
+            for group_id, group in md.groupby(md))
+        pairs = list(itertools.combinations(groupings, 2))
+
+        for permutations in [0, 99]:
+            obs = _pairwise_permanova(dm, pairs, groupings, permutations)
+            for (group1_id, group2_id), result in zip(pairs, obs):
+                ids = groupings[group1_id] + groupings[group2_id]
+                exp = skbio.stats.distance.permanova(
+                    dm.filter(ids), md[ids], permutations=0)
+                self.assertEqual(result['sample size'], len(ids))
+                self.assertEqual(result['number of permutations'],
+                                 permutations)
+                self.assertAlmostEqual(result['test statistic'],
+                                       exp['test statistic'])
+                if permutations == 0:
+                    self.assertTrue(np.isnan(result['p-value']))
+                else:
+                    self.assertTrue(0.01 <= result['p-value'] <= 1)
+        # a and c are far apart
+        self.assertLess(obs[pairs.index(('a', 'c'))]['p-value'], 0.05)
+
+    def test_pairwise_permanova_single_samples(self):
+        dm = skbio.DistanceMatrix([[0.00, 0.25, 0.25],
+                                   [0.25, 0.00, 0.00],
+                                   [0.25, 0.00, 0.00]],
+                                  ids=['sample1', 'sample2', 'sample3'])
+        groupings = collections.OrderedDict(
+            [('a', ['sample1']), ('b', ['sample2']), ('c', ['sample3'])])
+
+        with self.assertRaisesRegex(ValueError, "'a' and 'b'.*single"):
+            _pairwise_permanova(dm, [('a', 'b')], groupings, 99)
+
+    def test_raw_data(self):
+        dm = skbio.DistanceMatrix([[0.00, 0.25, 0.25],
+                                   [0.25, 0.00, 0.00],
+                                   [0.25, 0.00, 0.00]],
+                                  ids=['sample1', 'sample2', 'sample3'])
+        md = qiime2.CategoricalMetadataColumn(
+            pd.Series(['a', 'b', 'b'], name='a or b',
+                      index=pd.Index(['sample1', 'sample2', 'sample3'],
+                                     name='id')))
+        exp = pd.DataFrame(
+            [['sample1', 'sample2', 'a', 'b', 0.25],
+             ['sample1', 'sample3', 'a', 'b', 0.25],
+             ['sample3', 'sample2', 'b', 'b', 0.0],
+             ['sample2', 'sample1', 'b', 'a', 0.25],
+             ['sample3', 'sample1', 'b', 'a', 0.25]],
+            index=[0, 1, 0, 1, 2],
+            columns=['SubjectID1', 'SubjectID2', 'Group1', 'Group2',
+                     'Distance'])
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            beta_group_significance(output_dir, dm, md)
+            obs = pd.read_csv(os.path.join(output_dir, 'raw_data.tsv'),
+                              sep='\t', index_col=0)
+            pdt.assert_frame_equal(obs, exp, check_dtype=False)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            beta_group_significance(output_dir, dm, md,
+                                    compress_raw_data=True)
+            self.assertFalse(os.path.exists(
+                os.path.join(output_dir, 'raw_data.tsv')))
+            obs = pd.read_csv(os.path.join(output_dir, 'raw_data.tsv.gz'),
+                              sep='\t', index_col=0)
+            pdt.assert_frame_equal(obs, exp, check_dtype=False)
+            index_fp = os.path.join(output_dir, 'index.html')
+            self.assertTrue('raw_data.tsv.gz' in open(index_fp).read())
+
+    def test_raw_data_max_rows(self):
+        dm = skbio.DistanceMatrix([[0.00, 0.25, 0.25],
+                                   [0.25, 0.00, 0.00],
+                                   [0.25, 0.00, 0.00]],
+                                  ids=['sample1', 'sample2', 'sample3'])
+        md = qiime2.CategoricalMetadataColumn(
+            pd.Series(['a', 'b', 'b'], name='a or b',
+                      index=pd.Index(['sample1', 'sample2', 'sample3'],
+                                     name='id')))
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            beta_group_significance(output_dir, dm, md, max_raw_data_rows=3)
+            obs = pd.read_csv(os.path.join(output_dir, 'raw_data.tsv'),
+                              sep='\t', index_col=0)
+            self.assertEqual(list(obs.index), [0, 1, 0])
+            self.assertEqual(list(obs['SubjectID1']),
+                             ['sample1', 'sample1', 'sample3'])
+            index_fp = os.path.join(output_dir, 'index.html')
+            self.assertTrue('the first 3 of' in open(index_fp).read())
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            beta_group_significance(output_dir, dm, md, max_raw_data_rows=0)
+            self.assertEqual(glob.glob('%s/raw_data.tsv*' % output_dir), [])
+            index_fp = os.path.join(output_dir, 'index.html')
+            self.assertFalse('raw_data.tsv' in open(index_fp).read())
+
+    def test_pairs_summary_chunks(self):
+        dm = skbio.DistanceMatrix([[0.00, 0.12, 0.13, 0.14, 0.15],
+                                   [0.12, 0.00, 0.22, 0.23, 0.24],
+                                   [0.13, 0.22, 0.00, 0.31, 0.32],
+                                   [0.14, 0.23, 0.31, 0.00, 0.44],
+                                   [0.15, 0.24, 0.32, 0.44, 0.00]],
+                                  ids=['s1', 's2', 's3', 's4', 's5'])
+        groupings = collections.OrderedDict(
+            [('g1', ['s4', 's1', 's3']), ('g2', ['s2', 's5'])])
+        group_distances = _group_distances(dm, groupings)
+
+        for group_id in groupings:
+            exp = pd.concat(_pairs_summary_chunks(group_distances, group_id,
+                                                  groupings),
+                            ignore_index=True)
+            chunks = list(_pairs_summary_chunks(group_distances, group_id,
+                                                groupings, chunk_size=3))
+            self.assertTrue(len(chunks) > 1)
+            self.assertTrue(all(len(chunk) <= 3 for chunk in chunks))
+            obs = pd.concat(chunks, ignore_index=True)
+            pdt.assert_frame_equal(obs, exp)
+
+    def test_group_boxplot_data_two_groups(self):
         dm = skbio.DistanceMatrix([[0.00, 0.12, 0.13, 0.14, 0.15],
                                    [0.12, 0.00, 0.22, 0.23, 0.24],
                                    [0.13, 0.22, 0.00, 0.31, 0.32],
@@ -682,13 +1461,14 @@ class BetaGroupSignificanceTests(unittest.TestCase):
 
         groupings = collections.OrderedDict(
             [('g1', ['s1', 's2']), ('g2', ['s3', 's4', 's5'])])
-        obs = _get_distance_boxplot_data(dm, 'g1', groupings)
+        obs = _group_boxplot_data(_group_distances(dm, groupings), 'g1',
+                                  groupings)
         exp_data = [[0.12], [0.13, 0.14, 0.15, 0.22, 0.23, 0.24]]
         exp_labels = ['g1 (n=1)', 'g2 (n=6)']
         self.assertEqual(obs[0], exp_data)
         self.assertEqual(obs[1], exp_labels)
 
-    def test_get_distance_boxplot_data_within_always_first(self):
+    def test_group_boxplot_data_within_always_first(self):
         dm = skbio.DistanceMatrix([[0.00, 0.12, 0.13, 0.14, 0.15],
                                    [0.12, 0.00, 0.22, 0.23, 0.24],
                                    [0.13, 0.22, 0.00, 0.31, 0.32],
@@ -698,7 +1478,8 @@ class BetaGroupSignificanceTests(unittest.TestCase):
 
         groupings = collections.OrderedDict(
             [('g2', ['s3', 's4', 's5']), ('g1', ['s1', 's2'])])
-        obs = _get_distance_boxplot_data(dm, 'g1', groupings)
+        obs = _group_boxplot_data(_group_distances(dm, groupings), 'g1',
+                                  groupings)
         exp_data = [[0.12], [0.13, 0.14, 0.15, 0.22, 0.23, 0.24]]
         exp_labels = ['g1 (n=1)', 'g2 (n=6)']
         exp_summary = [('s2', 's1', 'g1', 'g1', 0.12),
@@ -710,9 +1491,10 @@ class BetaGroupSignificanceTests(unittest.TestCase):
                        ('s2', 's5', 'g1', 'g2', 0.23999999999999999)]
         self.assertEqual(obs[0], exp_data)
         self.assertEqual(obs[1], exp_labels)
-        self.assertEqual(obs[2], exp_summary)
+        self.assertEqual(self._pairs_summary(dm, 'g1', groupings),
+                         exp_summary)
 
-    def test_get_distance_boxplot_data_three_groups(self):
+    def test_group_boxplot_data_three_groups(self):
         dm = skbio.DistanceMatrix([[0.00, 0.12, 0.13, 0.14, 0.15],
                                    [0.12, 0.00, 0.22, 0.23, 0.24],
                                    [0.13, 0.22, 0.00, 0.31, 0.32],
@@ -722,13 +1504,14 @@ class BetaGroupSignificanceTests(unittest.TestCase):
 
         groupings = collections.OrderedDict(
             [('g1', ['s1', 's2']), ('g2', ['s3', 's5']), ('g3', ['s4'])])
-        obs = _get_distance_boxplot_data(dm, 'g1', groupings)
+        obs = _group_boxplot_data(_group_distances(dm, groupings), 'g1',
+                                  groupings)
         exp_data = [[0.12], [0.13, 0.15, 0.22, 0.24], [0.14, 0.23]]
         exp_labels = ['g1 (n=1)', 'g2 (n=4)', 'g3 (n=2)']
         self.assertEqual(obs[0], exp_data)
         self.assertEqual(obs[1], exp_labels)
 
-    def test_get_distance_boxplot_data_between_order_retained(self):
+    def test_group_boxplot_data_between_order_retained(self):
         dm = skbio.DistanceMatrix([[0.00, 0.12, 0.13, 0.14, 0.15],
                                    [0.12, 0.00, 0.22, 0.23, 0.24],
                                    [0.13, 0.22, 0.00, 0.31, 0.32],
@@ -738,12 +1521,41 @@ class BetaGroupSignificanceTests(unittest.TestCase):
 
         groupings = collections.OrderedDict(
             [('g1', ['s1', 's2']), ('g3', ['s4']), ('g2', ['s3', 's5'])])
-        obs = _get_distance_boxplot_data(dm, 'g1', groupings)
+        obs = _group_boxplot_data(_group_distances(dm, groupings), 'g1',
+                                  groupings)
         exp_data = [[0.12], [0.14, 0.23], [0.13, 0.15, 0.22, 0.24]]
         exp_labels = ['g1 (n=1)', 'g3 (n=2)', 'g2 (n=4)']
         self.assertEqual(obs[0], exp_data)
         self.assertEqual(obs[1], exp_labels)
 
+    def test_group_boxplot_data_unordered_groups(self):
+        dm = skbio.DistanceMatrix([[0.00, 0.12, 0.13, 0.14, 0.15],
+                                   [0.12, 0.00, 0.22, 0.23, 0.24],
+                                   [0.13, 0.22, 0.00, 0.31, 0.32],
+                                   [0.14, 0.23, 0.31, 0.00, 0.44],
+                                   [0.15, 0.24, 0.32, 0.44, 0.00]],
+                                  ids=['s1', 's2', 's3', 's4', 's5'])
+
+        # group members aren't in distance matrix order
+        groupings = collections.OrderedDict(
+            [('g1', ['s5', 's1', 's3']), ('g2', ['s4', 's2'])])
+        obs = _group_boxplot_data(_group_distances(dm, groupings), 'g2',
+                                  groupings)
+        self.assertEqual(obs[0], [[0.23], [0.44, 0.14, 0.31,
+                                           0.24, 0.12, 0.22]])
+        self.assertEqual(obs[1], ['g2 (n=1)', 'g1 (n=6)'])
+        self.assertEqual(
+            self._pairs_summary(dm, 'g2', groupings)[:3],
+            [('s2', 's4', 'g2', 'g2', 0.23),
+             ('s4', 's5', 'g2', 'g1', 0.44),
+             ('s4', 's1', 'g2', 'g1', 0.14)])
+
+    def _pairs_summary(self, dm, group_id, groupings):
+        chunks = _pairs_summary_chunks(_group_distances(dm, groupings),
+                                       group_id, groupings)
+        return [row for chunk in chunks
+                for row in chunk.itertuples(index=False, name=None)]
+
 
 class TestMantel(unittest.TestCase):
     def setUp(self):
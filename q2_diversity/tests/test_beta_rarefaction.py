@@ -7,6 +7,7 @@
 # ----------------------------------------------------------------------------
 
 import unittest
+from unittest import mock
 import functools
 import tempfile
 import os
@@ -23,7 +24,7 @@ from qiime2.plugin.testing import TestPluginBase
 from q2_diversity import beta_rarefaction
 from q2_diversity._beta._beta_rarefaction import (
     _get_multiple_rarefaction, _upgma, _cluster_samples, _add_support_count,
-    _jackknifed_emperor)
+    _jackknifed_emperor, _get_beta_func)
 
 
 class SharedSetup:
@@ -169,6 +170,28 @@ class BetaRarefactionTests(SharedSetup, TestPluginBase):
             beta_rarefaction(self.output_dir, table, 'braycurtis', 'upgma',
                              self.md, 2)
 
+    def test_beta_rarefaction_previous_iterations(self):
+        dm = skbio.DistanceMatrix([[0, 0.5, 0.25], [0.5, 0, 0.75],
+                                   [0.25, 0.75, 0]],
+                                  ids=['S1', 'S2', 'S3'])
+        previous = {'braycurtis_depth-2_iter-%d' % i: dm for i in (1, 2)}
+        beta_rarefaction(self.output_dir, self.table, 'braycurtis', 'upgma',
+                         self.md, 2, iterations=4,
+                         previous_iterations=previous)
+
+        self.assertBetaRarefactionValidity(
+            self.output_dir, 4, 'spearman', 'upgma')
+
+    def test_beta_rarefaction_previous_iterations_mismatched(self):
+        dm = skbio.DistanceMatrix([[0, 0.5, 0.25], [0.5, 0, 0.75],
+                                   [0.25, 0.75, 0]],
+                                  ids=['S1', 'S2', 'S3'])
+        with self.assertRaisesRegex(ValueError, 'jaccard_depth-2_iter-1'):
+            beta_rarefaction(self.output_dir, self.table, 'braycurtis',
+                             'upgma', self.md, 2,
+                             previous_iterations={
+                                 'jaccard_depth-2_iter-1': dm})
+
     def test_beta_rarefaction_missing_phylogeny(self):
         with self.assertRaisesRegex(ValueError, 'Phylogeny must be provided'):
             beta_rarefaction(self.output_dir, self.table,
@@ -215,6 +238,74 @@ class GetMultipleRarefactionTests(SharedSetup, TestPluginBase):
                 self.assertEqual(obs.shape, (3, 3))
                 self.assertEqual(set(obs.ids), set(['S1', 'S2', 'S3']))
 
+    def test_previous_iterations(self):
+        ctx = qiime2.sdk.Context()
+        table = qiime2.Artifact.import_data('FeatureTable[Frequency]',
+                                            self.table)
+        beta_func = ctx.get_action('diversity', 'beta')
+        rare_func = ctx.get_action('feature-table', 'rarefy')
+        previous = skbio.DistanceMatrix([[0, 42, 42], [42, 0, 42],
+                                         [42, 42, 0]],
+                                        ids=['S1', 'S2', 'S3'])
+
+        obs_dms = _get_multiple_rarefaction(
+            beta_func, rare_func, 'braycurtis', 3, table, 2,
+            {'braycurtis_depth-2_iter-2': previous})
+
+        self.assertEqual(len(obs_dms), 3)
+        self.assertIs(obs_dms[1], previous)
+        for obs in obs_dms[::2]:
+            self.assertEqual(obs.shape, (3, 3))
+            self.assertEqual(set(obs.ids), set(['S1', 'S2', 'S3']))
+            self.assertLessEqual(obs.data.max(), 1.0)
+
+
+class BetaRarefactionIterationsTests(TestPluginBase):
+    package = 'q2_diversity.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.beta_rarefaction_iterations = self.plugin.pipelines[
+            'beta_rarefaction_iterations']
+        table = Table(np.array([[0, 1, 3], [1, 1, 2], [2, 1, 0]]),
+                      ['O1', 'O2', 'O3'], ['S1', 'S2', 'S3'])
+        self.table = qiime2.Artifact.import_data('FeatureTable[Frequency]',
+                                                 table)
+
+    def test_previous_iterations(self):
+        first, = self.beta_rarefaction_iterations(
+            table=self.table, metric='braycurtis', sampling_depth=2,
+            iterations=2)
+
+        calls = []
+
+        def get_beta_func(ctx, metric, phylogeny):
+            beta_func = _get_beta_func(ctx, metric, phylogeny)
+
+            def counted_beta_func(**kwargs):
+                calls.append(kwargs)
+                return beta_func(**kwargs)
+            return counted_beta_func
+
+        with mock.patch('q2_diversity._beta._pipeline._get_beta_func',
+                        side_effect=get_beta_func):
+            second, = self.beta_rarefaction_iterations(
+                table=self.table, metric='braycurtis', sampling_depth=2,
+                iterations=4, previous_iterations=first)
+
+        self.assertEqual(set(first.keys()),
+                         {'braycurtis_depth-2_iter-%d' % i for i in (1, 2)})
+        self.assertEqual(set(second.keys()),
+                         {'braycurtis_depth-2_iter-%d' % i
+                          for i in (1, 2, 3, 4)})
+        # only the new iterations are computed, and the others are reused
+        self.assertEqual(len(calls), 2)
+        for key in first.keys():
+            observed = second[key].view(skbio.DistanceMatrix)
+            expected = first[key].view(skbio.DistanceMatrix)
+            self.assertEqual(observed.ids, expected.ids)
+            npt.assert_array_equal(observed.data, expected.data)
+
 
 class UPGMATests(unittest.TestCase):
     # The translation between skbio and scipy is a little spooky, so these
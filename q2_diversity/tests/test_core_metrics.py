@@ -7,17 +7,26 @@
 # ----------------------------------------------------------------------------
 
 import io
+import tracemalloc
 import unittest
+from unittest import mock
 
 import biom
 import skbio
 import numpy as np
+import numpy.testing as npt
 import pandas as pd
 import pandas.testing as pdt
+import scipy.sparse
 
 from qiime2.plugin.testing import TestPluginBase
+from qiime2.sdk.parallel_config import ParallelConfig
 from qiime2 import Artifact, Metadata
 
+from q2_diversity._core_metrics import (core_metrics,
+                                        core_metrics_multiple_depths,
+                                        _pcoa_dimensions, _sample_totals)
+
 
 class CoreMetricsTests(TestPluginBase):
     package = 'q2_diversity'
@@ -144,6 +153,132 @@ class CoreMetricsTests(TestPluginBase):
         pdt.assert_series_equal(results[1].view(pd.Series), obs_feat_exp)
         pdt.assert_series_equal(results[2].view(pd.Series), shannon_exp)
 
+    def test_core_metrics_parallel(self):
+        table = biom.Table(np.array([[150, 100, 100], [50, 100, 100]]),
+                           ['O1', 'O2'],
+                           ['S1', 'S2', 'S3'])
+        table = Artifact.import_data('FeatureTable[Frequency]', table)
+
+        metadata = Metadata(
+            pd.DataFrame({'foo': ['1', '2', '3']},
+                         index=pd.Index(['S1', 'S2', 'S3'], name='id')))
+
+        with ParallelConfig():
+            results = self.core_metrics.parallel(
+                table=table, sampling_depth=200, metadata=metadata,
+                n_jobs=2)._result()
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(repr(results.bray_curtis_distance_matrix.type),
+                         'DistanceMatrix')
+        self.assertEqual(repr(results.jaccard_emperor.type), 'Visualization')
+
+        obs_feat_exp = pd.Series({'S1': 2, 'S2': 2, 'S3': 2},
+                                 name='observed_features')
+        pdt.assert_series_equal(results[1].view(pd.Series), obs_feat_exp)
+
+    def test_core_metrics_pcoa_dimensions(self):
+        table = biom.Table(np.array([[150, 100, 100, 80],
+                                     [50, 100, 100, 120],
+                                     [0, 10, 20, 30]]),
+                           ['O1', 'O2', 'O3'],
+                           ['S1', 'S2', 'S3', 'S4'])
+        table = Artifact.import_data('FeatureTable[Frequency]', table)
+
+        metadata = Metadata(
+            pd.DataFrame({'foo': ['1', '2', '3', '4']},
+                         index=pd.Index(['S1', 'S2', 'S3', 'S4'], name='id')))
+
+        results = self.core_metrics(table=table, sampling_depth=200,
+                                    metadata=metadata, pcoa_dimensions=2)
+
+        for pcoa in (results.jaccard_pcoa_results,
+                     results.bray_curtis_pcoa_results):
+            self.assertEqual(
+                pcoa.view(skbio.OrdinationResults).samples.shape, (4, 2))
+
+    def test_core_metrics_pcoa_dimensions_large_table(self):
+        table = biom.Table(np.array([[150, 100, 100, 80],
+                                     [50, 100, 100, 120],
+                                     [0, 10, 20, 30]]),
+                           ['O1', 'O2', 'O3'],
+                           ['S1', 'S2', 'S3', 'S4'])
+        table = Artifact.import_data('FeatureTable[Frequency]', table)
+
+        metadata = Metadata(
+            pd.DataFrame({'foo': ['1', '2', '3', '4']},
+                         index=pd.Index(['S1', 'S2', 'S3', 'S4'], name='id')))
+
+        with mock.patch('q2_diversity._core_metrics._PCOA_AUTO_MAX_SAMPLES',
+                        3), \
+                mock.patch('q2_diversity._core_metrics._PCOA_AUTO_DIMENSIONS',
+                           2):
+            results = self.core_metrics(table=table, sampling_depth=200,
+                                        metadata=metadata)
+
+        self.assertEqual(
+            results.jaccard_pcoa_results.view(
+                skbio.OrdinationResults).samples.shape, (4, 2))
+
+    def _large_table(self):
+        n_features, n_samples = 2000, 6000
+        rng = np.random.default_rng(0)
+        data = scipy.sparse.random(n_features, n_samples, density=0.1,
+                                   random_state=rng, format='csr')
+        data.data = np.ceil(data.data * 100)
+        table = Artifact.import_data(
+            'FeatureTable[Frequency]',
+            biom.Table(data, ['O%d' % i for i in range(n_features)],
+                       ['S%d' % i for i in range(n_samples)]))
+        return data, table
+
+    def test_pcoa_dimensions_does_not_load_table(self):
+        data, table = self._large_table()
+
+        tracemalloc.start()
+        try:
+            dimensions = _pcoa_dimensions(table, None)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(dimensions, 10)
+        # the table's counts alone take ~10MB in memory
+        self.assertLess(peak, data.data.nbytes / 4)
+
+    def test_core_metrics_pipelines_do_not_load_table(self):
+        # Only the pipelines' own work is measured: the actions they call,
+        # which run in their own processes when executed in parallel, are
+        # stubbed out.
+        data, table = self._large_table()
+        ctx = mock.Mock(parallel=False)
+
+        def get_action(plugin, action):
+            n_outputs = 3 if action == 'core_alpha_metrics' else 1
+            return mock.Mock(
+                side_effect=lambda *args, **kwargs: (mock.Mock(),) * n_outputs)
+        ctx.get_action.side_effect = get_action
+
+        for pipeline, kwargs in (
+                (core_metrics, {'sampling_depth': 10, 'metadata': None}),
+                (core_metrics_multiple_depths,
+                 {'sampling_depths': [10, 20], 'with_pcoa': True})):
+            with self.subTest(pipeline.__name__):
+                # the sample totals are read a bounded slice at a time, here
+                # much smaller than the table
+                with mock.patch(
+                        'q2_diversity._core_metrics._TOTALS_BLOCK_SIZE',
+                        2 ** 14):
+                    tracemalloc.start()
+                    try:
+                        pipeline(ctx, table, **kwargs)
+                        _, peak = tracemalloc.get_traced_memory()
+                    finally:
+                        tracemalloc.stop()
+
+                # the table's counts alone take ~10MB in memory
+                self.assertLess(peak, data.data.nbytes / 4)
+
     def test_core_metrics_ignore_missing_samples_false(self):
         table = biom.Table(np.array([[150, 100, 100], [50, 100, 100]]),
                            ['O1', 'O2'],
@@ -223,5 +358,217 @@ class CoreMetricsTests(TestPluginBase):
         self.assertEqual(repr(results.jaccard_emperor.type), 'Visualization')
 
 
+class CoreMetricsSelectedTests(TestPluginBase):
+    package = 'q2_diversity'
+
+    def setUp(self):
+        super().setUp()
+        self.core_metrics_selected = self.plugin.pipelines[
+            'core_metrics_selected']
+
+        table = biom.Table(np.array([[0, 11, 11], [13, 11, 11]]),
+                           ['O1', 'O2'],
+                           ['S1', 'S2', 'S3'])
+        self.table = Artifact.import_data('FeatureTable[Frequency]', table)
+
+        tree = skbio.TreeNode.read(io.StringIO(
+            '((O1:0.25, O2:0.50):0.25, O3:0.75)root;'))
+        self.tree = Artifact.import_data('Phylogeny[Rooted]', tree)
+
+        self.metadata = Metadata(
+            pd.DataFrame({'foo': ['1', '2', '3']},
+                         index=pd.Index(['S1', 'S2', 'S3'], name='id')))
+
+    def test_core_metrics_selected_defaults(self):
+        results = self.core_metrics_selected(table=self.table,
+                                             sampling_depth=13,
+                                             phylogeny=self.tree,
+                                             metadata=self.metadata,
+                                             with_emperor=True)
+
+        self.assertEqual(
+            set(results.alpha_diversities.keys()),
+            {'observed_features', 'shannon', 'pielou_e', 'faith_pd'})
+        beta = {'jaccard', 'braycurtis', 'unweighted_unifrac',
+                'weighted_unifrac'}
+        self.assertEqual(set(results.distance_matrices.keys()), beta)
+        self.assertEqual(set(results.pcoa_results.keys()), beta)
+        self.assertEqual(set(results.emperor_plots.keys()), beta)
+
+        expected = pd.Series({'S1': 1, 'S2': 2, 'S3': 2},
+                             name='observed_features')
+        pdt.assert_series_equal(
+            results.alpha_diversities['observed_features'].view(pd.Series),
+            expected)
+
+    def test_core_metrics_selected_subset(self):
+        results = self.core_metrics_selected(
+            table=self.table, sampling_depth=13,
+            metrics={'shannon', 'braycurtis'}, with_emperor=False)
+
+        self.assertEqual(list(results.alpha_diversities.keys()), ['shannon'])
+        self.assertEqual(list(results.distance_matrices.keys()),
+                         ['braycurtis'])
+        self.assertEqual(list(results.pcoa_results.keys()), ['braycurtis'])
+        self.assertEqual(len(results.emperor_plots), 0)
+
+    def test_core_metrics_selected_without_pcoa(self):
+        results = self.core_metrics_selected(
+            table=self.table, sampling_depth=13, metrics={'jaccard'},
+            with_pcoa=False, with_emperor=False)
+
+        self.assertEqual(len(results.alpha_diversities), 0)
+        self.assertEqual(list(results.distance_matrices.keys()), ['jaccard'])
+        self.assertEqual(len(results.pcoa_results), 0)
+        self.assertEqual(len(results.emperor_plots), 0)
+
+    def test_core_metrics_selected_phylo_metric_without_phylogeny(self):
+        with self.assertRaisesRegex(ValueError, 'faith_pd.*phylogeny'):
+            self.core_metrics_selected(table=self.table, sampling_depth=13,
+                                       metrics={'faith_pd'},
+                                       with_emperor=False)
+
+    def test_core_metrics_selected_required_inputs_only(self):
+        results = self.core_metrics_selected(table=self.table,
+                                             sampling_depth=13)
+
+        self.assertEqual(set(results.distance_matrices.keys()),
+                         {'jaccard', 'braycurtis'})
+        self.assertEqual(set(results.pcoa_results.keys()),
+                         {'jaccard', 'braycurtis'})
+        self.assertEqual(len(results.emperor_plots), 0)
+
+    def test_core_metrics_selected_emperor_without_metadata(self):
+        with self.assertRaisesRegex(ValueError, 'Metadata must be provided'):
+            self.core_metrics_selected(table=self.table, sampling_depth=13,
+                                       with_emperor=True)
+
+    def test_core_metrics_selected_emperor_without_pcoa(self):
+        with self.assertRaisesRegex(ValueError, 'requires `with_pcoa`'):
+            self.core_metrics_selected(table=self.table, sampling_depth=13,
+                                       metadata=self.metadata,
+                                       with_pcoa=False, with_emperor=True)
+
+
+class CoreMetricsMultipleDepthsTests(TestPluginBase):
+    package = 'q2_diversity'
+
+    def setUp(self):
+        super().setUp()
+        self.core_metrics_multiple_depths = self.plugin.pipelines[
+            'core_metrics_multiple_depths']
+
+        table = biom.Table(np.array([[0, 11, 11, 4], [13, 11, 11, 4]]),
+                           ['O1', 'O2'],
+                           ['S1', 'S2', 'S3', 'S4'])
+        self.table = Artifact.import_data('FeatureTable[Frequency]', table)
+
+    def test_core_metrics_multiple_depths(self):
+        results = self.core_metrics_multiple_depths(
+            table=self.table, sampling_depths=[5, 13, 20],
+            metrics={'observed_features', 'braycurtis'}, with_pcoa=False,
+            with_emperor=False)
+
+        self.assertEqual(set(results.rarefied_tables.keys()),
+                         {'depth-5', 'depth-13', 'depth-20'})
+        self.assertEqual(set(results.alpha_diversities.keys()),
+                         {'observed_features_depth-5',
+                          'observed_features_depth-13',
+                          'observed_features_depth-20'})
+        self.assertEqual(set(results.distance_matrices.keys()),
+                         {'braycurtis_depth-5', 'braycurtis_depth-13',
+                          'braycurtis_depth-20'})
+
+        for depth, samples in ((20, ['S2', 'S3']),
+                               (13, ['S1', 'S2', 'S3']),
+                               (5, ['S1', 'S2', 'S3', 'S4'])):
+            rarefied = results.rarefied_tables['depth-%d' % depth].view(
+                biom.Table)
+            self.assertEqual(sorted(rarefied.ids()), samples)
+            npt.assert_array_equal(rarefied.sum(axis='sample'), depth)
+
+    def test_core_metrics_multiple_depths_required_inputs_only(self):
+        results = self.core_metrics_multiple_depths(
+            table=self.table, sampling_depths=[5, 13])
+
+        self.assertEqual(set(results.rarefied_tables.keys()),
+                         {'depth-5', 'depth-13'})
+        self.assertEqual(len(results.emperor_plots), 0)
+
+    def test_sample_totals(self):
+        table = biom.Table(np.array([[0, 11, 0, 4, 2], [13, 11, 0, 4, 0]]),
+                           ['O1', 'O2'], ['S1', 'S2', 'S3', 'S4', 'S5'])
+        table = Artifact.import_data('FeatureTable[Frequency]', table)
+
+        for block_size in (1, 3, 100):
+            with mock.patch('q2_diversity._core_metrics._TOTALS_BLOCK_SIZE',
+                            block_size):
+                npt.assert_array_equal(_sample_totals(table),
+                                       [13, 22, 0, 8, 2])
+
+    def test_core_metrics_multiple_depths_with_replacement(self):
+        results = self.core_metrics_multiple_depths(
+            table=self.table, sampling_depths=[13, 5],
+            metrics={'observed_features'}, with_replacement=True,
+            with_pcoa=False, with_emperor=False)
+
+        rarefied = results.rarefied_tables['depth-5'].view(biom.Table)
+        self.assertEqual(sorted(rarefied.ids()), ['S1', 'S2', 'S3', 'S4'])
+
+
+class CoreMetricsIncrementalTests(TestPluginBase):
+    package = 'q2_diversity'
+
+    def setUp(self):
+        super().setUp()
+        self.core_metrics = self.plugin.pipelines['core_metrics']
+        self.core_metrics_incremental = self.plugin.pipelines[
+            'core_metrics_incremental']
+
+        self.metadata = Metadata(
+            pd.DataFrame({'foo': ['1', '2', '3']},
+                         index=pd.Index(['S1', 'S2', 'S3'], name='id')))
+
+    def test_core_metrics_incremental(self):
+        table = biom.Table(np.array([[150, 100, 100], [50, 100, 100]]),
+                           ['O1', 'O2'],
+                           ['S1', 'S2', 'S3'])
+        table = Artifact.import_data('FeatureTable[Frequency]', table)
+        new_table = biom.Table(np.array([[200, 0], [0, 100], [0, 100]]),
+                               ['O1', 'O2', 'O3'],
+                               ['S4', 'S5'])
+        new_table = Artifact.import_data('FeatureTable[Frequency]',
+                                         new_table)
+        previous = self.core_metrics(table=table, sampling_depth=200,
+                                     metadata=self.metadata)
+
+        results = self.core_metrics_incremental(
+            table=new_table, rarefied_table=previous.rarefied_table,
+            jaccard_distance_matrix=previous.jaccard_distance_matrix,
+            bray_curtis_distance_matrix=previous.bray_curtis_distance_matrix,
+            bray_curtis_pcoa_results=previous.bray_curtis_pcoa_results,
+            sampling_depth=200)
+
+        ids = ['S1', 'S2', 'S3', 'S4', 'S5']
+        self.assertEqual(
+            sorted(results.rarefied_table.view(biom.Table).ids()), ids)
+
+        expected = skbio.DistanceMatrix(
+            [[0, 0.25, 0.25, 0.25, 0.75],
+             [0.25, 0, 0, 0.5, 0.5],
+             [0.25, 0, 0, 0.5, 0.5],
+             [0.25, 0.5, 0.5, 0, 1],
+             [0.75, 0.5, 0.5, 1, 0]], ids=ids)
+        observed = results.bray_curtis_distance_matrix.view(
+            skbio.DistanceMatrix)
+        self.assertEqual(observed.ids, expected.ids)
+        npt.assert_allclose(observed.data, expected.data)
+
+        self.assertEqual(list(results.pcoa_results.keys()), ['braycurtis'])
+        projected = results.pcoa_results['braycurtis'].view(
+            skbio.OrdinationResults)
+        self.assertEqual(list(projected.samples.index), ids)
+
+
 if __name__ == '__main__':
     unittest.main()
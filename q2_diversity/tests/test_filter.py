@@ -7,6 +7,7 @@
 # ----------------------------------------------------------------------------
 
 import unittest
+from unittest import mock
 
 import numpy as np
 import pandas as pd
@@ -15,6 +16,8 @@ import skbio
 
 from q2_diversity import filter_distance_matrix
 from q2_diversity import filter_alpha_diversity
+from q2_diversity import partition_distance_matrix
+from q2_diversity import filter_alpha_diversity_multiple
 
 
 class TestFilterDistanceMatrix(unittest.TestCase):
@@ -255,6 +258,86 @@ class TestFilterDistanceMatrix(unittest.TestCase):
                                    where,
                                    exclude_ids=True)
 
+    def test_order_preserved(self):
+        df = pd.DataFrame({'SampleType': ['gut', 'tongue', 'gut', 'gut']},
+                          index=pd.Index(['S1', 'S2', 'S3', 'S4'], name='id'))
+        metadata = qiime2.Metadata(df)
+
+        dm = skbio.DistanceMatrix([[0, 1, 2, 3],
+                                   [1, 0, 4, 5],
+                                   [2, 4, 0, 6],
+                                   [3, 5, 6, 0]],
+                                  ['S4', 'S2', 'S3', 'S1'])
+
+        filtered = filter_distance_matrix(dm, metadata,
+                                          "SampleType='gut'")
+
+        expected = skbio.DistanceMatrix([[0, 2, 3], [2, 0, 6], [3, 6, 0]],
+                                        ['S4', 'S3', 'S1'])
+        self.assertEqual(filtered, expected)
+
+    def test_no_filtering_returns_input(self):
+        df = pd.DataFrame({'SampleType': ['gut', 'tongue', 'gut']},
+                          index=pd.Index(['S1', 'S2', 'S3'], name='id'))
+        metadata = qiime2.Metadata(df)
+
+        dm = skbio.DistanceMatrix([[0, 1, 2], [1, 0, 3], [2, 3, 0]],
+                                  ['S3', 'S1', 'S2'])
+
+        filtered = filter_distance_matrix(dm, metadata)
+
+        self.assertIs(filtered, dm)
+
+
+class TestPartitionDistanceMatrix(unittest.TestCase):
+    def setUp(self):
+        self.dm = skbio.DistanceMatrix([[0, 1, 2, 3, 4],
+                                        [1, 0, 5, 6, 7],
+                                        [2, 5, 0, 8, 9],
+                                        [3, 6, 8, 0, 10],
+                                        [4, 7, 9, 10, 0]],
+                                       ['S5', 'S1', 'S4', 'S2', 'S3'])
+
+    def _column(self, values, ids):
+        return qiime2.CategoricalMetadataColumn(
+            pd.Series(values, index=pd.Index(ids, name='id'), name='site'))
+
+    def test_partition_distance_matrix(self):
+        column = self._column(['site10', 'site2', 'site2', 'site10', 'site1'],
+                              ['S1', 'S2', 'S3', 'S4', 'S5'])
+
+        observed = partition_distance_matrix(self.dm, column)
+
+        self.assertEqual(list(observed), ['site1', 'site2', 'site10'])
+        self.assertEqual(observed['site1'],
+                         skbio.DistanceMatrix([[0]], ['S5']))
+        self.assertEqual(observed['site2'],
+                         skbio.DistanceMatrix([[0, 10], [10, 0]],
+                                              ['S2', 'S3']))
+        self.assertEqual(observed['site10'],
+                         skbio.DistanceMatrix([[0, 5], [5, 0]],
+                                              ['S1', 'S4']))
+
+    def test_partition_distance_matrix_missing_samples(self):
+        # S4 and S5 are missing from the metadata or have no value, and S6
+        # isn't in the distance matrix
+        column = self._column(['gut', 'tongue', 'gut', np.nan, 'gut'],
+                              ['S1', 'S2', 'S3', 'S5', 'S6'])
+
+        observed = partition_distance_matrix(self.dm, column)
+
+        self.assertEqual(list(observed), ['gut', 'tongue'])
+        self.assertEqual(observed['gut'],
+                         skbio.DistanceMatrix([[0, 7], [7, 0]],
+                                              ['S1', 'S3']))
+        self.assertEqual(observed['tongue'],
+                         skbio.DistanceMatrix([[0]], ['S2']))
+
+    def test_partition_distance_matrix_no_overlap(self):
+        column = self._column(['gut'], ['S6'])
+        with self.assertRaisesRegex(ValueError, 'None of the samples'):
+            partition_distance_matrix(self.dm, column)
+
 
 class TestFilterAlphaDiversityArtifact(unittest.TestCase):
     def test_filter_alpha_diversity(self):
@@ -408,5 +491,58 @@ class TestFilterAlphaDiversityArtifact(unittest.TestCase):
         self.assertTrue(filtered.sort_values().equals(expected.sort_values()))
 
 
+class TestFilterAlphaDiversityMultiple(unittest.TestCase):
+    def setUp(self):
+        df = pd.DataFrame({'SampleType': ['gut', 'tongue', 'gut']},
+                          index=pd.Index(['S1', 'S2', 'S3'], name='id'))
+        self.metadata = qiime2.Metadata(df)
+        self.alpha_diversities = {
+            'shannon_entropy': pd.Series([1.0, 2.0, 3.0, 4.0],
+                                         index=['S1', 'S2', 'S3', 'S4'],
+                                         name='shannon_entropy'),
+            'observed_features': pd.Series([5, 6, 7],
+                                           index=['S3', 'S2', 'S1'],
+                                           name='observed_features')}
+
+    def test_filter_alpha_diversity_multiple(self):
+        with mock.patch.object(self.metadata, 'get_ids',
+                               wraps=self.metadata.get_ids) as get_ids:
+            filtered = filter_alpha_diversity_multiple(
+                self.alpha_diversities, self.metadata,
+                where="SampleType='gut'")
+        get_ids.assert_called_once_with(where="SampleType='gut'")
+
+        self.assertEqual(list(filtered),
+                         ['shannon_entropy', 'observed_features'])
+        pd.testing.assert_series_equal(
+            filtered['shannon_entropy'],
+            pd.Series([1.0, 3.0], index=['S1', 'S3'],
+                      name='shannon_entropy'))
+        pd.testing.assert_series_equal(
+            filtered['observed_features'],
+            pd.Series([5, 7], index=['S3', 'S1'], name='observed_features'))
+
+    def test_filter_alpha_diversity_multiple_exclude_ids(self):
+        self.alpha_diversities['observed_features'] = pd.Series(
+            [5, 6], index=['S4', 'S1'], name='observed_features')
+
+        filtered = filter_alpha_diversity_multiple(
+            self.alpha_diversities, self.metadata, exclude_ids=True)
+
+        pd.testing.assert_series_equal(
+            filtered['shannon_entropy'],
+            pd.Series([4.0], index=['S4'], name='shannon_entropy'))
+        pd.testing.assert_series_equal(
+            filtered['observed_features'],
+            pd.Series([5], index=['S4'], name='observed_features'))
+
+    def test_filter_alpha_diversity_multiple_all_filtered(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "All samples.*'observed_features'"):
+            filter_alpha_diversity_multiple(self.alpha_diversities,
+                                            self.metadata,
+                                            exclude_ids=True)
+
+
 if __name__ == "__main__":
     unittest.main()
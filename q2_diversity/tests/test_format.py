@@ -0,0 +1,201 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import skbio
+from qiime2.plugin import ValidationError
+from qiime2.plugin.testing import TestPluginBase
+from q2_types.distance_matrix import DistanceMatrixDirectoryFormat
+
+from q2_diversity._type import NeighborGraph, DistanceBlock
+from q2_diversity._format import (NeighborGraphFormat,
+                                  NeighborGraphDirectoryFormat,
+                                  DistanceBlockFormat,
+                                  DistanceBlockDirectoryFormat,
+                                  CondensedDistanceMatrixDirectoryFormat)
+
+
+class NeighborGraphFormatTests(TestPluginBase):
+    package = 'q2_diversity.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.graph = pd.DataFrame({
+            'sample-id': ['S1', 'S1', 'S2', 'S2', 'S3', 'S3'],
+            'neighbor-id': ['S2', 'S3', 'S1', 'S3', 'S2', 'S1'],
+            'distance': [0.25, 0.5, 0.25, 0.125, 0.125, 0.5]})
+
+    def _write(self, contents):
+        path = os.path.join(self.temp_dir.name, 'neighbor-graph.tsv')
+        with open(path, 'w') as fh:
+            fh.write(contents)
+        return path
+
+    def test_semantic_type_registration(self):
+        self.assertRegisteredSemanticType(NeighborGraph)
+        self.assertSemanticTypeRegisteredToFormat(
+            NeighborGraph, NeighborGraphDirectoryFormat)
+
+    def test_neighbor_graph_format(self):
+        path = self._write('sample-id\tneighbor-id\tdistance\n'
+                           'S1\tS2\t0.25\nS2\tS1\t0.25\n')
+        NeighborGraphFormat(path, mode='r').validate()
+
+    def test_neighbor_graph_format_bad_header(self):
+        path = self._write('id\tneighbor\tdistance\nS1\tS2\t0.25\n')
+        with self.assertRaisesRegex(ValidationError, 'header'):
+            NeighborGraphFormat(path, mode='r').validate()
+
+    def test_neighbor_graph_format_missing_field(self):
+        path = self._write('sample-id\tneighbor-id\tdistance\nS1\t0.25\n')
+        with self.assertRaisesRegex(ValidationError, 'Line 2 has 2 fields'):
+            NeighborGraphFormat(path, mode='r').validate()
+
+    def test_neighbor_graph_format_bad_distance(self):
+        path = self._write('sample-id\tneighbor-id\tdistance\nS1\tS2\tfar\n')
+        with self.assertRaisesRegex(ValidationError, 'not a number'):
+            NeighborGraphFormat(path, mode='r').validate()
+
+    def test_neighbor_graph_transformers(self):
+        transformer = self.get_transformer(pd.DataFrame, NeighborGraphFormat)
+        ff = transformer(self.graph)
+        ff.validate()
+
+        transformer = self.get_transformer(NeighborGraphFormat, pd.DataFrame)
+        pdt.assert_frame_equal(transformer(ff), self.graph)
+
+    def test_neighbor_graph_numeric_ids(self):
+        path = self._write('sample-id\tneighbor-id\tdistance\n1\t2\t0.5\n')
+        transformer = self.get_transformer(NeighborGraphFormat, pd.DataFrame)
+        observed = transformer(NeighborGraphFormat(path, mode='r'))
+
+        self.assertEqual(list(observed['sample-id']), ['1'])
+        self.assertEqual(list(observed['neighbor-id']), ['2'])
+
+
+class DistanceBlockFormatTests(TestPluginBase):
+    package = 'q2_diversity.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.block = pd.DataFrame([[0.25, 0.5, 1.0], [0.125, 0.0, 0.75]],
+                                  index=['Q1', 'Q2'],
+                                  columns=['R1', 'R2', 'R3'])
+
+    def _write(self, contents):
+        path = os.path.join(self.temp_dir.name, 'distance-block.tsv')
+        with open(path, 'w') as fh:
+            fh.write(contents)
+        return path
+
+    def test_semantic_type_registration(self):
+        self.assertRegisteredSemanticType(DistanceBlock)
+        self.assertSemanticTypeRegisteredToFormat(
+            DistanceBlock, DistanceBlockDirectoryFormat)
+
+    def test_distance_block_format(self):
+        path = self._write('\tR1\tR2\nQ1\t0.25\t0.5\n')
+        DistanceBlockFormat(path, mode='r').validate()
+
+    def test_distance_block_format_bad_header(self):
+        path = self._write('id\tR1\tR2\nQ1\t0.25\t0.5\n')
+        with self.assertRaisesRegex(ValidationError, 'header must be empty'):
+            DistanceBlockFormat(path, mode='r').validate()
+
+    def test_distance_block_format_missing_field(self):
+        path = self._write('\tR1\tR2\nQ1\t0.25\n')
+        with self.assertRaisesRegex(ValidationError, 'Line 2 has 2 fields'):
+            DistanceBlockFormat(path, mode='r').validate()
+
+    def test_distance_block_format_bad_distance(self):
+        path = self._write('\tR1\tR2\nQ1\t0.25\tfar\n')
+        with self.assertRaisesRegex(ValidationError, 'not a number'):
+            DistanceBlockFormat(path, mode='r').validate()
+
+    def test_distance_block_transformers(self):
+        transformer = self.get_transformer(pd.DataFrame, DistanceBlockFormat)
+        ff = transformer(self.block)
+        ff.validate()
+
+        transformer = self.get_transformer(DistanceBlockFormat, pd.DataFrame)
+        pdt.assert_frame_equal(transformer(ff), self.block)
+
+    def test_distance_block_numeric_ids(self):
+        path = self._write('\t1\t002\n3\t0.25\t0.5\n')
+        transformer = self.get_transformer(DistanceBlockFormat, pd.DataFrame)
+        observed = transformer(DistanceBlockFormat(path, mode='r'))
+
+        self.assertEqual(list(observed.index), ['3'])
+        self.assertEqual(list(observed.columns), ['1', '002'])
+
+
+class CondensedDistanceMatrixFormatTests(TestPluginBase):
+    package = 'q2_diversity.tests'
+
+    def setUp(self):
+        super().setUp()
+        self.dm = skbio.DistanceMatrix([[0.0, 0.25, 0.5, 0.1],
+                                        [0.25, 0.0, 0.125, 0.3],
+                                        [0.5, 0.125, 0.0, 0.7],
+                                        [0.1, 0.3, 0.7, 0.0]],
+                                       ids=['S1', 'S2', 'S3', '004'])
+
+    def _write(self, ids, distances):
+        path = os.path.join(self.temp_dir.name, 'condensed')
+        os.mkdir(path)
+        with open(os.path.join(path, 'ids.txt'), 'w') as fh:
+            fh.write(''.join('%s\n' % id_ for id_ in ids))
+        np.save(os.path.join(path, 'distances.npy'), distances)
+        return path
+
+    def test_condensed_distance_matrix_format(self):
+        path = self._write(self.dm.ids, self.dm.condensed_form())
+        CondensedDistanceMatrixDirectoryFormat(path, mode='r').validate()
+
+    def test_condensed_distance_matrix_format_float32(self):
+        path = self._write(self.dm.ids,
+                           self.dm.condensed_form().astype(np.float32))
+        with self.assertRaisesRegex(ValidationError, 'double precision'):
+            CondensedDistanceMatrixDirectoryFormat(path, mode='r').validate()
+
+    def test_condensed_distance_matrix_format_wrong_size(self):
+        path = self._write(self.dm.ids, self.dm.condensed_form()[:-1])
+        with self.assertRaisesRegex(ValidationError, '4 samples have 6'):
+            CondensedDistanceMatrixDirectoryFormat(path, mode='r').validate()
+
+    def test_condensed_distance_matrix_format_not_condensed(self):
+        path = self._write(self.dm.ids, self.dm.data)
+        with self.assertRaisesRegex(ValidationError, 'one-dimensional'):
+            CondensedDistanceMatrixDirectoryFormat(path, mode='r').validate()
+
+    def test_condensed_distance_matrix_to_lsmat(self):
+        path = self._write(self.dm.ids, self.dm.condensed_form())
+        transformer = self.get_transformer(
+            CondensedDistanceMatrixDirectoryFormat,
+            DistanceMatrixDirectoryFormat)
+        lsmat = transformer(CondensedDistanceMatrixDirectoryFormat(path,
+                                                                   mode='r'))
+        lsmat.validate()
+        self.assertEqual(skbio.DistanceMatrix.read(
+            str(lsmat.path / 'distance-matrix.tsv')), self.dm)
+
+    def test_condensed_distance_matrix_to_lsmat_in_blocks(self):
+        path = self._write(self.dm.ids, self.dm.condensed_form())
+        transformer = self.get_transformer(
+            CondensedDistanceMatrixDirectoryFormat,
+            DistanceMatrixDirectoryFormat)
+        with mock.patch('q2_diversity._transformer._LSMAT_BLOCK_SIZE', 5):
+            lsmat = transformer(
+                CondensedDistanceMatrixDirectoryFormat(path, mode='r'))
+        self.assertEqual(skbio.DistanceMatrix.read(
+            str(lsmat.path / 'distance-matrix.tsv')), self.dm)
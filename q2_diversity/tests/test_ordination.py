@@ -6,14 +6,17 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import tracemalloc
 import unittest
 
 import skbio
 from skbio.util import assert_ordination_results_equal
 import pandas as pd
 import numpy as np
+import numpy.testing as npt
 
-from q2_diversity import pcoa, pcoa_biplot, tsne, umap
+from q2_diversity import pcoa, pcoa_biplot, pcoa_project, tsne, umap
+from q2_diversity._ordination import _neighbor_graph
 
 
 class PCoATests(unittest.TestCase):
@@ -42,6 +45,53 @@ class PCoATests(unittest.TestCase):
                                         ignore_directionality=True,
                                         ignore_method_names=True)
 
+    def test_pcoa_fsvd_peak_memory(self):
+        n = 1000
+        rng = np.random.default_rng(0)
+        points = rng.random((n, 20))
+        dm = skbio.DistanceMatrix(
+            np.sqrt(((points[:, None] - points[None, :]) ** 2).sum(axis=2)),
+            ids=[str(i) for i in range(n)])
+
+        tracemalloc.start()
+        try:
+            result = pcoa(dm, number_of_dimensions=3)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(result.samples.shape, (n, 3))
+        # the truncated solver only needs the centered copy of the distance
+        # matrix, not the n x n eigenvectors of a full decomposition
+        self.assertLess(peak, 2.5 * dm.data.nbytes)
+
+    def test_pcoa_project(self):
+        # a sample identical to an ordinated one is projected onto the same
+        # coordinates
+        dm = skbio.DistanceMatrix(
+            [[0.0000000, 0.3333333, 0.6666667, 0.3333333],
+             [0.3333333, 0.0000000, 0.4285714, 0.0000000],
+             [0.6666667, 0.4285714, 0.0000000, 0.4285714],
+             [0.3333333, 0.0000000, 0.4285714, 0.0000000]],
+            ids=['S1', 'S2', 'S3', 'S4'])
+
+        observed = pcoa_project(self.ordination, dm)
+
+        self.assertEqual(list(observed.samples.index),
+                         ['S1', 'S2', 'S3', 'S4'])
+        pd.testing.assert_frame_equal(observed.samples.loc[['S1', 'S2', 'S3']],
+                                      self.ordination.samples)
+        np.testing.assert_allclose(observed.samples.loc['S4'].values,
+                                   self.ordination.samples.loc['S2'].values,
+                                   atol=1e-7)
+        pd.testing.assert_series_equal(observed.eigvals,
+                                       self.ordination.eigvals)
+
+    def test_pcoa_project_missing_ordinated_sample(self):
+        dm = self.dm.filter(['S1', 'S2'])
+        with self.assertRaisesRegex(ValueError, 'Missing: S3'):
+            pcoa_project(self.ordination, dm)
+
     def test_pcoa_biplot(self):
         features = pd.DataFrame([[1, 0], [3, 0.1], [8, -0.4]],
                                 index=['S1', 'S2', 'S3'],
@@ -87,3 +137,69 @@ class umapTests(unittest.TestCase):
     def test_umap_custom(self):
         observed_second = umap(self.dm, 3).samples.shape
         self.assertEqual(observed_second, (5, 3))
+
+
+class NeighborGraphTests(unittest.TestCase):
+
+    def setUp(self):
+        ids = ['S%d' % i for i in range(12)]
+        rng = np.random.default_rng(0)
+        points = rng.random((12, 2))
+        dm = skbio.DistanceMatrix.from_iterable(
+            points, lambda x, y: np.linalg.norm(x - y), keys=ids)
+        rows = []
+        for i, sample_id in enumerate(ids):
+            order = [j for j in np.argsort(dm.data[i]) if j != i][:10]
+            rows.extend((sample_id, ids[j], dm.data[i, j]) for j in order)
+        self.graph = pd.DataFrame(
+            rows, columns=['sample-id', 'neighbor-id', 'distance'])
+        self.dm = dm
+
+    def test_neighbor_graph(self):
+        graph = self.graph.sample(frac=1, random_state=0)
+        ids, neighbors, distances = _neighbor_graph(graph)
+
+        self.assertEqual(set(ids), set(self.dm.ids))
+        self.assertEqual(neighbors.shape, (12, 10))
+        for i, sample_id in enumerate(ids):
+            expected = self.graph[self.graph['sample-id'] == sample_id]
+            self.assertEqual(sorted(ids[neighbors[i]]),
+                             sorted(expected['neighbor-id']))
+            npt.assert_allclose(
+                distances[i],
+                [self.dm[sample_id, ids[j]] for j in neighbors[i]])
+
+    def test_neighbor_graph_unknown_neighbor(self):
+        graph = self.graph.copy()
+        graph.loc[0, 'neighbor-id'] = 'not-a-sample'
+        with self.assertRaisesRegex(ValueError, 'neighbor.*sample'):
+            _neighbor_graph(graph)
+
+    def test_neighbor_graph_uneven_neighbors(self):
+        with self.assertRaisesRegex(ValueError, 'same number'):
+            _neighbor_graph(self.graph.iloc[1:])
+
+    def test_tsne_neighbor_graph(self):
+        observed = tsne(neighbor_graph=self.graph, perplexity=3,
+                        random_state=0)
+
+        self.assertEqual(observed.samples.shape, (12, 3))
+        self.assertEqual(set(observed.samples.index), set(self.dm.ids))
+
+    def test_umap_neighbor_graph(self):
+        observed = umap(neighbor_graph=self.graph, n_neighbors=5,
+                        random_state=0)
+
+        self.assertEqual(observed.samples.shape, (12, 3))
+        self.assertEqual(set(observed.samples.index), set(self.dm.ids))
+
+    def test_umap_neighbor_graph_too_many_neighbors(self):
+        with self.assertRaisesRegex(ValueError, 'n_neighbors.*11'):
+            umap(neighbor_graph=self.graph, n_neighbors=12)
+
+    def test_distance_matrix_and_neighbor_graph(self):
+        for func in (tsne, umap):
+            with self.assertRaisesRegex(ValueError, 'Exactly one'):
+                func(self.dm, neighbor_graph=self.graph)
+            with self.assertRaisesRegex(ValueError, 'Exactly one'):
+                func()